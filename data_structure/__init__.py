@@ -1,3 +1,3 @@
 from .exceptions import *
-from .naryrangetree import NaryRangeTree, NaryRangeTreeNode
+from .naryrangetree import NaryRangeTree, NaryRangeTreeEvent, NaryRangeTreeNode
 from .skillunit import *
\ No newline at end of file
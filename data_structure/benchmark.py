@@ -0,0 +1,210 @@
+import contextlib
+import io
+import pickle
+import random
+import time
+import tracemalloc
+import uuid
+
+# This allows for the benchmark to be run from the repository root or from this folder
+try:
+    from data_structure.naryrangetree import NaryRangeTree
+    from data_structure.skillunit import ActionUnit, SkillUnit
+except ImportError:
+    from naryrangetree import NaryRangeTree
+    from skillunit import ActionUnit, SkillUnit
+
+SIBLING_COUNTS = [1_000, 10_000, 100_000, 200_000]
+SAMPLE_INSERTS = 1_000
+MEMORY_NODE_COUNTS = [10_000, 100_000]
+FRAMES_PER_SKILL = 100
+SCALING_NODE_COUNTS = [1_000, 10_000, 100_000, 1_000_000]
+SCALING_SAMPLE = 1_000
+CHAIN_DEPTH = 100
+
+def per_frame_intervals(num_frames, shuffle=False, seed=0):
+    # One-frame ranges, as produced by "Fill Quick Action"
+    frames = list(range(num_frames))
+    if shuffle:
+        random.Random(seed).shuffle(frames)
+    return [(f"frame_{f}", f, f + 1) for f in frames]
+
+def marginal_insert_cost(num_siblings, shuffle=False, nested=False):
+    """Average seconds per insert once the tree already holds num_siblings siblings."""
+    tree = NaryRangeTree()
+    if nested:
+        # The siblings live under a single skill instead of directly under the root
+        tree.insert("parent", 0, num_siblings + SAMPLE_INSERTS)
+    intervals = per_frame_intervals(num_siblings + SAMPLE_INSERTS, shuffle)
+    for value, range_start, range_end in intervals[:num_siblings]:
+        tree.insert(value, range_start, range_end)
+
+    samples = intervals[num_siblings:]
+    start_time = time.perf_counter()
+    for value, range_start, range_end in samples:
+        tree.insert(value, range_start, range_end)
+    return (time.perf_counter() - start_time) / len(samples)
+
+def run_insert_benchmark(sibling_counts=SIBLING_COUNTS):
+    print(f"{'siblings':>10} {'in order (us)':>15} {'shuffled (us)':>15} {'nested (us)':>15}")
+    for num_siblings in sibling_counts:
+        in_order = marginal_insert_cost(num_siblings)
+        shuffled = marginal_insert_cost(num_siblings, shuffle=True)
+        nested = marginal_insert_cost(num_siblings, nested=True)
+        print(f"{num_siblings:>10} {in_order*1e6:>15.2f} {shuffled*1e6:>15.2f} {nested*1e6:>15.2f}")
+
+def snapshot_edit_cost(num_siblings):
+    """Average seconds per snapshot followed by one insert, as every undoable edit does, among num_siblings siblings."""
+    intervals = per_frame_intervals(num_siblings + SAMPLE_INSERTS, shuffle=True)
+    tree = NaryRangeTree.from_intervals(intervals[:num_siblings])
+    snapshots = []
+
+    start_time = time.perf_counter()
+    for value, range_start, range_end in intervals[num_siblings:]:
+        snapshots.append(tree.snapshot())
+        tree.insert(value, range_start, range_end)
+    return (time.perf_counter() - start_time) / SAMPLE_INSERTS
+
+def run_snapshot_benchmark(sibling_counts=SIBLING_COUNTS):
+    print(f"{'siblings':>10} {'snapshot + insert (us)':>23}")
+    for num_siblings in sibling_counts:
+        print(f"{num_siblings:>10} {snapshot_edit_cost(num_siblings)*1e6:>23.2f}")
+
+def annotation_intervals(num_nodes):
+    # A skill every FRAMES_PER_SKILL frames, filled with one action per frame
+    intervals = []
+    # ActionUnit prints every unit it creates
+    with contextlib.redirect_stdout(io.StringIO()):
+        for skill_start in range(0, num_nodes, FRAMES_PER_SKILL):
+            skill_end = skill_start + FRAMES_PER_SKILL - 1
+            intervals.append((SkillUnit(uuid.uuid4(), f"skill_{skill_start % 7}", skill_start, skill_end), skill_start, skill_end))
+            for frame in range(skill_start, skill_end):
+                intervals.append((ActionUnit(uuid.uuid4(), f"action_{frame % 5}", frame, frame + 1), frame, frame + 1))
+    return intervals[:num_nodes]
+
+def node_memory(num_nodes):
+    """Bytes per annotation held in memory (units and tree nodes) and in skilltree.pkl."""
+    tracemalloc.start()
+    intervals = annotation_intervals(num_nodes)
+    tree = NaryRangeTree.from_intervals(intervals)
+    del intervals
+    in_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    start_time = time.perf_counter()
+    pickled = pickle.dumps(tree)
+    dump_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    pickle.loads(pickled)
+    load_time = time.perf_counter() - start_time
+    return in_memory / num_nodes, len(pickled) / num_nodes, dump_time, load_time
+
+def run_memory_benchmark(node_counts=MEMORY_NODE_COUNTS):
+    print(f"{'nodes':>10} {'memory (B/node)':>16} {'pickle (B/node)':>16} {'dump (s)':>10} {'load (s)':>10}")
+    for num_nodes in node_counts:
+        in_memory, pickled, dump_time, load_time = node_memory(num_nodes)
+        print(f"{num_nodes:>10} {in_memory:>16.0f} {pickled:>16.0f} {dump_time:>10.3f} {load_time:>10.3f}")
+
+def _unit(value_type, name, range_start, range_end):
+    unit_class = ActionUnit if value_type == "action" else SkillUnit
+    return (unit_class(uuid.uuid4(), name, range_start, range_end), range_start, range_end)
+
+def flat_intervals(num_nodes, seed=0):
+    # One action per frame directly under the root
+    return [_unit("action", f"action_{frame % 5}", frame, frame + 1) for frame in range(num_nodes)]
+
+def deep_intervals(num_nodes, seed=0):
+    # Chains of CHAIN_DEPTH skills nested inside each other, each ending in an action, side by side
+    intervals = []
+    chain_start = 0
+    while len(intervals) < num_nodes:
+        for depth in range(CHAIN_DEPTH):
+            value_type = "action" if depth == CHAIN_DEPTH - 1 else "skill"
+            range_start, range_end = chain_start + depth, chain_start + 2*CHAIN_DEPTH - depth
+            intervals.append(_unit(value_type, f"{value_type}_{depth % 7}", range_start, range_end))
+        chain_start += 2*CHAIN_DEPTH + 1
+    return intervals[:num_nodes]
+
+def random_intervals(num_nodes, seed=0):
+    # Skills recursively split into children with gaps between them, the leaves are actions
+    rng = random.Random(seed)
+    intervals = []
+    position = 0
+    while len(intervals) < num_nodes:
+        length = rng.randint(20, 2_000)
+        stack = [(position, position + length)]
+        position += length + rng.randint(0, 10)
+        while stack and len(intervals) < num_nodes:
+            range_start, range_end = stack.pop()
+            if range_end - range_start <= 2 or rng.random() < 0.3:
+                intervals.append(_unit("action", f"action_{range_start % 5}", range_start, range_end))
+                continue
+            intervals.append(_unit("skill", f"skill_{range_start % 7}", range_start, range_end))
+            # Children are at most half as long as their parent, so never equal to it
+            cursor = range_start
+            while cursor < range_end:
+                child_end = min(range_end, cursor + rng.randint(1, (range_end - range_start) // 2))
+                if rng.random() < 0.8:
+                    stack.append((cursor, child_end))
+                cursor = child_end + rng.randint(0, 3)
+    return intervals
+
+SCALING_SHAPES = {"flat": flat_intervals, "deep": deep_intervals, "random": random_intervals}
+
+def _throughput(operation, arguments):
+    start_time = time.perf_counter()
+    for argument in arguments:
+        operation(argument)
+    return len(arguments) / (time.perf_counter() - start_time)
+
+def scaling_costs(shape, num_nodes, seed=0):
+    """Build time in seconds, operations per second and tree bytes per node for one synthetic set."""
+    # ActionUnit prints every unit it creates
+    with contextlib.redirect_stdout(io.StringIO()):
+        intervals = SCALING_SHAPES[shape](num_nodes, seed)
+    rng = random.Random(seed)
+    samples = rng.sample(intervals, min(SCALING_SAMPLE, len(intervals)))
+    last_frame = max(range_end for _, _, range_end in intervals)
+    frames = [rng.uniform(0, last_frame) for _ in range(SCALING_SAMPLE)]
+
+    start_time = time.perf_counter()
+    tree = NaryRangeTree.from_intervals(intervals)
+    build_time = time.perf_counter() - start_time
+
+    # Pop a sample and insert it back, in sorted order so every node finds its old place
+    pop = _throughput(lambda interval: tree.pop_by_uuid(interval[0].uuid), samples)
+    samples.sort(key=lambda interval: (interval[1], -interval[2], interval[0].type == "action"))
+    insert = _throughput(lambda interval: tree.insert(*interval), samples)
+    range_query = _throughput(lambda frame: tree.range_query(frame, frame + FRAMES_PER_SKILL), frames)
+    tightest = _throughput(tree.query_value_with_tightest_range_containing, frames)
+    # The boundary index of a bulk-built tree is built on first use
+    tree.next_boundary(0)
+    boundary = _throughput(tree.next_boundary, frames)
+
+    start_time = time.perf_counter()
+    traversed = sum(1 for _ in tree.iter_nodes())
+    traverse = traversed / (time.perf_counter() - start_time)
+
+    del tree
+    tracemalloc.start()
+    tree = NaryRangeTree.from_intervals(intervals)
+    memory = tracemalloc.get_traced_memory()[0] / num_nodes
+    tracemalloc.stop()
+    return build_time, insert, pop, range_query, tightest, boundary, traverse, memory
+
+def run_scaling_benchmark(node_counts=SCALING_NODE_COUNTS, shapes=SCALING_SHAPES):
+    print("Throughput in operations per second, traverse in nodes per second, memory excludes the units")
+    print(f"{'shape':>8} {'nodes':>10} {'build (s)':>10} {'insert':>10} {'pop':>10} {'range':>10} "
+          f"{'tightest':>10} {'boundary':>10} {'traverse':>10} {'memory (B/node)':>16}")
+    for shape in shapes:
+        for num_nodes in node_counts:
+            build_time, *throughputs, memory = scaling_costs(shape, num_nodes)
+            print(f"{shape:>8} {num_nodes:>10} {build_time:>10.3f} "
+                  + " ".join(f"{throughput:>10.0f}" for throughput in throughputs)
+                  + f" {memory:>16.0f}")
+
+if __name__ == "__main__":
+    run_insert_benchmark()
+    run_snapshot_benchmark()
+    run_memory_benchmark()
+    run_scaling_benchmark()
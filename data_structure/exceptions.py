@@ -33,4 +33,20 @@ class ActionHasChildren(Exception):
     def __eq__(self, o: object) -> bool:
         if isinstance(o, ActionHasChildren):
             return self.name == o.name
-        return False 
\ No newline at end of file
+        return False 
+
+class InvalidIntervals(Exception):
+    type = "Error"
+    def __init__(self, errors):
+        self.errors = errors
+    
+    def __str__(self):
+        return f"{len(self.errors)} invalid interval(s):\n" + "\n".join(str(error) for error in self.errors)
+    
+    def __hash__(self) -> int:
+        return hash(tuple(str(error) for error in self.errors))
+    
+    def __eq__(self, o: object) -> bool:
+        if isinstance(o, InvalidIntervals):
+            return self.errors == o.errors
+        return False
@@ -0,0 +1,122 @@
+import unittest
+from collections import OrderedDict
+
+FRAME_CACHE_BYTES = 512 * 1024 * 1024
+PLAYHEAD_RADIUS = 30
+
+class FrameCache:
+    """Decoded frames keyed by frame index, kept within a byte budget.
+
+    Frames are evicted least recently used first, except that frames within radius of the
+    playhead are kept while any other frame can go; once only those are left, the one
+    farthest from the playhead goes first. Values are opaque, the caller gives their size.
+    """
+    def __init__(self, max_bytes = FRAME_CACHE_BYTES, radius = PLAYHEAD_RADIUS):
+        self.max_bytes = max_bytes
+        self.radius = radius
+        self.playhead = 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # {frame: (value, nbytes)}, least recently used first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, frame):
+        return frame in self._entries
+
+    def get(self, frame):
+        """The value cached for frame (now the most recently used), or None."""
+        entry = self._entries.get(frame)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(frame)
+        return entry[0]
+
+    def peek(self, frame):
+        """The value cached for frame, or None, without counting a hit or miss or using it."""
+        entry = self._entries.get(frame)
+        return None if entry is None else entry[0]
+
+    def put(self, frame, value, nbytes):
+        """Cache value for frame, evicting others to stay within the budget.
+
+        Returns False (and caches nothing) if value alone is over the budget.
+        """
+        if nbytes > self.max_bytes:
+            return False
+        self.discard(frame)
+        self._entries[frame] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self.discard(self._victim())
+        return True
+
+    def discard(self, frame):
+        entry = self._entries.pop(frame, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def set_playhead(self, frame):
+        self.playhead = frame
+
+    def set_budget(self, max_bytes):
+        self.max_bytes = max_bytes
+        while self.nbytes > self.max_bytes:
+            self.discard(self._victim())
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _victim(self):
+        for frame in self._entries:
+            if abs(frame - self.playhead) > self.radius:
+                return frame
+        return max(self._entries, key = lambda frame: abs(frame - self.playhead))
+
+class Eviction(unittest.TestCase):
+    # Test that the budget holds and that frames near the playhead outlive older ones far away
+    def test(self):
+        cache = FrameCache(max_bytes = 50, radius = 2)
+        for frame in range(5):
+            self.assertTrue(cache.put(frame, f"img{frame}", 10))
+        self.assertEqual((len(cache), cache.nbytes), (5, 50))
+
+        # Frame 0 is the least recently used, but sits next to the playhead
+        cache.set_playhead(0)
+        self.assertEqual(cache.get(3), "img3")
+        cache.put(10, "img10", 10)
+        self.assertEqual(sorted(cache._entries), [0, 1, 2, 3, 10])
+        cache.put(11, "img11", 10)
+        self.assertEqual(sorted(cache._entries), [0, 1, 2, 10, 11])
+
+        # With every frame near the playhead, the farthest one goes
+        cache.set_playhead(11)
+        cache.set_budget(20)
+        self.assertEqual(sorted(cache._entries), [10, 11])
+        self.assertEqual(cache.nbytes, 20)
+
+        self.assertFalse(cache.put(12, "too big", 30))
+        self.assertNotIn(12, cache)
+
+class Counters(unittest.TestCase):
+    # Test hit and miss counting and that replacing a frame does not count its bytes twice
+    def test(self):
+        cache = FrameCache(max_bytes = 100)
+        self.assertIsNone(cache.get(1))
+        cache.put(1, "a", 10)
+        cache.put(1, "b", 20)
+        self.assertEqual(cache.get(1), "b")
+        self.assertEqual((cache.peek(1), cache.peek(2)), ("b", None))
+        self.assertEqual((cache.hits, cache.misses, cache.nbytes), (1, 1, 20))
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses, cache.nbytes), (0, 0, 0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import unittest
+import numpy as np
+
+RING_SLOTS = 8
+
+def _unused_refs():
+    # References to an array held only by a list, as counted in FrameRing.acquire
+    slots = [np.empty(0)]
+    return sys.getrefcount(slots[0])
+
+class FrameRing:
+    """Preallocated image arrays of one shape, handed out in turn for frames to be written into.
+
+    An array is handed out again only once nothing but the ring refers to it, so a frame still
+    kept in a cache or by an image wrapping it is never overwritten; when every array is in
+    use, one more is added. Changing the shape starts the ring over, and arrays in use
+    elsewhere live on until they are let go.
+    """
+    UNUSED_REFS = _unused_refs()
+
+    def __init__(self, shape, slots = RING_SLOTS, dtype = np.uint8):
+        self.dtype = dtype
+        self.reshape(shape, slots)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def reshape(self, shape, slots = RING_SLOTS):
+        self.shape = tuple(shape)
+        self._slots = [np.empty(self.shape, self.dtype) for _ in range(slots)]
+        self._next = 0
+
+    def trim(self, slots = RING_SLOTS):
+        """Lets go of all but slots arrays, unused ones kept first, after the ring grew for frames since let go."""
+        unused = [sys.getrefcount(array) <= self.UNUSED_REFS + 1 for array in self._slots]
+        order = sorted(range(len(self._slots)), key = lambda i: not unused[i])
+        self._slots = [self._slots[i] for i in sorted(order[:slots])]
+        self._next = 0
+    
+    def acquire(self):
+        """An array of the ring's shape that nothing else refers to, with undefined contents."""
+        n = len(self._slots)
+        for i in range(n):
+            j = (self._next + i) % n
+            if sys.getrefcount(self._slots[j]) <= self.UNUSED_REFS:
+                self._next = (j + 1) % n
+                return self._slots[j]
+        self._slots.append(np.empty(self.shape, self.dtype))
+        self._next = 0
+        return self._slots[-1]
+
+class Reuse(unittest.TestCase):
+    # Test that arrays are handed out in turn and never while something else holds them
+    def test(self):
+        ring = FrameRing((2, 3, 3), slots = 2)
+        first = ring.acquire()
+        second = ring.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual((first.shape, first.dtype), ((2, 3, 3), np.uint8))
+
+        # Both are held, so the ring grows
+        third = ring.acquire()
+        self.assertEqual(len(ring), 3)
+
+        # A view keeps its array in use too
+        view = second[:, :, 0]
+        first_id = id(first)
+        del first, second
+        self.assertEqual(id(ring.acquire()), first_id)
+        self.assertEqual(len(ring), 3)
+        del view, third
+        self.assertEqual(len({id(ring.acquire()) for _ in range(3)}), 3)
+        self.assertEqual(len(ring), 3)
+
+        # Trimming keeps unused arrays before those in use
+        ring = FrameRing((2, 3, 3), slots = 3)
+        held = [ring.acquire(), ring.acquire()]
+        ring.trim(slots = 2)
+        self.assertEqual([array is held[0] for array in ring._slots], [True, False])
+        ring.trim(slots = 1)
+        self.assertEqual(len(ring), 1)
+        self.assertFalse(any(ring.acquire() is array for array in held))
+        
+        ring.reshape((4, 4, 3), slots = 1)
+        self.assertEqual((len(ring), ring.acquire().shape), (1, (4, 4, 3)))
+
+if __name__ == "__main__":
+    unittest.main()
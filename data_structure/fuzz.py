@@ -0,0 +1,377 @@
+import contextlib
+import io
+import pickle
+import random
+import unittest
+
+# This allows for the tests to be run from the repository root or from this folder
+try:
+    from data_structure.exceptions import ActionHasChildren, InvalidIntervals, OverlappingSkills
+    from data_structure.naryrangetree import NaryRangeTree
+    from data_structure.skillunit import ActionRunUnit, ActionUnit, SkillUnit
+except ImportError:
+    from exceptions import ActionHasChildren, InvalidIntervals, OverlappingSkills
+    from naryrangetree import NaryRangeTree
+    from skillunit import ActionRunUnit, ActionUnit, SkillUnit
+
+FUZZ_SEEDS = range(25)
+FUZZ_STEPS = 150
+MAX_FRAME = 40
+
+class ReferenceModel():
+    """The tree's nesting rules on plain nested lists, scanning every sibling on each call.
+
+    Nodes are [value, range_start, range_end, children]. There is no bisecting, no index, no
+    bulk path and no copy-on-write, so the tree can be checked against it after any change to
+    those. Queries are answered by brute force over all stored ranges.
+    """
+    def __init__(self, root = None):
+        self.root = root if root is not None else [None, float("-inf"), float("inf"), []]
+
+    def copy(self):
+        def copy_node(node):
+            return [node[0], node[1], node[2], [copy_node(child) for child in node[3]]]
+        return ReferenceModel(copy_node(self.root))
+
+    def nodes(self):
+        # [(node, parent)] in pre-order
+        result = []
+        stack = [self.root]
+        while stack:
+            parent = stack.pop()
+            for child in parent[3]:
+                result.append((child, parent))
+            stack.extend(reversed(parent[3]))
+        return result
+
+    def find(self, value_uuid):
+        for node, parent in self.nodes():
+            if node[0].uuid == value_uuid:
+                return node, parent
+        raise KeyError(value_uuid)
+
+    def locate(self, parent, value, range_start, range_end):
+        """The parent a new range goes under and the children it adopts, or None if it is invalid."""
+        is_action = value.type == "action"
+        while True:
+            adopted = []
+            descend_into = None
+            for child in parent[3]:
+                _, child_start, child_end, _ = child
+                if child_end < range_start or child_start > range_end:
+                    continue
+                if child_start < range_start < child_end < range_end or range_start < child_start < range_end < child_end:
+                    return None
+                if range_start < child_start and range_end <= child_start:
+                    break
+                if range_start >= child_start and range_end <= child_end:
+                    if child[0].type == "action":
+                        # A single frame at the end of an action sits beside it
+                        if range_start == range_end == child_end and child_start < child_end:
+                            continue
+                        return None
+                    descend_into = child
+                    break
+                if range_start <= child_start and range_end >= child_end:
+                    if is_action:
+                        return None
+                    adopted.append(child)
+            if descend_into is None:
+                return parent, adopted
+            parent = descend_into
+
+    def insert(self, value, range_start, range_end, parent = None):
+        if any(node[0].uuid == value.uuid for node, _ in self.nodes()):
+            return False
+        located = self.locate(parent or self.root, value, range_start, range_end)
+        if located is None:
+            return False
+        parent, adopted = located
+        node = [value, range_start, range_end, adopted]
+        parent[3] = sorted([child for child in parent[3] if all(child is not other for other in adopted)] + [node], key=lambda child: child[1])
+        return True
+
+    def insert_many(self, intervals):
+        # A batch is nested as if inserted in sorted order, single frames last, or not at all
+        ordered = sorted(intervals, key=lambda interval: (interval[1] == interval[2], interval[1], -interval[2], interval[0].type == "action"))
+        model = self.copy()
+        if not all(model.insert(*interval) for interval in ordered):
+            return False
+        self.root = model.root
+        return True
+
+    def pop(self, value_uuid):
+        """Pop the node, or return None if a freed single frame would land at the start of an action."""
+        model = self.copy()
+        node, parent = model.find(value_uuid)
+        parent[3] = [child for child in parent[3] if child is not node]
+        # Single frames on the node's boundary are nested again from its parent
+        points = [child for child in node[3] if child[1] == child[2] and child[1] in (node[1], node[2])]
+        parent[3] = sorted(parent[3] + [child for child in node[3] if all(child is not point for point in points)], key=lambda child: child[1])
+        for point in points:
+            located = model.locate(parent, point[0], point[1], point[2])
+            if located is None:
+                return None
+            new_parent = located[0]
+            new_parent[3] = sorted(new_parent[3] + [point], key=lambda child: child[1])
+        self.root = model.root
+        return node
+
+    def shape(self, node = None):
+        node = node or self.root
+        return [(child[0].uuid, child[1], child[2], self.shape(child)) for child in node[3]]
+
+    def ranges(self):
+        return [(node[0], node[1], node[2]) for node, _ in self.nodes()]
+
+    def intersecting(self, range_start, range_end):
+        return {value.uuid for value, start, end in self.ranges() if start <= range_end and end >= range_start}
+
+    def loosely_intersecting(self, range_start, range_end):
+        return {value.uuid for value, start, end in self.ranges()
+                if range_start <= start <= range_end or range_start <= end <= range_end}
+
+    def boundaries(self):
+        return sorted({frame for _, start, end in self.ranges() for frame in (start, end)})
+
+    def gaps(self, range_start, range_end):
+        # Walk the window in half frames, keeping the uncovered stretches between covered points
+        ranges = self.ranges()
+        gaps = []
+        position = range_start
+        uncovered = False
+        for i in range(2*range_start, 2*range_end + 1):
+            point = i / 2
+            if any(start <= point <= end for _, start, end in ranges):
+                if uncovered and position < point:
+                    gaps.append((position, point))
+                position = point
+                uncovered = False
+            else:
+                uncovered = True
+        if uncovered and position < range_end:
+            gaps.append((position, range_end))
+        return gaps
+
+    def fill_segments(self, range_start, range_end):
+        cuts = sorted({range_start, range_end} | {frame for frame in self.boundaries() if range_start < frame < range_end})
+        return list(zip(cuts, cuts[1:]))
+
+    def frame_names(self, frame_start, num_frames):
+        # Row per depth of the name covering each frame, dropping the empty rows at the bottom
+        rows = []
+        def walk(node, depth):
+            for child in node[3]:
+                if len(rows) == depth:
+                    rows.append([None] * num_frames)
+                for frame in range(frame_start, frame_start + num_frames):
+                    if child[1] <= frame < child[2] or child[1] == child[2] == frame:
+                        rows[depth][frame - frame_start] = child[0].name
+                walk(child, depth + 1)
+        walk(self.root, 0)
+        while rows and rows[-1] == [None] * num_frames:
+            rows.pop()
+        return rows
+
+    def levels(self):
+        levels = {}
+        stack = [(self.root, 0)]
+        while stack:
+            node, level = stack.pop()
+            for child in node[3]:
+                levels[child[0].uuid] = level + 1
+                stack.append((child, level + 1))
+        return levels
+
+def tree_shape(node):
+    return [(child.value.uuid, child.range_start, child.range_end, tree_shape(child)) for child in node.children]
+
+def check_structure(test, tree, model):
+    """Check that tree nests exactly like model, and that its indexes agree with its nodes."""
+    test.assertEqual(tree_shape(tree.root), model.shape())
+    nodes = 0
+    stack = [tree.root]
+    while stack:
+        parent = stack.pop()
+        previous = None
+        for child in parent.children:
+            nodes += 1
+            if previous is not None:
+                test.assertTrue(previous.range_end <= child.range_start and previous.range_start < child.range_start, f"{previous.value} and {child.value} out of order")
+            previous = child
+            test.assertIs(tree.get_by_uuid(child.value.uuid), child)
+            test.assertIs(tree._parent_of(child), parent)
+            stack.append(child)
+    test.assertEqual(len(tree._nodes), nodes)
+
+class TreeFuzzer():
+    """Applies random operations to a tree and a ReferenceModel side by side."""
+    def __init__(self, test, seed):
+        self.test = test
+        self.rng = random.Random(seed)
+        self.tree = NaryRangeTree()
+        self.model = ReferenceModel()
+        self.snapshots = [] # [(tree snapshot, model copy)]
+        self.next_id = 0
+
+    def new_interval(self):
+        rng = self.rng
+        range_start = rng.randrange(MAX_FRAME)
+        length = rng.choice([0, 1, 1, 2, 3, 5, 8, 13])
+        range_end = min(MAX_FRAME, range_start + length)
+        self.next_id += 1
+        kind = rng.random()
+        if kind < 0.45:
+            value = SkillUnit(f"uuid{self.next_id}", "skill", range_start, range_end)
+        elif kind < 0.8 or range_start == range_end:
+            value = ActionUnit(f"uuid{self.next_id}", "action", range_start, range_end)
+        else:
+            value = ActionRunUnit(f"uuid{self.next_id}", "run", range_start, range_end)
+        return value, range_start, range_end
+
+    def step(self):
+        operations = [self.insert] * 6 + [self.insert_many] * 2 + [self.pop] * 3 + [self.pop_many, self.pop_run_frame,
+                      self.snapshot, self.restore, self.round_trip, self.query]
+        self.rng.choice(operations)()
+        check_structure(self.test, self.tree, self.model)
+
+    def insert(self):
+        interval = self.new_interval()
+        accepted = self.model.insert(*interval)
+        try:
+            self.tree.insert(*interval)
+        except (OverlappingSkills, ActionHasChildren):
+            self.test.assertFalse(accepted, f"Tree rejected {interval[0]}")
+        else:
+            self.test.assertTrue(accepted, f"Tree accepted {interval[0]}")
+
+    def insert_many(self):
+        intervals = [self.new_interval() for _ in range(self.rng.randint(1, 5))]
+        accepted = self.model.insert_many(intervals)
+        try:
+            self.tree.insert_many(intervals)
+        except InvalidIntervals:
+            self.test.assertFalse(accepted, f"Tree rejected {intervals}")
+        else:
+            self.test.assertTrue(accepted, f"Tree accepted {intervals}")
+
+    def pop(self):
+        uuids = sorted((node[0].uuid for node, _ in self.model.nodes()), key=str)
+        if not uuids:
+            return
+        value_uuid = self.rng.choice(uuids)
+        if self.model.pop(value_uuid) is None:
+            with self.test.assertRaises(ActionHasChildren):
+                self.tree.pop_by_uuid(value_uuid)
+        else:
+            self.test.assertEqual(self.tree.pop_by_uuid(value_uuid).value.uuid, value_uuid)
+
+    def pop_many(self):
+        uuids = sorted((node[0].uuid for node, _ in self.model.nodes()), key=str)
+        value_uuids = self.rng.sample(uuids, min(len(uuids), 3))
+        if self.rng.random() < 0.3:
+            # One missing uuid leaves the tree unchanged
+            with self.test.assertRaises(ValueError):
+                self.tree.pop_many(value_uuids + ["missing"])
+            return
+        model = self.model.copy()
+        if all(model.pop(value_uuid) is not None for value_uuid in value_uuids):
+            self.model = model
+            self.tree.pop_many(value_uuids)
+        else:
+            with self.test.assertRaises(ActionHasChildren):
+                self.tree.pop_many(value_uuids)
+
+    def pop_run_frame(self):
+        runs = sorted((value.uuid for value, start, end in self.model.ranges() if isinstance(value, ActionRunUnit) and start < end), key=str)
+        if runs:
+            run = self.model.pop(self.rng.choice(runs))[0]
+            frame = self.rng.choice(run.frames)
+            for part in run.split(frame, drop_frame=True):
+                if part is not None:
+                    self.test.assertTrue(self.model.insert(part, part.frame_start, part.frame_end))
+            self.tree.pop_run_frame(run.uuid, frame)
+
+    def snapshot(self):
+        self.snapshots.append((self.tree.snapshot(), self.model.copy()))
+
+    def restore(self):
+        if self.snapshots:
+            snapshot, model = self.rng.choice(self.snapshots)
+            # Later edits must not have leaked into the snapshot
+            check_structure(self.test, snapshot, model)
+            self.tree.restore(snapshot)
+            self.model = model.copy()
+
+    def round_trip(self):
+        self.tree = pickle.loads(pickle.dumps(self.tree))
+        # A bulk build nests like inserting in sorted order, which can differ from the edit history
+        intervals = self.model.ranges()
+        sorted_model = ReferenceModel()
+        if sorted_model.insert_many(intervals):
+            check_structure(self.test, NaryRangeTree.from_intervals(intervals), sorted_model)
+        else:
+            with self.test.assertRaises(InvalidIntervals):
+                NaryRangeTree.from_intervals(intervals)
+
+    def query(self):
+        rng = self.rng
+        range_start = rng.randrange(-2, MAX_FRAME + 2)
+        range_end = range_start + rng.randrange(0, 10)
+        test, tree, model = self.test, self.tree, self.model
+        test.assertEqual({node.value.uuid for node in tree.range_query(range_start, range_end)}, model.intersecting(range_start, range_end))
+        test.assertEqual({value.uuid for value in tree.loose_range_query(range_start, range_end)}, model.loosely_intersecting(range_start, range_end))
+        test.assertEqual(tree.gaps(range_start = range_start, range_end = range_end), model.gaps(range_start, range_end))
+        test.assertEqual(tree.fill_segments(range_start, range_end), model.fill_segments(range_start, range_end))
+
+        boundaries = model.boundaries()
+        test.assertEqual(tree.next_boundary(range_start), next((frame for frame in boundaries if frame > range_start), None))
+        test.assertEqual(tree.prev_boundary(range_start), next((frame for frame in reversed(boundaries) if frame < range_start), None))
+
+        # The first child holding the frame, all the way down
+        node = model.root
+        child = node
+        while child is not None:
+            node = child
+            child = next((child for child in node[3] if child[1] <= range_start <= child[2]), None)
+        tightest = tree.query_value_with_tightest_range_containing(range_start)
+        test.assertEqual(getattr(tightest.value, "uuid", None), getattr(node[0], "uuid", None))
+
+        labels, name_ids = tree.frame_labels(range_end - range_start, range_start)
+        names = {name_id: name for name, name_id in name_ids.items()}
+        rows = [[names.get(label) for label in row] for row in labels.tolist()]
+        while rows and rows[-1] == [None] * (range_end - range_start):
+            rows.pop()
+        test.assertEqual(rows, model.frame_names(range_start, range_end - range_start))
+
+        levels = model.levels()
+        for node, level in tree.range_query(range_start, range_end, levels = True):
+            test.assertEqual(level, levels[node.value.uuid])
+            test.assertEqual(tree.level_of(node), level)
+
+class FuzzAgainstReferenceModel(unittest.TestCase):
+    # Test random sequences of edits and queries against the brute force model
+    def test(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for seed in FUZZ_SEEDS:
+                fuzzer = TreeFuzzer(self, seed)
+                for _ in range(FUZZ_STEPS):
+                    fuzzer.step()
+
+class ReferenceModelRules(unittest.TestCase):
+    # Test the model itself on the cases the tree's own tests pin down
+    def test(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = ReferenceModel()
+            self.assertTrue(model.insert(SkillUnit("uuid1", "A", 0, 10), 0, 10))
+            self.assertFalse(model.insert(SkillUnit("uuid2", "B", 5, 15), 5, 15))
+            self.assertTrue(model.insert(ActionUnit("uuid3", "C", 2, 4), 2, 4))
+            self.assertFalse(model.insert(ActionUnit("uuid4", "D", 3, 3), 3, 3))
+            self.assertTrue(model.insert(ActionUnit("uuid5", "E", 4, 4), 4, 4))
+            self.assertFalse(model.insert(ActionUnit("uuid6", "F", 1, 5), 1, 5))
+            self.assertTrue(model.insert(SkillUnit("uuid7", "G", 1, 5), 1, 5))
+            self.assertEqual(model.gaps(-2, 12), [(-2, 0), (10, 12)])
+
+# Run Tests
+if __name__ == "__main__":
+    unittest.main()
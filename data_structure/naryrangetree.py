@@ -1,19 +1,137 @@
+import math
+import pickle
+import random
 import unittest
+import uuid
+from bisect import bisect_right
+from contextlib import contextmanager
+from operator import attrgetter
+import numpy as np
+from sortedcontainers import SortedKeyList, SortedList
 
 # This allows for us to have unittests in the same file as the class definition
 try:
-    from data_structure.exceptions import ActionHasChildren, OverlappingSkills
-    from data_structure.skillunit import ActionUnit, SkillUnit
+    from data_structure.exceptions import ActionHasChildren, InvalidIntervals, OverlappingSkills
+    from data_structure.skillunit import ActionRunUnit, ActionUnit, SkillUnit
 except ImportError:
-    from exceptions import ActionHasChildren, OverlappingSkills
-    from skillunit import ActionUnit, SkillUnit
+    from exceptions import ActionHasChildren, InvalidIntervals, OverlappingSkills
+    from skillunit import ActionRunUnit, ActionUnit, SkillUnit
+
+# Siblings never overlap, so ordering them by start also orders them by end
+_range_start_key = attrgetter("range_start")
+
+def _interval_sort_key(interval):
+    # Parents sort before their children, and skills before actions with the same range
+    value, range_start, range_end = interval
+    return range_start, -range_end, _is_action(value)
+
+def _is_action(value):
+    # Actions (including runs of per-frame actions) cannot have children; skills and plain values can
+    return getattr(value, "type", None) == "action"
+
+def _is_end_point(range_start, range_end, parent_start, parent_end):
+    # A single frame at the very end of an action sits beside it rather than inside it,
+    # which is where it lands when it is inserted before the action
+    return range_start == range_end == parent_end and parent_start < parent_end
+
+def _split_points(ordered):
+    # Single-frame ranges are nested after everything else, see NaryRangeTree._insert_points
+    ranges = [interval for interval in ordered if interval[1] != interval[2]]
+    points = [interval for interval in ordered if interval[1] == interval[2]]
+    return ranges, points
+
+def _uuid_of(value):
+    # Values without a uuid (e.g. plain strings) are not indexed and are only reachable by search
+    return getattr(value, "uuid", None)
+
+class _ChildList(SortedKeyList):
+    """A node's children, sorted by start, whose copies share storage until either one changes.
+    
+    SortedKeyList keeps its values in sublists of up to about a thousand. copy() only copies
+    the lists of sublists, and a sublist is copied the first time a list that shares it
+    changes it. So the first change below a snapshot copies a few sublists per node on the
+    path rather than every sibling.
+    """
+    def __init__(self, iterable = None, key = _range_start_key):
+        self._shared = set() # ids of sublists that copies of this list may also hold
+        super().__init__(iterable, key = key)
+    
+    def copy(self):
+        copy = type(self)(key = self._key)
+        copy._load = self._load
+        copy._lists = list(self._lists)
+        copy._keys = list(self._keys)
+        copy._maxes = list(self._maxes)
+        copy._len = self._len
+        self._shared.update(map(id, self._lists))
+        copy._shared = set(self._shared)
+        return copy
+    
+    def _own_sublist(self, pos):
+        sublist = self._lists[pos]
+        if id(sublist) in self._shared:
+            self._shared.discard(id(sublist))
+            self._lists[pos] = list(sublist)
+            self._keys[pos] = list(self._keys[pos])
+    
+    def add(self, value):
+        if self._shared and self._maxes:
+            pos = bisect_right(self._maxes, self._key(value))
+            self._own_sublist(min(pos, len(self._maxes) - 1))
+        super().add(value)
+    
+    def _delete(self, pos, idx):
+        if self._shared:
+            self._own_sublist(pos)
+            if pos and len(self._keys[pos]) - 1 <= self._load >> 1:
+                # The sublist is merged into the one before it
+                self._own_sublist(pos - 1)
+        super()._delete(pos, idx)
+
+class _NoChildren(_ChildList):
+    # Shared by every leaf, so that most nodes do not carry a SortedKeyList of their own
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Leaf nodes share a read-only empty child list.")
+    add = update = clear = discard = remove = pop = __delitem__ = _read_only
+
+_NO_CHILDREN = _NoChildren(key=_range_start_key)
+
+def _child_list(children):
+    return _ChildList(children) if children else _NO_CHILDREN
+
+class _BoundaryIndex:
+    """Sorted, reference-counted set of the range starts and ends of a tree's nodes."""
+    __slots__ = ("counts", "frames")
+    
+    def __init__(self):
+        self.counts = {} # {frame: number of node starts and ends at frame}
+        self.frames = SortedList()
+    
+    def add(self, node):
+        for frame in (node.range_start, node.range_end):
+            if frame in self.counts:
+                self.counts[frame] += 1
+            else:
+                self.counts[frame] = 1
+                self.frames.add(frame)
+    
+    def remove(self, node):
+        for frame in (node.range_start, node.range_end):
+            self.counts[frame] -= 1
+            if not self.counts[frame]:
+                del self.counts[frame]
+                self.frames.remove(frame)
 
 class NaryRangeTreeNode:
+    __slots__ = ("value", "range_start", "range_end", "children", "owner")
+    
     def __init__(self, value, range_start, range_end):
         self.value = value
         self.range_start = range_start
         self.range_end = range_end
-        self.children = []
+        self.children = _NO_CHILDREN
+        # Token of the tree allowed to change this node in place, see NaryRangeTree.snapshot
+        self.owner = None
 
     def __repr__(self):
         return f"Node({self.value}, Range: [{self.range_start}, {self.range_end}]): {[child.value for child in self.children]}"
@@ -22,65 +140,551 @@ class NaryRangeTreeNode:
         if not isinstance(other, NaryRangeTreeNode):
             return False
         return self.value == other.value and self.range_start == other.range_start and self.range_end == other.range_end
+    
+    def __getstate__(self):
+        return (self.value, self.range_start, self.range_end, list(self.children))
+    
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Nodes pickled before __slots__ store their attribute dict, with children as a
+            # plain list if they also predate sorted children
+            state = (state["value"], state["range_start"], state["range_end"], state["children"])
+        self.value, self.range_start, self.range_end, children = state
+        self.children = _child_list(list(children))
+        self.owner = None
+
+class NaryRangeTreeEvent:
+    """A single change to a NaryRangeTree, delivered to subscribers in batches.
+    
+    level is the node's level after the change (before it for REMOVED), parent its parent
+    after the change and old_parent its previous parent for REPARENTED. RESET carries no
+    node and means the whole tree has to be reread.
+    """
+    INSERTED = "inserted"
+    REMOVED = "removed"
+    REPARENTED = "reparented"
+    LEVEL_CHANGED = "level_changed"
+    RESET = "reset"
+    
+    def __init__(self, kind, node = None, parent = None, level = None, old_parent = None):
+        self.kind = kind
+        self.node = node
+        self.parent = parent
+        self.level = level
+        self.old_parent = old_parent
+    
+    def __repr__(self):
+        return f"Event({self.kind}, {None if self.node is None else self.node.value}, level {self.level})"
 
 class NaryRangeTree:
     def __init__(self):
-        self.root = NaryRangeTreeNode(None, float("-inf"), float("inf"))
+        self._owner = object()
+        self.root = self._new_node(None, float("-inf"), float("inf"))
+        self._node_index = {} # {uuid: NaryRangeTreeNode}
+        # {uuid: parent uuid, None for the root}. Storing uuids rather than nodes means copying a
+        # node (see _own) only updates its own entry, not those of all its children.
+        self._parent_index = {}
+        self._boundary_index = _BoundaryIndex()
+        self._init_events()
+    
+    def _init_events(self):
+        self._listeners = [] # callables taking a list of NaryRangeTreeEvent
+        self._pending_events = []
+        self._batch_depth = 0
 
     def clear(self):
-        self.root = NaryRangeTreeNode(None, float("-inf"), float("inf"))
+        with self.batch():
+            self.root = self._new_node(None, float("-inf"), float("inf"))
+            self._node_index = {}
+            self._parent_index = {}
+            self._boundary_index = _BoundaryIndex()
+            self._emit(NaryRangeTreeEvent.RESET)
+    
+    def snapshot(self):
+        """A frozen copy of the tree in O(1), sharing every node with it.
+        
+        From then on neither tree changes a shared node in place: the first change below a
+        shared node copies the path down to it (see _own). The snapshot can be read from
+        another thread while this tree is edited, and handed back to restore.
+        """
+        snapshot = type(self).__new__(type(self))
+        snapshot._owner = object()
+        snapshot.root = self.root
+        # Built on first use, so taking a snapshot never walks the tree
+        snapshot._node_index = None
+        snapshot._parent_index = None
+        snapshot._boundary_index = None
+        snapshot._init_events()
+        self._owner = object()
+        return snapshot
+    
+    def restore(self, snapshot):
+        """Make this tree the version saved in snapshot, which stays usable (e.g. for redo)."""
+        with self.batch():
+            self.root = snapshot.root
+            self._owner = object()
+            self._node_index = None
+            self._parent_index = None
+            self._boundary_index = None
+            self._emit(NaryRangeTreeEvent.RESET)
+    
+    @property
+    def _nodes(self):
+        if self._node_index is None:
+            self._rebuild_index()
+        return self._node_index
+    
+    @property
+    def _parents(self):
+        if self._parent_index is None:
+            self._rebuild_index()
+        return self._parent_index
+    
+    @property
+    def _boundaries(self):
+        if self._boundary_index is None:
+            self._boundary_index = _BoundaryIndex()
+            for node in self.iter_nodes():
+                self._boundary_index.add(node)
+        return self._boundary_index
+    
+    def next_boundary(self, frame):
+        """The first start or end of a node after frame, or None. Action runs count as one range."""
+        frames = self._boundaries.frames
+        i = frames.bisect_right(frame)
+        return frames[i] if i < len(frames) else None
+    
+    def prev_boundary(self, frame):
+        """The last start or end of a node before frame, or None."""
+        frames = self._boundaries.frames
+        i = frames.bisect_left(frame)
+        return frames[i-1] if i > 0 else None
+    
+    def _new_node(self, value, range_start, range_end):
+        node = NaryRangeTreeNode(value, range_start, range_end)
+        node.owner = self._owner
+        return node
+    
+    def _own(self, node):
+        """The version of node this tree may change in place.
+        
+        A node shared with a snapshot is copied, along with every shared ancestor, and the
+        copies replace the originals in this tree only.
+        """
+        if node.owner is self._owner:
+            return node
+        path = [node]
+        while path[-1] is not self.root and path[-1].owner is not self._owner:
+            path.append(self._parent_of(path[-1]))
+        parent = path.pop()
+        if parent.owner is not self._owner:
+            parent = self.root = self._copy_node(parent)
+        while path:
+            shared = path.pop()
+            copy = self._copy_node(shared)
+            self._remove_child(parent, shared)
+            parent.children.add(copy)
+            self._index_node(copy, parent)
+            parent = copy
+        return parent
+    
+    def _copy_node(self, node):
+        copy = self._new_node(node.value, node.range_start, node.range_end)
+        # Shares the children's storage with node, see _ChildList
+        copy.children = node.children.copy() if node.children else _NO_CHILDREN
+        return copy
+    
+    def _parent_of(self, node):
+        node_uuid = _uuid_of(node.value)
+        if node_uuid not in self._parents:
+            return self._find_parent(node)
+        parent_uuid = self._parents[node_uuid]
+        return self.root if parent_uuid is None else self._nodes[parent_uuid]
+    
+    def subscribe(self, listener):
+        """Call listener with the list of NaryRangeTreeEvent after every change to the tree."""
+        self._listeners.append(listener)
+    
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+    
+    @contextmanager
+    def batch(self):
+        """Deliver every change made inside the block to subscribers as one list.
+        
+        Operations that raise leave the tree unchanged (or undo themselves, emitting the
+        matching events), so whatever was recorded is delivered even if the block fails.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._pending_events:
+                events, self._pending_events = self._pending_events, []
+                for listener in list(self._listeners):
+                    listener(events)
+    
+    def _emit(self, kind, node = None, parent = None, level = None, old_parent = None):
+        self._pending_events.append(NaryRangeTreeEvent(kind, node, parent, level, old_parent))
+    
+    def _emit_moved(self, node, parent, old_parent, level):
+        # Every descendant of a moved node changes level along with it
+        self._emit(NaryRangeTreeEvent.REPARENTED, node, parent, level, old_parent)
+        for descendant, depth in self.iter_nodes(levels = True, node = node):
+            self._emit(NaryRangeTreeEvent.LEVEL_CHANGED, descendant, level = level + depth)
+    
+    def level_of(self, node):
+        """Depth of node below the root (top-level nodes are level 1)."""
+        level = 0
+        while node is not self.root:
+            node = self._parent_of(node)
+            level += 1
+        return level
+    
+    def __getstate__(self):
+        # Saved as flat columns (parents before children, siblings in order) rather than as
+        # nested nodes, which keeps skilltree.pkl small and avoids recursing once per level.
+        # Subscribers are usually GUI callbacks and are not saved.
+        values, starts, ends, parents = [], [], [], []
+        stack = [(self.root, -1)]
+        while stack:
+            node, node_index = stack.pop()
+            for child in node.children:
+                values.append(child.value)
+                starts.append(child.range_start)
+                ends.append(child.range_end)
+                parents.append(node_index)
+                if child.children:
+                    stack.append((child, len(values)-1))
+        return {"values": values, "starts": starts, "ends": ends, "parents": parents}
+    
+    @classmethod
+    def from_intervals(cls, intervals):
+        """Build a tree from (value, range_start, range_end) triples in one sorted pass.
+        
+        Gives the same nesting as inserting the triples one by one in sorted order, with equal
+        ranges resolved in input order except that skills are placed above actions. Every
+        overlap, ActionHasChildren and duplicate uuid violation is collected and raised
+        together as InvalidIntervals, in which case nothing is built.
+        """
+        tree = cls()
+        # Built on first use rather than kept up to date node by node
+        tree._boundary_index = None
+        ordered = sorted(intervals, key=_interval_sort_key)
+        errors = tree._duplicate_uuid_errors(ordered)
+        ranges, points = _split_points(ordered)
+        parents, nesting_errors = cls._nest_sorted(ranges)
+        errors += nesting_errors
+        
+        nodes = []
+        for (value, range_start, range_end), parent_index in zip(ranges, parents):
+            new_node = tree._new_node(value, range_start, range_end)
+            nodes.append(new_node)
+            if parent_index is None:
+                continue
+            parent = tree.root if parent_index < 0 else nodes[parent_index]
+            tree._writable_children(parent).add(new_node)
+            tree._index_node(new_node, parent)
+        errors += tree._insert_points(points)[1]
+        if errors:
+            raise InvalidIntervals(errors)
+        return tree
+    
+    def _insert_points(self, points):
+        """Insert single-frame ranges one by one, collecting violations instead of raising.
+        
+        A point on the boundary of two siblings can belong to either of them, which a single
+        stack pass cannot decide, so these always go through the regular insertion path.
+        """
+        nodes = []
+        errors = []
+        for value, range_start, range_end in points:
+            try:
+                nodes.append(self._insert_recursive(self.root, self._new_node(value, range_start, range_end)))
+            except (OverlappingSkills, ActionHasChildren) as e:
+                errors.append(e)
+        return nodes, errors
+    
+    @staticmethod
+    def _nest_sorted(ordered):
+        """Single stack pass over ranges of non-zero length sorted with _interval_sort_key.
+        
+        Returns the index in ordered of each interval's parent (-1 for top-level, None when
+        the interval is invalid) and the violations found.
+        """
+        parents = []
+        errors = []
+        # Indices of the open ancestors of the next interval, innermost last
+        stack = []
+        for value, range_start, range_end in ordered:
+            error = None
+            while stack:
+                top_value, top_start, top_end = ordered[stack[-1]]
+                # Sorting guarantees top starts at or before this interval
+                if range_end <= top_end:
+                    if _is_action(top_value):
+                        error = ActionHasChildren(top_value.name)
+                    break
+                elif range_start >= top_end:
+                    stack.pop()
+                else:
+                    error = OverlappingSkills(value, range_start, range_end, top_value, top_start, top_end)
+                    break
+            if error is not None:
+                errors.append(error)
+                parents.append(None)
+                continue
+            parents.append(stack[-1] if stack else -1)
+            stack.append(len(parents)-1)
+        return parents, errors
+    
+    def _duplicate_uuid_errors(self, intervals):
+        errors = []
+        seen = set()
+        for value, range_start, range_end in intervals:
+            value_uuid = _uuid_of(value)
+            if value_uuid is None:
+                continue
+            if value_uuid in self._nodes or value_uuid in seen:
+                errors.append(ValueError(f"Node with uuid {value_uuid} already in tree."))
+            seen.add(value_uuid)
+        return errors
+    
+    def __setstate__(self, state):
+        self._init_events()
+        self._owner = object()
+        self._boundary_index = None
+        if "root" in state:
+            # Trees pickled before the column format store the nested nodes (and an index that
+            # held parent nodes rather than parent uuids, so it is rebuilt)
+            self.root = state["root"]
+            self.root.owner = self._owner
+            for node in self.iter_nodes():
+                node.owner = self._owner
+            self._rebuild_index()
+            return
+        
+        self.root = self._new_node(None, float("-inf"), float("inf"))
+        nodes = [self._new_node(value, range_start, range_end)
+                 for value, range_start, range_end in zip(state["values"], state["starts"], state["ends"])]
+        children = {} # {parent index: [child nodes in order]}
+        for node, parent_index in zip(nodes, state["parents"]):
+            children.setdefault(parent_index, []).append(node)
+        for parent_index, siblings in children.items():
+            parent = self.root if parent_index < 0 else nodes[parent_index]
+            parent.children = _child_list(siblings)
+        self._rebuild_index()
+    
+    def _rebuild_index(self):
+        self._node_index = {}
+        self._parent_index = {}
+        stack = [self.root]
+        while stack:
+            parent = stack.pop()
+            for child in parent.children:
+                self._index_node(child, parent)
+                stack.append(child)
+    
+    @staticmethod
+    def _writable_children(node):
+        if node.children is _NO_CHILDREN:
+            node.children = _ChildList()
+        return node.children
+    
+    def _index_node(self, node, parent):
+        node_uuid = _uuid_of(node.value)
+        if node_uuid is not None:
+            self._nodes[node_uuid] = node
+            parent_uuid = _uuid_of(parent.value)
+            if parent is self.root or parent_uuid is not None:
+                self._parents[node_uuid] = parent_uuid
+            else:
+                # Parents without a uuid are found by _find_parent instead
+                self._parents.pop(node_uuid, None)
+    
+    def _unindex_node(self, node):
+        node_uuid = _uuid_of(node.value)
+        if node_uuid is not None:
+            self._nodes.pop(node_uuid, None)
+            self._parents.pop(node_uuid, None)
         
     def insert(self, value, range_start, range_end):
-        new_node = NaryRangeTreeNode(value, range_start, range_end)
-        self._insert_recursive(self.root, new_node)
+        value_uuid = _uuid_of(value)
+        if value_uuid is not None and value_uuid in self._nodes:
+            raise ValueError(f"Node with uuid {value_uuid} already in tree.")
+        new_node = self._new_node(value, range_start, range_end)
+        with self.batch():
+            self._insert_recursive(self.root, new_node)
+        return new_node
+    
+    def insert_many(self, intervals):
+        """Insert (value, range_start, range_end) triples as a single transaction.
+        
+        The whole batch is validated against itself and against the tree before anything is
+        inserted; every violation is raised together as InvalidIntervals and the tree is left
+        unchanged. Returns the new nodes in sorted order.
+        """
+        ordered = sorted(intervals, key=_interval_sort_key)
+        errors = self._duplicate_uuid_errors(ordered)
+        ranges, points = _split_points(ordered)
+        errors += self._nest_sorted(ranges)[1]
+        for value, range_start, range_end in ranges:
+            try:
+                self._locate(self.root, value, range_start, range_end)
+            except (OverlappingSkills, ActionHasChildren) as e:
+                errors.append(e)
+        if errors:
+            raise InvalidIntervals(errors)
+        
+        with self.batch():
+            recorded = len(self._pending_events)
+            # Validity of ranges only depends on pairs of ranges, so applying them in sorted order cannot fail
+            new_nodes = [self._insert_recursive(self.root, self._new_node(value, range_start, range_end))
+                         for value, range_start, range_end in ranges]
+            point_nodes, errors = self._insert_points(points)
+            new_nodes += point_nodes
+            if errors:
+                # Points can still clash with each other on a boundary; undo the whole batch
+                for node in reversed(new_nodes):
+                    self._remove_node(node)
+                # None of the nodes stayed in the tree, so subscribers hear of none of them
+                del self._pending_events[recorded:]
+                raise InvalidIntervals(errors)
+        return new_nodes
+    
+    def pop_many(self, node_uuids):
+        """Pop every node in node_uuids, or none of them if any uuid is missing."""
+        missing = [node_uuid for node_uuid in node_uuids if node_uuid not in self._nodes]
+        if missing:
+            raise ValueError(f"Nodes with uuids {missing} not found.")
+        with self.batch():
+            recorded = len(self._pending_events)
+            before = self.snapshot()
+            try:
+                return [self.pop_by_uuid(node_uuid) for node_uuid in node_uuids]
+            except ActionHasChildren:
+                # A pop can still be refused once earlier ones have moved nodes around. The
+                # tree is as it was, so subscribers hear of none of it
+                self.restore(before)
+                del self._pending_events[recorded:]
+                raise
+                    
+    def fill_segments(self, range_start, range_end):
+        """Split [range_start, range_end) at every node boundary inside it.
+        
+        The per-frame units of each piece would all land under the same parent, so each piece
+        can be inserted as a single ActionRunUnit instead.
+        """
+        cuts = {range_start, range_end}
+        for node in self.iter_nodes(range_start = range_start, range_end = range_end):
+            for bound in (node.range_start, node.range_end):
+                if range_start < bound < range_end:
+                    cuts.add(bound)
+        cuts = sorted(cuts)
+        return list(zip(cuts, cuts[1:]))
+    
+    def split_run(self, node_uuid, frame):
+        """Split the ActionRunUnit node_uuid into the runs before frame and from frame on.
+        
+        Returns the popped run node and the nodes that replace it.
+        """
+        run_node = self._get_run(node_uuid)
+        return self._replace_run(run_node, run_node.value.split(frame))
+    
+    def pop_run_frame(self, node_uuid, frame):
+        """Delete a single frame from the ActionRunUnit node_uuid.
+        
+        Returns the popped run node and the (up to two) runs left on either side of frame.
+        """
+        run_node = self._get_run(node_uuid)
+        return self._replace_run(run_node, run_node.value.split(frame, drop_frame=True))
+    
+    def _get_run(self, node_uuid):
+        run_node = self.get_by_uuid(node_uuid)
+        if not isinstance(run_node.value, ActionRunUnit):
+            raise ValueError(f"Node {run_node} is not an action run.")
+        return run_node
+    
+    def _replace_run(self, run_node, runs):
+        with self.batch():
+            self._remove_node(run_node)
+            # The parts lie within the old run, which had no children, so they cannot clash
+            return run_node, [self._insert_recursive(self.root, self._new_node(run, run.frame_start, run.frame_end))
+                              for run in runs if run is not None]
                     
     def _insert_recursive(self, current_node, new_node):
-        children = current_node.children
-        addedAsRoot = False
-        i = 0
-        #print("Current children:", [child.value for child in children])
-        while i < len(children):
-            child = children[i]
-            #print(f"Checking {new_node.value} against {child.value}")
-            # check for overlap (invalid)
-            if self._has_overlap(child, new_node.range_start, new_node.range_end):
-                raise OverlappingSkills(new_node.value, new_node.range_start, new_node.range_end, child.value, child.range_start, child.range_end)
-            # node less than current node
-            elif new_node.range_start < child.range_start and new_node.range_end <= child.range_start:
-                #print("Node less than current node")
-                children.insert(i, new_node)
-                
-                return
-            # node should be child of root node
-            elif new_node.range_start >= child.range_start and new_node.range_end <= child.range_end:
-                if type(child.value) is ActionUnit:
-                    raise ActionHasChildren(child.value.name)
-                #print("Node should be child of root node")
-                self._insert_recursive(child, new_node)
-                return
-            # node should be new root node
-            if new_node.range_start <= child.range_start and new_node.range_end >= child.range_end:
-                if type(new_node.value) is ActionUnit:
-                    raise ActionHasChildren(new_node.value.name)
-                #print("Node should be new root node")
-                # If we hit this once already, hitting it again would add duplicates!
-                old_child = children.pop(i)
-                if not addedAsRoot:
-                    children.insert(i, new_node)
-                    i+=1
-                addedAsRoot = True
-                # TODO: change to rerun insert?
-                new_node.children.append(old_child)
-                # do NOT return here- there may be more children to move
-            else:
-                i+=1
-                #print("Other case??")
+        parent, adopted_start, num_adopted = self._locate(current_node, new_node.value, new_node.range_start, new_node.range_end)
+        parent = self._own(parent)
+        children = self._writable_children(parent)
+        if num_adopted:
+            adopted = list(children.islice(adopted_start, adopted_start+num_adopted))
+            del children[adopted_start:adopted_start+num_adopted]
+            new_node.children = _child_list(adopted)
+            for child in adopted:
+                self._index_node(child, new_node)
+        children.add(new_node)
+        self._index_node(new_node, parent)
+        if self._boundary_index is not None:
+            self._boundary_index.add(new_node)
+        if self._listeners:
+            level = self.level_of(parent) + 1
+            self._emit(NaryRangeTreeEvent.INSERTED, new_node, parent, level)
+            for child in new_node.children:
+                self._emit_moved(child, new_node, parent, level + 1)
+        return new_node
+    
+    def _locate(self, current_node, value, range_start, range_end):
+        """Find where a new range belongs below current_node without changing the tree.
         
-        #node greater than all other nodes
-        if not addedAsRoot:
-            #print("Node greater than all other nodes. Appending")
-            children.append(new_node)
+        Returns the parent node and the index and number of its children the new node
+        would adopt, or raises OverlappingSkills/ActionHasChildren.
+        """
+        while True:
+            children = current_node.children
+            # Only siblings touching [range_start, range_end] can contain, overlap or be adopted
+            # by the new node, and they form one contiguous block of the sorted children
+            lo, hi = self._touching_children(children, range_start, range_end)
+            adopted_start = None
+            num_adopted = 0
+            descend_into = None
+            for i in range(lo, hi):
+                child = children[i]
+                # check for overlap (invalid)
+                if self._has_overlap(child, range_start, range_end):
+                    raise OverlappingSkills(value, range_start, range_end, child.value, child.range_start, child.range_end)
+                # node less than current node: every later sibling is after it as well
+                elif range_start < child.range_start and range_end <= child.range_start:
+                    break
+                # node should be child of current child
+                elif range_start >= child.range_start and range_end <= child.range_end:
+                    if _is_action(child.value):
+                        if _is_end_point(range_start, range_end, child.range_start, child.range_end):
+                            continue
+                        raise ActionHasChildren(child.value.name)
+                    descend_into = child
+                    break
+                # node should be new root node of the current child
+                elif range_start <= child.range_start and range_end >= child.range_end:
+                    if _is_action(value):
+                        raise ActionHasChildren(value.name)
+                    if adopted_start is None:
+                        adopted_start = i
+                    num_adopted += 1
             
+            if descend_into is not None:
+                current_node = descend_into
+                continue
+            return current_node, adopted_start, num_adopted
+    
+    def _touching_children(self, children, range_start, range_end):
+        # Index range of the children whose closed range intersects [range_start, range_end]
+        lo = children.bisect_key_left(range_start)
+        # At most one sibling starts before range_start and still reaches it
+        if lo > 0 and children[lo-1].range_end >= range_start:
+            lo -= 1
+        hi = children.bisect_key_right(range_end)
+        return lo, hi
 
     def _has_overlap(self, node, range_start, range_end):
         # TODO: Handle singles
@@ -98,8 +702,8 @@ class NaryRangeTree:
             raise ValueError(f"Node with value {value} not found.")
     
     def pop(self, value):
-        result = self._retrieve_recursive(self.root, value, popValue = True)
-        print("Result:", result)
+        with self.batch():
+            result = self._retrieve_recursive(self.root, value, popValue = True)
         if result:
             return result
         else:
@@ -116,15 +720,9 @@ class NaryRangeTree:
                 or (not callable(value) and value and child.value == value):
                 #print("Found")
                 if popValue:
-                    found_child = children.pop(i)
-                    dangling_children = found_child.children
-                    #print("Dangling children",dangling_children)
-                    if dangling_children:
-                        initPosition = i
-                        while dangling_children:
-                            #print("Inserting dangling child",initPosition)
-                            children.insert(initPosition, dangling_children.pop())
-                            print(children)
+                    self._check_release(current_node, child)
+                    current_node = self._own(current_node)
+                    found_child = self._release_children(current_node, current_node.children.pop(i))
                 else:
                     found_child = children[i]
                 return found_child
@@ -136,18 +734,197 @@ class NaryRangeTree:
                 return found_value
         return found_value
     
-    def query_value_with_tightest_range_containing(self, num_in_range):
-        return self._query_tightest_range_containing_recursive(self.root, num_in_range)
+    def get_by_uuid(self, node_uuid):
+        node = self._nodes.get(node_uuid)
+        if node is None:
+            raise ValueError(f"Node with uuid {node_uuid} not found.")
+        return node
     
-    def _query_tightest_range_containing_recursive(self, current_node, num_in_range):
-        children = current_node.children
-        current_best_node = current_node
+    def pop_by_uuid(self, node_uuid):
+        node = self.get_by_uuid(node_uuid)
+        with self.batch():
+            return self._remove_node(node)
+    
+    def _remove_node(self, node):
+        parent = self._parent_of(node)
+        self._check_release(parent, node)
+        parent = self._own(parent)
+        self._remove_child(parent, node)
+        return self._release_children(parent, node)
+    
+    def _find_parent(self, node):
+        # Fallback for values without a uuid: search every ancestor candidate touching the node
+        stack = [self.root]
+        while stack:
+            current_node = stack.pop()
+            children = current_node.children
+            lo, hi = self._touching_children(children, node.range_start, node.range_end)
+            for child in children.islice(lo, hi):
+                if child is node:
+                    return current_node
+                if child.range_start <= node.range_start and node.range_end <= child.range_end:
+                    stack.append(child)
+        raise ValueError(f"Node {node} not found.")
+    
+    def _remove_child(self, parent, node):
+        children = parent.children
+        # Siblings have distinct starts, so the bisect lands exactly on the node
+        i = children.bisect_key_left(node.range_start)
+        if i >= len(children) or children[i] is not node:
+            raise ValueError(f"Node {node} is not a child of {parent}.")
+        del children[i]
+    
+    def _boundary_points(self, node):
+        # Single frame children on node's own start or end, which can touch the siblings beyond it
+        children = node.children
+        if not children:
+            return []
+        points = [child for child in (children[0], children[-1])
+                  if child.range_start == child.range_end and child.range_start in (node.range_start, node.range_end)]
+        return points[:1] if len(points) == 2 and points[0] is points[1] else points
+    
+    def _check_release(self, parent, node):
+        # Nest node's boundary points among its siblings without changing anything, so that a
+        # pop that would leave a single frame at the start of an action fails before it begins
+        for point in self._boundary_points(node):
+            probe = NaryRangeTreeNode(None, float("-inf"), float("inf"))
+            children = parent.children
+            lo, hi = self._touching_children(children, point.range_start, point.range_end)
+            probe.children = _child_list([child for child in children.islice(lo, hi) if child is not node])
+            self._locate(probe, point.value, point.range_start, point.range_end)
+    
+    def _release_children(self, parent, node):
+        # Dangling children fit exactly in the gap left by their old parent, except single frames
+        # on its boundary: those may belong inside the sibling beyond it, so they are nested again
+        points = self._boundary_points(node)
+        released = [child for child in node.children if not any(child is point for point in points)]
+        parent.children.update(released)
+        for child in released:
+            self._index_node(child, parent)
+        if self._listeners:
+            level = self.level_of(parent) + 1
+            self._emit(NaryRangeTreeEvent.REMOVED, node, parent, level)
+            for child in released:
+                self._emit_moved(child, parent, node, level)
+        for point in points:
+            new_parent = self._own(self._locate(parent, point.value, point.range_start, point.range_end)[0])
+            self._writable_children(new_parent).add(point)
+            self._index_node(point, new_parent)
+            if self._listeners:
+                self._emit_moved(point, new_parent, node, self.level_of(new_parent) + 1)
+        self._unindex_node(node)
+        if self._boundary_index is not None:
+            self._boundary_index.remove(node)
+        # A node shared with a snapshot keeps its children there, the caller gets a bare copy
+        if node.owner is not self._owner:
+            node = self._new_node(node.value, node.range_start, node.range_end)
+        node.children = _NO_CHILDREN
+        return node
+    
+    def query_value_with_tightest_range_containing(self, num_in_range, value_type = None):
+        # With value_type, stops above the first node of another type (e.g. the action under a skill)
+        return self._query_tightest_range_containing_recursive(self.root, num_in_range, value_type)
+    
+    def query_run_containing(self, frame):
+        """The ActionRunUnit node whose frames include frame, or None.
         
-        for child in children:
-            if child.range_start <= num_in_range and child.range_end >= num_in_range:
-                return self._query_tightest_range_containing_recursive(child, num_in_range)
-            
-        return current_best_node
+        Runs that touch (as fill_segments makes them) both contain their shared boundary as a
+        range, and the tightest range query picks the earlier one; only the later one holds
+        the frame itself.
+        """
+        for node in self.range_query(frame, frame):
+            if isinstance(node.value, ActionRunUnit) and frame in node.value.frames:
+                return node
+        return None
+    
+    def _query_tightest_range_containing_recursive(self, current_node, num_in_range, value_type = None):
+        child = self._child_containing(current_node, num_in_range)
+        while child is not None and (value_type is None or child.value.type == value_type):
+            current_node = child
+            child = self._child_containing(current_node, num_in_range)
+        return current_node
+    
+    def gaps(self, node = None, range_start = None, range_end = None):
+        """The parts of [range_start, range_end] not covered by any child of node, in order.
+        
+        node defaults to the root and the window to node's own range. Returns (start, end)
+        pairs with start < end; only the children touching the window are visited.
+        """
+        if node is None:
+            node = self.root
+        if range_start is None:
+            range_start = node.range_start
+        if range_end is None:
+            range_end = node.range_end
+        gaps = []
+        position = range_start
+        children = node.children
+        lo, hi = self._touching_children(children, range_start, range_end)
+        for child in children.islice(lo, hi):
+            if child.range_start > position:
+                gaps.append((position, min(child.range_start, range_end)))
+            position = max(position, child.range_end)
+        if position < range_end:
+            gaps.append((position, range_end))
+        return gaps
+
+    def frame_labels(self, num_frames, frame_start = 0, name_ids = None):
+        """Name ids of the nodes covering each frame, one row per depth.
+
+        Returns (labels, name_ids): labels is an int32 NumPy array of shape (depth, num_frames)
+        whose row d holds the nodes at level d+1 and whose column i is frame frame_start+i,
+        with -1 where no node at that depth covers the frame. A node covers the frames from
+        its start up to but not including its end, so per-frame actions label one frame each,
+        and a single-frame node covers its own frame. Action runs count as one node. name_ids
+        maps names to ids; new names get the next free id, and the caller's dict is not changed.
+        """
+        frame_end = frame_start + num_frames
+        name_ids = {} if name_ids is None else dict(name_ids)
+        levels, starts, ends, ids = [], [], [], []
+        for node, level in self.iter_nodes(levels = True, range_start = frame_start, range_end = frame_end):
+            name = getattr(node.value, "name", node.value)
+            ids.append(name_ids.setdefault(name, len(name_ids)))
+            levels.append(level)
+            starts.append(node.range_start)
+            ends.append(node.range_end)
+        if not levels:
+            return np.full((0, num_frames), -1, dtype=np.int32), name_ids
+
+        levels = np.array(levels)
+        starts = np.array(starts, dtype=float)
+        ends = np.array(ends, dtype=float)
+        first = np.ceil(starts)
+        # A single frame only covers a frame when it sits exactly on one
+        stop = np.where(starts == ends, first + (first == starts), np.ceil(ends))
+        first = np.clip(first - frame_start, 0, num_frames).astype(np.int64)
+        stop = np.clip(stop - frame_start, 0, num_frames).astype(np.int64)
+
+        # Nodes at one depth never share a frame, so laying the rows end to end turns the paint
+        # into one lookup of the last node starting at or before each cell
+        offsets = (levels - 1) * num_frames
+        keep = stop > first
+        first, stop, ids = (first + offsets)[keep], (stop + offsets)[keep], np.array(ids)[keep]
+        order = np.argsort(first, kind="stable")
+        first, stop, ids = first[order], stop[order], ids[order]
+        depth = int(levels.max())
+        if not len(ids):
+            return np.full((depth, num_frames), -1, dtype=np.int32), name_ids
+        cells = np.arange(depth * num_frames)
+        covering = np.searchsorted(first, cells, side="right") - 1
+        covered = covering >= 0
+        covered[covered] = cells[covered] < stop[covering[covered]]
+        labels = np.where(covered, ids[np.maximum(covering, 0)], -1).astype(np.int32)
+        return labels.reshape(depth, num_frames), name_ids
+
+    def _child_containing(self, current_node, num_in_range):
+        # First child (in order) whose range contains num_in_range, if any
+        children = current_node.children
+        i = children.bisect_key_left(num_in_range)
+        if i > 0 and children[i-1].range_end >= num_in_range:
+            return children[i-1]
+        if i < len(children) and children[i].range_start == num_in_range:
+            return children[i]
+        return None
     
     def loose_range_query(self, range_start, range_end):
         result = []
@@ -158,24 +935,93 @@ class NaryRangeTree:
         if (range_start <= current_node.range_start and  current_node.range_start <= range_end) \
             or (range_start <= current_node.range_end and current_node.range_end <= range_end):
             result.append(current_node.value)
-        for child in current_node.children:
+        # A node's range bounds its whole subtree, so only children touching the window can match
+        lo, hi = self._subtree_touching_children(current_node, range_start, range_end)
+        for child in current_node.children.islice(lo, hi):
             self._loose_range_query_recursive(child, range_start, range_end, result)
+    
+    def range_query(self, range_start, range_end, depth = None, levels = False, expand_runs = False):
+        """Nodes whose range intersects [range_start, range_end], in pre-order.
+        
+        With depth set, only nodes at that level (top-level nodes are level 1) are returned.
+        Subtrees outside the window are never visited.
+        """
+        nodes = self.iter_nodes(levels = True, max_depth = depth, range_start = range_start, range_end = range_end, expand_runs = expand_runs)
+        return [(node, level) if levels else node for node, level in nodes if depth is None or level == depth]
+    
+    def subtree_bounds(self, node = None):
+        """Smallest and largest frame covered by node's subtree (the whole tree by default)."""
+        if node is None:
+            node = self.root
+        if node is not self.root:
+            # Children always lie within their parent, so a node's range bounds its subtree
+            return node.range_start, node.range_end
+        children = node.children
+        if not children:
+            return None
+        # Siblings are ordered by start and by end alike
+        return children[0].range_start, children[-1].range_end
+    
+    def _subtree_touching_children(self, current_node, range_start, range_end):
+        bounds = self.subtree_bounds(current_node)
+        if bounds is None or bounds[1] < range_start or bounds[0] > range_end:
+            return 0, 0
+        return self._touching_children(current_node.children, range_start, range_end)
 
     def traverse(self, levels = False):
-        nodes = []
-        if levels:
-            self._traverse_recursive(self.root, nodes, 0)
-        else:
-            self._traverse_recursive(self.root, nodes, -1)
-        return nodes[1:]
-
-    def _traverse_recursive(self, current_node, nodes, level):
-        if level >= 0:
-            nodes.append((current_node, level))
-        else:
-            nodes.append(current_node)
-        for child in current_node.children:
-            self._traverse_recursive(child, nodes, level+1 if level >= 0 else -1)
+        return list(self.iter_nodes(levels = levels))
+    
+    def iter_nodes(self, levels = False, max_depth = None, range_start = None, range_end = None, value_type = None, node = None, expand_runs = False):
+        """Lazily yield the nodes below node (the root by default) in pre-order.
+        
+        Levels count from 1 for node's children. max_depth stops the descent at that level,
+        range_start/range_end only visit nodes intersecting the window and value_type only
+        yields values whose type ("action" or "skill") matches, while still descending into
+        the others. With expand_runs, each ActionRunUnit is replaced by detached nodes for
+        its per-frame units (only those in the window). The tree must not be modified while
+        the iterator is in use.
+        """
+        if node is None:
+            node = self.root
+        if range_start is None:
+            range_start = float("-inf")
+        if range_end is None:
+            range_end = float("inf")
+        # A stack of child iterators keeps memory proportional to the depth, not the tree size
+        stack = [(self._iter_children(node, range_start, range_end), 1)]
+        while stack:
+            children, level = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                continue
+            if value_type is None or child.value.type == value_type:
+                if expand_runs and isinstance(child.value, ActionRunUnit):
+                    for frame_node in self.expand_run(child, range_start, range_end):
+                        yield (frame_node, level) if levels else frame_node
+                else:
+                    yield (child, level) if levels else child
+            if child.children and (max_depth is None or level < max_depth):
+                stack.append((self._iter_children(child, range_start, range_end), level+1))
+    
+    @staticmethod
+    def expand_run(run_node, range_start = float("-inf"), range_end = float("inf")):
+        """Detached nodes for the per-frame units of an ActionRunUnit node touching the window."""
+        # Frame f covers [f, f+1], so it touches the window when f+1 >= range_start and f <= range_end
+        run = run_node.value
+        frames = run.frames
+        first = max(frames.start, math.ceil(range_start) - 1) if range_start > float("-inf") else frames.start
+        last = min(frames.stop, math.floor(range_end) + 1) if range_end < float("inf") else frames.stop
+        for frame in range(first, last):
+            yield NaryRangeTreeNode(run.frame_unit(frame), frame, frame + 1)
+    
+    def _iter_children(self, current_node, range_start, range_end):
+        if range_start == float("-inf") and range_end == float("inf"):
+            # Plain iteration never builds the list's positional index, so a snapshot can be
+            # walked from another thread (e.g. while saving) without writing to shared nodes
+            return iter(current_node.children)
+        lo, hi = self._subtree_touching_children(current_node, range_start, range_end)
+        return current_node.children.islice(lo, hi)
 
 # New NaryRangeTree tests
 class Overlap(unittest.TestCase):
@@ -234,6 +1080,498 @@ class InsertionDeletionProperLocations(unittest.TestCase):
         TestMethods.assertLocation(self, tree, NaryRangeTreeNode("B2",5,10), 1, 1)
         TestMethods.assertLocation(self, tree, NaryRangeTreeNode("C",10,11), 1, 2)
         
+class AdoptionKeepsSiblings(unittest.TestCase):
+    # Test that wrapping some siblings neither duplicates the new node nor disturbs later siblings
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert("A", 1, 2)
+        tree.insert("B", 2, 3)
+        tree.insert("C", 5, 6)
+        tree.insert("D", 0, 4)
+        
+        self.assertEqual([node.value for node in tree.traverse()], ["D", "A", "B", "C"])
+        TestMethods.assertLocation(self, tree, NaryRangeTreeNode("D",0,4), 1, 0)
+        TestMethods.assertLocation(self, tree, NaryRangeTreeNode("A",1,2), 2, 0)
+        TestMethods.assertLocation(self, tree, NaryRangeTreeNode("B",2,3), 2, 1)
+        TestMethods.assertLocation(self, tree, NaryRangeTreeNode("C",5,6), 1, 1)
+        
+        # A failed insert must leave the tree untouched
+        with self.assertRaises(OverlappingSkills):
+            tree.insert("ERR", -1, 5.5)
+        with self.assertRaises(OverlappingSkills):
+            tree.insert("ERR", 1.5, 5.5)
+        self.assertEqual([node.value for node in tree.traverse()], ["D", "A", "B", "C"])
+        TestMethods.assertLocation(self, tree, NaryRangeTreeNode("C",5,6), 1, 1)
+
+class TightestRangeContaining(unittest.TestCase):
+    # Test that the query descends to the innermost range, preferring the earlier of two touching siblings
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert("A", 0, 10)
+        tree.insert("B", 2, 4)
+        tree.insert("C", 4, 6)
+        
+        self.assertEqual(tree.query_value_with_tightest_range_containing(3).value, "B")
+        self.assertEqual(tree.query_value_with_tightest_range_containing(4).value, "B")
+        self.assertEqual(tree.query_value_with_tightest_range_containing(5).value, "C")
+        self.assertEqual(tree.query_value_with_tightest_range_containing(8).value, "A")
+        self.assertIsNone(tree.query_value_with_tightest_range_containing(11).value)
+
+class UuidIndex(unittest.TestCase):
+    # Test that uuid lookups and pops keep the index and parents in sync with the tree
+    def test(self):
+        tree = NaryRangeTree()
+        
+        skill_node = SkillUnit("uuid1", "A", 0, 10)
+        action_node_1 = ActionUnit("uuid2", "B", 1, 2)
+        action_node_2 = ActionUnit("uuid3", "C", 2, 3)
+        tree.insert(action_node_1, 1, 2)
+        tree.insert(action_node_2, 2, 3)
+        tree.insert(skill_node, 0, 10)
+        
+        self.assertIs(tree.get_by_uuid("uuid2").value, action_node_1)
+        self.assertIs(tree._parent_of(tree.get_by_uuid("uuid2")), tree.get_by_uuid("uuid1"))
+        with self.assertRaises(ValueError):
+            tree.insert(ActionUnit("uuid2", "B", 20, 21), 20, 21)
+        
+        popped = tree.pop_by_uuid("uuid1")
+        self.assertIs(popped.value, skill_node)
+        self.assertEqual(len(popped.children), 0)
+        with self.assertRaises(ValueError):
+            tree.get_by_uuid("uuid1")
+        self.assertIs(tree._parent_of(tree.get_by_uuid("uuid2")), tree.root)
+        self.assertIs(tree._parent_of(tree.get_by_uuid("uuid3")), tree.root)
+        self.assertEqual([node.value for node in tree.root.children], [action_node_1, action_node_2])
+        
+        # The predicate fallback keeps the index in sync as well
+        tree.pop(lambda value: value.uuid == "uuid3")
+        with self.assertRaises(ValueError):
+            tree.pop_by_uuid("uuid3")
+        self.assertEqual(list(tree._nodes), ["uuid2"])
+
+class RangeQuery(unittest.TestCase):
+    # Test window queries against a brute-force scan of the tree
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert("A", 0, 10)
+        tree.insert("B", 1, 3)
+        tree.insert("C", 3, 6)
+        tree.insert("D", 4, 5)
+        tree.insert("E", 12, 15)
+        tree.insert("F", 20, 30)
+        
+        for range_start in range(-2, 32):
+            for range_end in range(range_start, 32):
+                expected = [(node.value, level) for node, level in tree.traverse(levels=True)
+                            if node.range_start <= range_end and node.range_end >= range_start]
+                result = [(node.value, level) for node, level in tree.range_query(range_start, range_end, levels=True)]
+                self.assertEqual(result, expected, f"[{range_start},{range_end}]")
+                
+                expected_depth = [value for value, level in expected if level == 2]
+                self.assertEqual([node.value for node in tree.range_query(range_start, range_end, depth=2)], expected_depth)
+                
+                expected_loose = [node.value for node in tree.traverse()
+                                  if range_start <= node.range_start <= range_end or range_start <= node.range_end <= range_end]
+                self.assertEqual(tree.loose_range_query(range_start, range_end), expected_loose)
+        
+        self.assertEqual(tree.subtree_bounds(), (0, 30))
+        self.assertEqual(NaryRangeTree().subtree_bounds(), None)
+
+class IterNodes(unittest.TestCase):
+    # Test the lazy traversal filters and that deep trees do not hit the recursion limit
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 0, 10), 0, 10)
+        tree.insert(ActionUnit("uuid2", "B", 1, 2), 1, 2)
+        tree.insert(SkillUnit("uuid3", "C", 3, 6), 3, 6)
+        tree.insert(ActionUnit("uuid4", "D", 4, 5), 4, 5)
+        tree.insert(ActionUnit("uuid5", "E", 12, 15), 12, 15)
+        
+        names = lambda nodes: [node.value.name for node in nodes]
+        self.assertEqual(names(tree.iter_nodes()), ["A", "B", "C", "D", "E"])
+        self.assertEqual(names(tree.iter_nodes(max_depth=2)), ["A", "B", "C", "E"])
+        self.assertEqual(names(tree.iter_nodes(value_type="action")), ["B", "D", "E"])
+        self.assertEqual(names(tree.iter_nodes(range_start=4, range_end=11)), ["A", "C", "D"])
+        self.assertEqual(names(tree.iter_nodes(node=tree.get_by_uuid("uuid3"))), ["D"])
+        self.assertEqual([level for node, level in tree.iter_nodes(levels=True)], [1, 2, 2, 3, 1])
+        self.assertEqual(tree.traverse(levels=True), list(tree.iter_nodes(levels=True)))
+        
+        # Stopping early only visits what was consumed
+        self.assertEqual(next(tree.iter_nodes(value_type="skill")).value.name, "A")
+        
+        deep_tree = NaryRangeTree()
+        depth = 5000
+        # Inserting the innermost range first makes every insert wrap a single top-level node
+        for i in range(depth):
+            deep_tree.insert(f"N{i}", depth - i, depth + i)
+        deepest_node, deepest_level = list(deep_tree.iter_nodes(levels=True))[-1]
+        self.assertEqual((deepest_node.value, deepest_level), ("N0", depth))
+
+class FromIntervals(unittest.TestCase):
+    # Test that the bulk builder nests like repeated inserts and reports every violation at once
+    def test(self):
+        intervals = [("E", 12, 15), ("B", 1, 3), ("A", 0, 10), ("D", 4, 5), ("C", 3, 6), ("A2", 0, 10)]
+        
+        tree = NaryRangeTree()
+        for value, range_start, range_end in intervals:
+            tree.insert(value, range_start, range_end)
+        bulk_tree = NaryRangeTree.from_intervals(intervals)
+        self.assertEqual(bulk_tree.traverse(levels=True), tree.traverse(levels=True))
+        
+        # Skills end up above actions with an identical range, whatever the input order
+        action_node = ActionUnit("uuid1", "B", 0, 10)
+        skill_node = SkillUnit("uuid2", "A", 0, 10)
+        bulk_tree = NaryRangeTree.from_intervals([(action_node, 0, 10), (skill_node, 0, 10)])
+        self.assertEqual([(node.value.name, level) for node, level in bulk_tree.traverse(levels=True)], [("A", 1), ("B", 2)])
+        self.assertIs(bulk_tree._parent_of(bulk_tree.get_by_uuid("uuid1")), bulk_tree.get_by_uuid("uuid2"))
+        
+        invalid = [
+            ("A", 0, 10),
+            ("ERR1", 5, 15),
+            (ActionUnit("uuid3", "B", 20, 30), 20, 30),
+            (ActionUnit("uuid4", "C", 21, 22), 21, 22),
+            ("ERR2", 25, 35),
+            (ActionUnit("uuid3", "D", 40, 41), 40, 41),
+        ]
+        with self.assertRaises(InvalidIntervals) as context:
+            NaryRangeTree.from_intervals(invalid)
+        errors = context.exception.errors
+        self.assertEqual(len(errors), 4)
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertEqual(errors[1], OverlappingSkills("ERR1", 5, 15, "A", 0, 10))
+        self.assertEqual(errors[2], ActionHasChildren("B"))
+        self.assertIsInstance(errors[3], OverlappingSkills)
+
+class InsertPopMany(unittest.TestCase):
+    # Test that batches are applied completely or not at all
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 0, 10), 0, 10)
+        tree.insert(ActionUnit("uuid2", "B", 20, 21), 20, 21)
+        
+        batch = [(ActionUnit(f"frame{frame}", "F", frame, frame+1), frame, frame+1) for frame in range(9, -1, -1)]
+        batch.append((SkillUnit("uuid3", "C", 2, 5), 2, 5))
+        nodes = tree.insert_many(batch)
+        self.assertEqual([node.value.name for node in nodes], ["F", "F", "C", "F", "F", "F", "F", "F", "F", "F", "F"])
+        self.assertEqual([(node.value.uuid, level) for node, level in tree.traverse(levels=True)][:6],
+                         [("uuid1", 1), ("frame0", 2), ("frame1", 2), ("uuid3", 2), ("frame2", 3), ("frame3", 3)])
+        
+        before = tree.traverse(levels=True)
+        invalid = [
+            (ActionUnit("uuid4", "D", 30, 31), 30, 31),
+            (ActionUnit("uuid5", "E", 5, 15), 5, 15),
+            (ActionUnit("uuid6", "G", 20, 21), 20, 21),
+            (SkillUnit("uuid7", "H", 29, 32), 29, 32),
+            (SkillUnit("uuid8", "I", 30.5, 35), 30.5, 35),
+        ]
+        with self.assertRaises(InvalidIntervals) as context:
+            tree.insert_many(invalid)
+        self.assertEqual(len(context.exception.errors), 3)
+        self.assertEqual(tree.traverse(levels=True), before)
+        with self.assertRaises(ValueError):
+            tree.get_by_uuid("uuid4")
+        
+        # Two actions on the same frame are only caught while applying, and are rolled back
+        points = [(SkillUnit("uuid9", "J", 50, 60), 50, 60),
+                  (ActionUnit("uuid10", "K", 55, 55), 55, 55),
+                  (ActionUnit("uuid11", "L", 55, 55), 55, 55)]
+        with self.assertRaises(InvalidIntervals):
+            tree.insert_many(points)
+        self.assertEqual(tree.traverse(levels=True), before)
+        with self.assertRaises(ValueError):
+            tree.get_by_uuid("uuid9")
+
+        with self.assertRaises(ValueError):
+            tree.pop_many(["uuid3", "missing"])
+        self.assertEqual(tree.traverse(levels=True), before)
+        
+        popped = tree.pop_many(["uuid3"] + [f"frame{frame}" for frame in range(10)])
+        self.assertEqual(len(popped), 11)
+        self.assertEqual([node.value.uuid for node in tree.traverse()], ["uuid1", "uuid2"])
+
+class ActionRuns(unittest.TestCase):
+    # Test that a run of per-frame actions behaves like the per-frame actions it replaces
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 0, 200), 0, 200)
+        run = ActionRunUnit("uuid2", "B", 10, 110)
+        tree.insert(run, 10, 110)
+        self.assertEqual(len(tree.traverse()), 2)
+        
+        frames = tree.range_query(50, 60, expand_runs=True, levels=True)
+        self.assertEqual([(node.range_start, level) for node, level in frames][1:], [(frame, 2) for frame in range(49, 61)])
+        self.assertEqual(frames[1][0].value.uuid, run.frame_uuid(49))
+        self.assertEqual(len(list(tree.iter_nodes(expand_runs=True))), 101)
+        
+        # A run is an action, so it cannot hold anything
+        with self.assertRaises(ActionHasChildren):
+            tree.insert(SkillUnit("uuid3", "C", 20, 30), 20, 30)
+        
+        popped, parts = tree.pop_run_frame("uuid2", 50)
+        self.assertIs(popped.value, run)
+        self.assertEqual([(node.value.uuid, node.range_start, node.range_end) for node in parts],
+                         [("uuid2", 10, 50), (run.frame_uuid(51), 51, 110)])
+        self.assertEqual([node.range_start for node in tree.iter_nodes(expand_runs=True)][1:], list(range(10, 50)) + list(range(51, 110)))
+        
+        self.assertEqual(tree.fill_segments(0, 30), [(0, 10), (10, 30)])
+        self.assertEqual(tree.fill_segments(150, 250), [(150, 200), (200, 250)])
+        
+        popped, parts = tree.split_run(run.frame_uuid(51), 60)
+        self.assertEqual([(node.range_start, node.range_end) for node in parts], [(51, 60), (60, 110)])
+        # The runs touch at 60, which only the later one holds as a frame
+        self.assertIs(tree.query_value_with_tightest_range_containing(60), parts[0])
+        self.assertIs(tree.query_run_containing(60), parts[1])
+        self.assertIs(tree.query_run_containing(59), parts[0])
+        self.assertIsNone(tree.query_run_containing(150))
+        popped, parts = tree.pop_run_frame("uuid2", 10)
+        self.assertEqual([(node.range_start, node.range_end) for node in parts], [(11, 50)])
+        with self.assertRaises(ValueError):
+            tree.pop_run_frame("uuid1", 15)
+
+class ChangeEvents(unittest.TestCase):
+    # Test that subscribers receive one batch of events per change, with levels after the change
+    def test(self):
+        tree = NaryRangeTree()
+        batches = []
+        tree.subscribe(batches.append)
+        summary = lambda: [(event.kind, event.node.value.uuid, event.level) for event in batches[-1]]
+        
+        tree.insert(SkillUnit("uuid1", "A", 0, 10), 0, 10)
+        tree.insert(ActionUnit("uuid2", "B", 2, 3), 2, 3)
+        tree.insert(SkillUnit("uuid3", "C", 1, 5), 1, 5)
+        self.assertEqual(summary(), [("inserted", "uuid3", 2), ("reparented", "uuid2", 3)])
+        tree.insert(SkillUnit("uuid4", "D", 0, 20), 0, 20)
+        self.assertEqual(summary(), [("inserted", "uuid4", 1), ("reparented", "uuid1", 2),
+                                     ("level_changed", "uuid3", 3), ("level_changed", "uuid2", 4)])
+        
+        tree.pop_by_uuid("uuid1")
+        self.assertEqual(summary(), [("removed", "uuid1", 2), ("reparented", "uuid3", 2), ("level_changed", "uuid2", 3)])
+        self.assertEqual(batches[-1][1].old_parent.value.uuid, "uuid1")
+        self.assertEqual([tree.level_of(node) for node in tree.traverse()], [1, 2, 3])
+        
+        # Rejected changes publish nothing, batches publish once
+        num_batches = len(batches)
+        with self.assertRaises(OverlappingSkills):
+            tree.insert(SkillUnit("uuid5", "E", 15, 25), 15, 25)
+        with self.assertRaises(InvalidIntervals):
+            tree.insert_many([(SkillUnit("uuid9", "J", 50, 60), 50, 60),
+                              (ActionUnit("uuid10", "K", 55, 55), 55, 55),
+                              (ActionUnit("uuid11", "L", 55, 55), 55, 55)])
+        self.assertEqual(len(batches), num_batches)
+        tree.insert_many([(ActionUnit(f"frame{frame}", "F", frame, frame+1), frame, frame+1) for frame in range(10, 15)])
+        self.assertEqual(len(batches), num_batches + 1)
+        self.assertEqual(len(batches[-1]), 5)
+        
+        # Subscribers are not saved along with the tree
+        restored = pickle.loads(pickle.dumps(tree))
+        restored.insert(SkillUnit("uuid6", "G", 30, 40), 30, 40)
+        self.assertEqual(len(batches), num_batches + 1)
+        
+        tree.clear()
+        self.assertEqual([event.kind for event in batches[-1]], ["reset"])
+
+class CompactNodes(unittest.TestCase):
+    # Test that slotted nodes and units round-trip through pickle, including the old dict format
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit(uuid.uuid4(), "A", 0, 10), 0, 10)
+        tree.insert(ActionUnit(uuid.uuid4(), "B", 1, 2), 1, 2)
+        tree.insert(ActionRunUnit("uuid3", "C", 3, 8), 3, 8)
+        leaf = tree.traverse()[1]
+        self.assertIs(leaf.children, tree.traverse()[2].children)
+        with self.assertRaises(TypeError):
+            leaf.children.add(NaryRangeTreeNode("D", 1, 1))
+        
+        restored = pickle.loads(pickle.dumps(tree))
+        self.assertEqual(restored.traverse(levels=True), tree.traverse(levels=True))
+        self.assertEqual([node.value.uuid for node in restored.traverse()], [node.value.uuid for node in tree.traverse()])
+        self.assertIs(type(restored.traverse()[2].value), ActionRunUnit)
+        restored.insert(SkillUnit("uuid4", "E", 12, 15), 12, 15)
+        self.assertIs(restored.get_by_uuid("uuid4").children, leaf.children)
+        
+        # Trees saved before __slots__ hold nested nodes and units with an attribute dict
+        unit = ActionUnit.__new__(ActionUnit)
+        unit.__setstate__({"uuid": "uuid5", "name": "F", "frame_start": 1, "frame_end": 2})
+        child = NaryRangeTreeNode.__new__(NaryRangeTreeNode)
+        child.__setstate__({"value": unit, "range_start": 1, "range_end": 2, "children": []})
+        root = NaryRangeTreeNode.__new__(NaryRangeTreeNode)
+        root.__setstate__({"value": None, "range_start": float("-inf"), "range_end": float("inf"), "children": [child]})
+        old_tree = NaryRangeTree.__new__(NaryRangeTree)
+        old_tree.__setstate__({"root": root})
+        self.assertIs(old_tree.get_by_uuid("uuid5"), child)
+        old_tree.insert(SkillUnit("uuid6", "G", 0, 5), 0, 5)
+        self.assertEqual([level for node, level in old_tree.traverse(levels=True)], [1, 2])
+
+class SharedChildLists(unittest.TestCase):
+    # Test that copies of a child list never see each other's changes, across sublist splits and merges
+    def test(self):
+        rng = random.Random(0)
+        original = _ChildList()
+        original._reset(4)
+        for start in rng.sample(range(1000), 200):
+            original.add(NaryRangeTreeNode(None, start, start))
+        lists = [original]
+        expected = [[node.range_start for node in original]]
+        for _ in range(2000):
+            i = rng.randrange(len(lists))
+            if rng.random() < 0.05:
+                lists.append(lists[i].copy())
+                expected.append(list(expected[i]))
+            elif rng.random() < 0.5 and expected[i]:
+                index = rng.randrange(len(expected[i]))
+                lists[i].pop(index)
+                del expected[i][index]
+            else:
+                start = rng.choice([start for start in range(1000, 1100) if start not in expected[i]] or [None])
+                if start is not None:
+                    lists[i].add(NaryRangeTreeNode(None, start, start))
+                    expected[i] = sorted(expected[i] + [start])
+            for children, starts in zip(lists, expected):
+                self.assertEqual([node.range_start for node in children], starts)
+        for children in lists:
+            children._check()
+
+class Snapshots(unittest.TestCase):
+    # Test that snapshots share nodes with the tree but never see its later changes
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 0, 10), 0, 10)
+        tree.insert(ActionUnit("uuid2", "B", 1, 2), 1, 2)
+        tree.insert(ActionRunUnit("uuid3", "C", 3, 8), 3, 8)
+        before = tree.snapshot()
+        self.assertIs(before.root, tree.root)
+        contents = before.traverse(levels=True)
+        
+        tree.insert(ActionUnit("uuid4", "D", 8, 9), 8, 9)
+        tree.pop_by_uuid("uuid1")
+        tree.pop_run_frame("uuid3", 5)
+        self.assertEqual(before.traverse(levels=True), contents)
+        self.assertEqual(before.get_by_uuid("uuid2").range_start, 1)
+        with self.assertRaises(ValueError):
+            before.get_by_uuid("uuid4")
+        # Only the changed path was copied
+        self.assertIs(tree.get_by_uuid("uuid2"), before.get_by_uuid("uuid2"))
+        
+        batches = []
+        tree.subscribe(batches.append)
+        after = tree.snapshot()
+        tree.restore(before)
+        self.assertEqual(tree.traverse(levels=True), contents)
+        self.assertEqual([event.kind for event in batches[-1]], ["reset"])
+        self.assertEqual(tree.level_of(tree.get_by_uuid("uuid2")), 2)
+        
+        # Editing the restored tree leaves the snapshot usable for a second restore
+        tree.pop_by_uuid("uuid2")
+        self.assertEqual(before.traverse(levels=True), contents)
+        tree.restore(after)
+        self.assertEqual([node.value.uuid for node in tree.traverse()], ["uuid2", "uuid3", tree.traverse()[2].value.uuid, "uuid4"])
+        tree.restore(before)
+        self.assertEqual(tree.traverse(levels=True), contents)
+
+class Boundaries(unittest.TestCase):
+    # Test stepping between range starts and ends as nodes are inserted, popped and restored
+    def test(self):
+        tree = NaryRangeTree.from_intervals([(SkillUnit("uuid1", "A", 0, 10), 0, 10), (ActionRunUnit("uuid2", "B", 2, 6), 2, 6)])
+        self.assertEqual(tree.next_boundary(-5), 0)
+        self.assertEqual(tree.next_boundary(2), 6)
+        self.assertEqual(tree.prev_boundary(6), 2)
+        self.assertIsNone(tree.next_boundary(10))
+        self.assertIsNone(tree.prev_boundary(0))
+        
+        before = tree.snapshot()
+        tree.insert(ActionUnit("uuid3", "C", 6, 8), 6, 8)
+        tree.pop_run_frame("uuid2", 3)
+        self.assertEqual([tree.next_boundary(frame) for frame in (2, 3, 4, 6)], [3, 4, 6, 8])
+        # A boundary shared by two nodes stays until both are gone
+        tree.pop_by_uuid("uuid3")
+        self.assertEqual(tree.next_boundary(5), 6)
+        tree.pop_by_uuid(tree.get_by_uuid("uuid2").value.frame_uuid(4))
+        self.assertEqual(tree.next_boundary(3), 10)
+        
+        tree.restore(before)
+        self.assertEqual(tree.next_boundary(2), 6)
+        self.assertEqual(before.prev_boundary(100), 10)
+
+class Gaps(unittest.TestCase):
+    # Test the uncovered parts of a node and of a window, and filling them under a skill
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 0, 20), 0, 20)
+        tree.insert(ActionUnit("uuid2", "B", 2, 4), 2, 4)
+        tree.insert(SkillUnit("uuid3", "C", 4, 8), 4, 8)
+        tree.insert(ActionUnit("uuid4", "D", 12, 12), 12, 12)
+        tree.insert(ActionUnit("uuid5", "E", 6, 7), 6, 7)
+        skill = tree.get_by_uuid("uuid1")
+        self.assertEqual(tree.gaps(skill), [(0, 2), (8, 12), (12, 20)])
+        self.assertEqual(tree.gaps(skill, 3, 10), [(8, 10)])
+        self.assertEqual(tree.gaps(range_start = -5, range_end = 25), [(-5, 0), (20, 25)])
+        self.assertEqual(tree.query_value_with_tightest_range_containing(6, value_type = "skill").value.uuid, "uuid3")
+        
+        # An action cannot start on a single frame node, so the fill is rejected as a whole
+        with self.assertRaises(InvalidIntervals):
+            tree.insert_many([(ActionRunUnit(f"run{i}", "F", start, end), start, end) for i, (start, end) in enumerate(tree.gaps(skill))])
+        tree.pop_by_uuid("uuid4")
+        tree.insert_many([(ActionRunUnit(f"run{i}", "F", start, end), start, end) for i, (start, end) in enumerate(tree.gaps(skill))])
+        self.assertEqual(tree.gaps(skill), [])
+        self.assertEqual(len(skill.children), 4)
+
+class ReleaseBoundaryPoints(unittest.TestCase):
+    # Test that single frames freed on a popped node's boundary are nested again
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 26, 28), 26, 28)
+        tree.insert(ActionUnit("uuid2", "B", 28, 28), 28, 28)
+        tree.insert(SkillUnit("uuid3", "C", 28, 31), 28, 31)
+        tree.pop_by_uuid("uuid1")
+        self.assertIs(tree._parent_of(tree.get_by_uuid("uuid2")), tree.get_by_uuid("uuid3"))
+        
+        # Next to an action starting there it has nowhere to go, so the pop is refused
+        tree.insert(SkillUnit("uuid4", "D", 20, 24), 20, 24)
+        tree.insert(ActionUnit("uuid5", "E", 24, 26), 24, 26)
+        tree.insert(ActionUnit("uuid6", "F", 24, 24), 24, 24)
+        contents = tree.traverse(levels=True)
+        root = tree.root
+        batches = []
+        tree.subscribe(batches.append)
+        with self.assertRaises(ActionHasChildren):
+            tree.pop_by_uuid("uuid4")
+        # Refused before anything changed, which is how the GUI knows not to log an undo step
+        self.assertIs(tree.root, root)
+        with self.assertRaises(ActionHasChildren):
+            tree.pop_many(["uuid3", "uuid4"])
+        self.assertEqual(tree.traverse(levels=True), contents)
+        self.assertEqual(batches, [])
+
+class FrameLabels(unittest.TestCase):
+    # Test the per-frame labels of each depth against a frame by frame walk of the tree
+    def test(self):
+        tree = NaryRangeTree()
+        tree.insert(SkillUnit("uuid1", "A", 0, 10), 0, 10)
+        tree.insert(ActionRunUnit("uuid2", "B", 0, 4), 0, 4)
+        tree.insert(SkillUnit("uuid3", "C", 5, 9), 5, 9)
+        tree.insert(ActionUnit("uuid4", "B", 6, 7), 6, 7)
+        tree.insert(ActionUnit("uuid5", "D", 9, 9), 9, 9)
+        tree.insert(SkillUnit("uuid6", "A", 12.5, 15), 12.5, 15)
+        labels, name_ids = tree.frame_labels(16)
+        self.assertEqual(name_ids, {"A": 0, "B": 1, "C": 2, "D": 3})
+        self.assertEqual(labels.tolist(), [
+            [ 0,  0,  0,  0,  0,  0,  0,  0,  0,  0, -1, -1, -1,  0,  0, -1],
+            [ 1,  1,  1,  1, -1,  2,  2,  2,  2, -1, -1, -1, -1, -1, -1, -1],
+            [-1, -1, -1, -1, -1, -1,  1, -1, -1,  3, -1, -1, -1, -1, -1, -1]])
+        
+        # A window keeps the ids it is given and only sees the nodes inside it
+        labels, window_ids = tree.frame_labels(4, frame_start = 5, name_ids = {"C": 0})
+        self.assertEqual(window_ids, {"C": 0, "A": 1, "B": 2, "D": 3})
+        self.assertEqual(labels.tolist(), [[1, 1, 1, 1], [0, 0, 0, 0], [-1, 2, -1, -1]])
+        self.assertEqual(tree.frame_labels(3, frame_start = 20)[0].shape, (0, 3))
+        
+        for frame in range(16):
+            for level in range(1, 4):
+                covering = [node.value.name for node, node_level in tree.traverse(levels=True) if node_level == level
+                            and (node.range_start <= frame < node.range_end or node.range_start == node.range_end == frame)]
+                expected = name_ids[covering[-1]] if covering else -1
+                self.assertEqual(tree.frame_labels(16)[0][level-1, frame], expected, msg = f"{frame},{level}")
+
 class NoActionChildren(unittest.TestCase):
     # Test that an action node cannot have children
     def test(self):
@@ -1,6 +1,10 @@
 import hashlib
+import sys
+import uuid as uuid_module
 
 class ActionUnit():
+    # Hundreds of thousands of units can be alive at once, so they carry no __dict__
+    __slots__ = ("uuid", "name", "frame_start", "frame_end")
     type = "action"
     full_valid_colors = [
         "#B52D4F",
@@ -30,7 +34,8 @@ class ActionUnit():
     
     def __init__(self, uuid, name, frame_start, frame_end):
         self.uuid = uuid
-        self.name = name
+        # Names repeat across units, so they share one string (and one pickle entry)
+        self.name = sys.intern(name)
         self.frame_start = frame_start
         self.frame_end = frame_end
         
@@ -51,7 +56,7 @@ class ActionUnit():
         return ActionUnit.name_to_color_map[self.name]
     
     def update(self, name, frame_start, frame_end):
-        self.name = name
+        self.name = sys.intern(name)
         self.frame_start = frame_start
         self.frame_end = frame_end
     
@@ -81,9 +86,61 @@ class ActionUnit():
     
     def __repr__(self):
         return f"[{self.type}]{self.name}({self.uuid}): [{self.frame_start},{self.frame_end}]"
+    
+    def __getstate__(self):
+        unit_uuid = self.uuid.bytes if isinstance(self.uuid, uuid_module.UUID) else self.uuid
+        return (unit_uuid, self.name, self.frame_start, self.frame_end)
+    
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Units pickled before __slots__ store their attribute dict
+            state = (state["uuid"], state["name"], state["frame_start"], state["frame_end"])
+        unit_uuid, name, self.frame_start, self.frame_end = state
+        self.uuid = uuid_module.UUID(bytes=unit_uuid) if isinstance(unit_uuid, bytes) else unit_uuid
+        self.name = sys.intern(name)
 
 
 class SkillUnit(ActionUnit):
+    __slots__ = ()
     type = "skill"
     def __init__(self, uuid, name, frame_start, frame_end):
-        super().__init__(uuid, name, frame_start, frame_end)
\ No newline at end of file
+        super().__init__(uuid, name, frame_start, frame_end)
+
+
+class ActionRunUnit(ActionUnit):
+    """An action repeated on every frame f in [frame_start, frame_end), i.e. the per-frame
+    units [f, f+1] made by "Fill Quick Action", stored as a single tree node."""
+    __slots__ = ()
+    type = "action"
+    def __init__(self, uuid, name, frame_start, frame_end):
+        super().__init__(uuid, name, frame_start, frame_end)
+    
+    @property
+    def frames(self):
+        return range(int(self.frame_start), int(self.frame_end))
+    
+    def frame_uuid(self, frame):
+        # Derived from the run, so expanding the same run twice gives the same uuids
+        return uuid_module.uuid5(uuid_module.NAMESPACE_OID, f"{self.uuid}:{frame}")
+    
+    def frame_unit(self, frame):
+        if frame not in self.frames:
+            raise ValueError(f"Frame {frame} is not part of {self}.")
+        return ActionUnit(self.frame_uuid(frame), self.name, frame, frame + 1)
+    
+    def split(self, frame, drop_frame=False):
+        """The runs before and from frame (after it with drop_frame), None where a part is empty.
+        
+        The first part keeps this run's uuid and the second takes the uuid of its first frame,
+        so splitting the same run at the same frame is repeatable (e.g. for redo).
+        """
+        if frame not in self.frames:
+            raise ValueError(f"Frame {frame} is not part of {self}.")
+        second_start = frame + 1 if drop_frame else frame
+        before = ActionRunUnit(self.uuid, self.name, self.frame_start, frame) if frame > self.frame_start else None
+        after = ActionRunUnit(self.frame_uuid(second_start), self.name, second_start, self.frame_end) if second_start < self.frame_end else None
+        return before, after
+    
+    def __repr__(self):
+        return f"[{self.type} run]{self.name}({self.uuid}): [{self.frame_start},{self.frame_end})"
+
@@ -6,6 +6,7 @@ import cv2
 
 import numpy as np
 from data_structure.naryrangetree import NaryRangeTree
+from data_structure.skillunit import ActionRunUnit, ActionUnit
 from example_model.skill import StackItem
 
 
@@ -23,10 +24,22 @@ def load_image_frame(file_path,frame):
             image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
     return image
 
+def has_image_frame(file_path, frame):
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        return f"{frame}.png" in zip_ref.namelist()
+
 def rescale(img):
     return img
     #return cv2.resize(img, (500, 500), interpolation=cv2.INTER_AREA)
 
+def expand_runs(children):
+    # The dataset is built from per-frame actions, so runs are unpacked back into them
+    for child in children:
+        if isinstance(child.value, ActionRunUnit):
+            yield from NaryRangeTree.expand_run(child)
+        else:
+            yield child
+
 def convert_skillhub_recursive(node: NaryRangeTree, path, root=False):
         stack = []
 
@@ -42,7 +55,7 @@ def convert_skillhub_recursive(node: NaryRangeTree, path, root=False):
         sub_func_name = None
                 
         if node.children:
-            for child in node.children:
+            for child in expand_runs(node.children):
                 if type(call_arg_vals) is type(None):
                     call_arg_vals = rescale(load_image_frame(path, child.value.frame_start))
                 
@@ -66,6 +79,9 @@ def convert_skillhub_recursive(node: NaryRangeTree, path, root=False):
 
         if not root:
             termination_frame = node.value.frame_end #+1
+            if isinstance(node.value, ActionUnit) and not has_image_frame(path, termination_frame):
+                # Runs are saved without the frame after their last one
+                termination_frame -= 1
             ret_arg_vals = rescale(load_image_frame(path, termination_frame))
             print("All Frames:", termination_frame)
         elif step_num == 1:
@@ -96,6 +112,21 @@ def load_skillsega(path):
     
     return convert_skillhub(path, naryrangetree)
 
+def load_frame_labels(path, name_ids=None):
+    """Per-frame labels at each depth of a .sega file, for per-frame supervision.
+
+    Covers frame 0 up to the last saved frame image; see NaryRangeTree.frame_labels.
+    Pass the model's fun_map as name_ids to keep its ids. Returns (labels, name_ids).
+    """
+    path = Path(path)
+
+    with zipfile.ZipFile(path, 'r') as zipf:
+        frames = [int(Path(name).stem) for name in zipf.namelist() if name.endswith(".png")]
+        with zipf.open("skilltree.pkl") as file:
+            naryrangetree = pickle.load(file)
+
+    return naryrangetree.frame_labels(max(frames, default=-1) + 1, name_ids=name_ids)
+
 def convert_skillhub(path: str, naryrangetree: NaryRangeTree):
     dataset: List[StackItem] = convert_skillhub_recursive(naryrangetree.root,path,True)
     
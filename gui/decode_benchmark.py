@@ -0,0 +1,56 @@
+import sys
+import time
+import cv2
+
+# This allows for the benchmark to be run from the repository root or from this folder
+try:
+    from gui.frame_reader import FrameReader
+except ImportError:
+    from frame_reader import FrameReader
+
+DECODE_FRAMES = 600
+
+def seek_every_frame(cap, frames):
+    # How playback used to read: the next frame, then the current one again, seeking to each
+    for frame in frames:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame + 1)
+        cap.read()
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        cap.read()
+
+def seek_once_per_frame(cap, frames):
+    for frame in frames:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        cap.read()
+
+def sequential_reads(cap, frames):
+    reader = FrameReader(cap)
+    for frame in frames:
+        reader.read(frame)
+
+def decode_fps(video_path, read_frames, first_frame, num_frames=DECODE_FRAMES):
+    """Frames played per second when reading num_frames frames from first_frame on."""
+    cap = cv2.VideoCapture(video_path)
+    frames = range(first_frame, first_frame + num_frames)
+    start_time = time.perf_counter()
+    read_frames(cap, frames)
+    elapsed = time.perf_counter() - start_time
+    cap.release()
+    return num_frames / elapsed
+
+def run_decode_benchmark(video_path, num_frames=DECODE_FRAMES):
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    starts = {"start": 0, "middle": max(0, frame_count // 2 - num_frames // 2)}
+    print(f"{'from':>8} {'seek twice (fps)':>18} {'seek once (fps)':>18} {'sequential (fps)':>18}")
+    for name, first_frame in starts.items():
+        results = [decode_fps(video_path, read_frames, first_frame, num_frames)
+                   for read_frames in (seek_every_frame, seek_once_per_frame, sequential_reads)]
+        print(f"{name:>8} " + " ".join(f"{fps:>18.1f}" for fps in results))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python decode_benchmark.py VIDEO [FRAMES]")
+        sys.exit(1)
+    run_decode_benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else DECODE_FRAMES)
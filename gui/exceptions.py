@@ -81,6 +81,22 @@ class FrameNotFound(Exception):
             return self.name == o.name
         return False
     
+class SaveInProgress(Exception):
+    type = "Warning"
+    def __init__(self, name):
+        self.name = name
+    
+    def __str__(self):
+        return f"Cannot save to '{self.name}' while another save is still running."
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+    
+    def __eq__(self, o: object) -> bool:
+        if isinstance(o, SaveInProgress):
+            return self.name == o.name
+        return False
+    
 class InvalidFile(Exception):
     type = "Error"
     def __init__(self, name):
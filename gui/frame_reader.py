@@ -0,0 +1,322 @@
+import bisect
+import json
+import os
+import cv2
+import numpy as np
+
+SEQUENTIAL_SKIP = 16
+SEEK_RETRIES = 3
+INDEX_SUFFIX = ".keyframes.json"
+INDEX_VERSION = 1
+PROXY_SUFFIX = ".proxy"
+PROXY_VERSION = 1
+PROXY_HEIGHT = 360
+PROXY_QUALITY = 80
+STORE_SUFFIX = ".frames"
+STORE_VERSION = 1
+STORE_HEIGHT = 720
+
+def load_sidecar(video_path, suffix, version):
+    """The data saved next to video_path with save_sidecar, or None if it is missing or stale."""
+    try:
+        with open(video_path + suffix, "r") as file:
+            data = json.load(file)
+        stat = os.stat(video_path)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != version or data.get("size") != stat.st_size or data.get("mtime") != stat.st_mtime:
+        return None
+    return data
+
+def save_sidecar(video_path, suffix, version, data):
+    # Stamped with the video's size and mtime, so an edited video is not paired with stale data
+    stat = os.stat(video_path)
+    data = {"version": version, "size": stat.st_size, "mtime": stat.st_mtime, **data}
+    try:
+        with open(video_path + suffix, "w") as file:
+            json.dump(data, file)
+    except OSError:
+        # E.g. a read-only folder, the data is then built again next time
+        pass
+
+class KeyframeIndex():
+    """Timestamps of every frame of a video and the frames decoding can start from.
+
+    Built once per video by reading its packets without decoding them, and kept in a sidecar
+    file next to it (video path + INDEX_SUFFIX) until the video changes.
+    """
+    def __init__(self, timestamps, keyframes):
+        self.timestamps = timestamps # msec of each frame, in display order
+        self.keyframes = keyframes # Sorted
+
+    def keyframe_before(self, frame):
+        i = bisect.bisect_right(self.keyframes, frame)
+        return self.keyframes[i-1] if i > 0 else 0
+
+    def frame_at(self, msec):
+        """The frame whose timestamp is closest to msec, or None for an empty video."""
+        i = bisect.bisect_left(self.timestamps, msec)
+        nearby = [j for j in (i-1, i) if 0 <= j < len(self.timestamps)]
+        if not nearby:
+            return None
+        return min(nearby, key=lambda j: abs(self.timestamps[j] - msec))
+
+    @classmethod
+    def scan(cls, video_path, cancelled=lambda: False):
+        """Index video_path, or return None if cancelled() turns true first."""
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        packet_times, keyframe_times = [], []
+        while cap.grab():
+            if cancelled():
+                cap.release()
+                return None
+            msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+            packet_times.append(msec)
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframe_times.append(msec)
+        cap.release()
+        # Packets come in decoding order, which differs from display order around B-frames
+        index = cls(sorted(packet_times), [])
+        index.keyframes = sorted({index.frame_at(msec) for msec in keyframe_times})
+        return index
+
+    @classmethod
+    def build(cls, video_path, cancelled=lambda: False):
+        """Scan video_path and save its sidecar index, or return None if cancelled first."""
+        index = cls.scan(video_path, cancelled)
+        if index is not None:
+            index.save(video_path)
+        return index
+
+    @classmethod
+    def load(cls, video_path):
+        """The sidecar index of video_path, or None if there is none or the video changed since."""
+        data = load_sidecar(video_path, INDEX_SUFFIX, INDEX_VERSION)
+        if data is None:
+            return None
+        return cls(data["timestamps"], data["keyframes"])
+
+    def save(self, video_path):
+        save_sidecar(video_path, INDEX_SUFFIX, INDEX_VERSION, {"timestamps": self.timestamps, "keyframes": self.keyframes})
+
+class FrameProxy():
+    """Downscaled copies of a video's frames for scrubbing, each one a JPEG of its own.
+
+    The JPEGs are stored back to back in a file next to the video (video path + PROXY_SUFFIX),
+    with their offsets in a sidecar written once the file is complete, so any frame is one
+    small read and decode away, without a keyframe to start from.
+    """
+    def __init__(self, video_path, offsets):
+        self.video_path = video_path
+        self.offsets = offsets # Frame i is bytes offsets[i] to offsets[i+1]
+        self.file = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read(self, frame):
+        """The BGR proxy image of frame, or None if the proxy has no such frame."""
+        frame = int(frame)
+        if not 0 <= frame < len(self):
+            return None
+        if self.file is None:
+            self.file = open(self.video_path + PROXY_SUFFIX, "rb")
+        self.file.seek(self.offsets[frame])
+        data = self.file.read(self.offsets[frame+1] - self.offsets[frame])
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @classmethod
+    def load(cls, video_path):
+        data = load_sidecar(video_path, PROXY_SUFFIX + ".json", PROXY_VERSION)
+        if data is None or not os.path.exists(video_path + PROXY_SUFFIX):
+            return None
+        return cls(video_path, data["offsets"])
+
+    @classmethod
+    def build(cls, video_path, height=PROXY_HEIGHT, cancelled=lambda: False):
+        """Write the proxy of video_path and return it, or None if cancelled() turns true first.
+
+        Also None for videos no taller than height, which gain nothing from a proxy.
+        """
+        cap = cv2.VideoCapture(video_path)
+        if cap.get(cv2.CAP_PROP_FRAME_HEIGHT) <= height:
+            cap.release()
+            return None
+        offsets = [0]
+        temp_path = video_path + PROXY_SUFFIX + ".part"
+        try:
+            with open(temp_path, "wb") as file:
+                while not cancelled():
+                    ret, image = cap.read()
+                    if not ret:
+                        break
+                    width = round(image.shape[1] * height / image.shape[0])
+                    small = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+                    ret, encoded = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, PROXY_QUALITY])
+                    file.write(encoded.tobytes())
+                    offsets.append(offsets[-1] + len(encoded))
+            if cancelled():
+                os.remove(temp_path)
+                return None
+            os.replace(temp_path, video_path + PROXY_SUFFIX)
+        except OSError:
+            # Without a writable folder there is no proxy, and full frames are used throughout
+            return None
+        finally:
+            cap.release()
+        save_sidecar(video_path, PROXY_SUFFIX + ".json", PROXY_VERSION, {"offsets": offsets})
+        return cls(video_path, offsets)
+
+class FrameStore():
+    """Decoded frames of a video at one resolution, in a memory-mapped file next to it.
+
+    The frames are a (frames, height, width, 3) BGR array saved in numpy's format (video path
+    + STORE_SUFFIX), with the number of frames in a sidecar written once the file is complete.
+    Reading a frame is a view into the mapped file, without the codec. Building one is
+    opt-in, as it takes height * width * 3 bytes of disk per frame.
+    """
+    def __init__(self, video_path, frames):
+        self.video_path = video_path
+        self.frames = frames # Read-only numpy memmap
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def height(self):
+        return self.frames.shape[1]
+
+    def read(self, frame):
+        """The BGR image of frame, a read-only view into the file, or None if the store has no such frame."""
+        frame = int(frame)
+        if not 0 <= frame < len(self):
+            return None
+        return self.frames[frame]
+
+    @classmethod
+    def load(cls, video_path):
+        data = load_sidecar(video_path, STORE_SUFFIX + ".json", STORE_VERSION)
+        if data is None:
+            return None
+        try:
+            frames = np.load(video_path + STORE_SUFFIX, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        return cls(video_path, frames[:data["frames"]])
+
+    @classmethod
+    def build(cls, video_path, height=STORE_HEIGHT, cancelled=lambda: False):
+        """Write the store of video_path and return it, or None if cancelled() turns true first.
+
+        Frames taller than height are scaled down to it, with height None they are kept as is.
+        """
+        cap = cv2.VideoCapture(video_path)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if frame_count <= 0 or frame_height <= 0:
+            cap.release()
+            return None
+        if height is None or frame_height <= height:
+            height = frame_height
+        width = round(frame_width * height / frame_height)
+        written = 0
+        temp_path = video_path + STORE_SUFFIX + ".part"
+        try:
+            frames = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.uint8, shape=(frame_count, height, width, 3))
+            while written < frame_count and not cancelled():
+                ret, image = cap.read()
+                if not ret:
+                    break
+                if image.shape[:2] == (height, width):
+                    frames[written] = image
+                else:
+                    cv2.resize(image, (width, height), dst=frames[written], interpolation=cv2.INTER_AREA)
+                written += 1
+            frames.flush()
+            # Unmapped before the file is moved
+            del frames
+            if cancelled():
+                os.remove(temp_path)
+                return None
+            os.replace(temp_path, video_path + STORE_SUFFIX)
+        except OSError:
+            # E.g. a read-only folder or a full disk, frames are then decoded as they are needed
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        finally:
+            cap.release()
+        save_sidecar(video_path, STORE_SUFFIX + ".json", STORE_VERSION, {"frames": written})
+        return cls.load(video_path)
+
+class FrameReader():
+    """Reads frames from a cv2.VideoCapture, seeking only when the reads are not contiguous.
+
+    Setting CAP_PROP_POS_FRAMES makes the decoder start over from the previous keyframe, so a
+    read of the frame right after the last one (or a few frames further, up to max_skip)
+    grabs its way there instead. Once index (a KeyframeIndex) is set, any read with no
+    keyframe between the last frame and the new one grabs forward too, since a seek would
+    have to decode from that keyframe anyway. After a seek, where it landed is taken from
+    the frame's timestamp rather than OpenCV's frame count, which assumes a constant frame
+    rate; a seek past the frame starts again from an earlier keyframe. seeks and reads
+    count how often each path was taken.
+    """
+    def __init__(self, cap, max_skip=SEQUENTIAL_SKIP, index=None):
+        self.cap = cap
+        self.max_skip = max_skip
+        self.index = index
+        self.last = None # Last frame grabbed, None when unknown
+        self.seeks = 0
+        self.reads = 0
+
+    def read(self, frame):
+        """The BGR image of frame, or None if it cannot be read."""
+        frame = int(frame)
+        self.reads += 1
+        if not self._can_grab_to(frame):
+            self.seeks += 1
+            self._seek(frame)
+        # Frames grabbed on the way are not decoded into images
+        while self.last < frame:
+            if not self.cap.grab():
+                self.last = None
+                return None
+            self.last += 1
+        ret, image = self.cap.retrieve()
+        return image if ret else None
+
+    def _can_grab_to(self, frame):
+        if self.last is None or frame < self.last:
+            return False
+        if frame - self.last <= self.max_skip + 1:
+            return True
+        # A seek could not start any later than the frames already decoded
+        return self.index is not None and self.index.keyframe_before(frame) <= self.last
+
+    def _seek(self, frame):
+        # OpenCV seeks to the keyframe before the frame itself and decodes up to it
+        target = frame
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        if self.index is None:
+            self.last = frame - 1
+            return
+        for _ in range(SEEK_RETRIES):
+            if not self.cap.grab():
+                break
+            landed = self.index.frame_at(self.cap.get(cv2.CAP_PROP_POS_MSEC))
+            if landed is None:
+                break
+            if landed <= frame:
+                self.last = landed
+                return
+            target = self.index.keyframe_before(target - (landed - frame))
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        # The timestamps did not help, so OpenCV's frame count has to do
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        self.last = frame - 1
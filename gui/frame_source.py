@@ -0,0 +1,122 @@
+import os
+import re
+import cv2
+import numpy as np
+
+# This allows for the module to be used from the repository root or from this folder
+try:
+    from gui.frame_reader import SEQUENTIAL_SKIP, FrameReader
+except ImportError:
+    from frame_reader import SEQUENTIAL_SKIP, FrameReader
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+IMAGE_SEQUENCE_FPS = 30
+
+class FrameSource():
+    """Frames of a recording by index, as BGR images.
+
+    seek_cost is about how many frames read in order a read anywhere else costs: 1 for
+    sources where every frame is read on its own, more for videos, which decode from the
+    keyframe before. Caching and prefetching are only worth their memory for costly sources.
+    """
+    seek_cost = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.fps = IMAGE_SEQUENCE_FPS
+        self.frame_count = 0
+        self.width = 0
+        self.height = 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def read(self, frame):
+        """The BGR image of frame, or None if it cannot be read."""
+        raise NotImplementedError
+
+    def set_index(self, index):
+        # Only videos have keyframes to index
+        pass
+
+    def release(self):
+        pass
+
+class VideoSource(FrameSource):
+    """A video file, read through OpenCV."""
+    seek_cost = SEQUENTIAL_SKIP
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.cap = cv2.VideoCapture(path)
+        self.reader = FrameReader(self.cap)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def read(self, frame):
+        return self.reader.read(frame)
+
+    def set_index(self, index):
+        self.reader.index = index
+
+    def release(self):
+        self.cap.release()
+
+def _natural_key(name):
+    # frame2.png before frame10.png
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+class ImageSequenceSource(FrameSource):
+    """A folder of images, one per frame, in the order of their numbered names."""
+    def __init__(self, path, fps=IMAGE_SEQUENCE_FPS):
+        super().__init__(path)
+        self.fps = fps
+        self.files = sorted((name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS)), key=_natural_key)
+        self.frame_count = len(self.files)
+        first = self.read(0)
+        if first is not None:
+            self.height, self.width = first.shape[:2]
+
+    def read(self, frame):
+        frame = int(frame)
+        if not 0 <= frame < self.frame_count:
+            return None
+        return cv2.imread(os.path.join(self.path, self.files[frame]), cv2.IMREAD_COLOR)
+
+class ArraySource(FrameSource):
+    """A .npy array of frames, (frames, height, width) or (frames, height, width, 3), memory-mapped.
+
+    Arrays are taken to be RGB, as most code outside OpenCV writes them; rgb=False reads them
+    as BGR, without a conversion.
+    """
+    def __init__(self, path, fps=IMAGE_SEQUENCE_FPS, rgb=True):
+        super().__init__(path)
+        self.fps = fps
+        self.rgb = rgb
+        self.frames = np.load(path, mmap_mode="r")
+        if self.frames.dtype != np.uint8 or self.frames.ndim not in (3, 4) or (self.frames.ndim == 4 and self.frames.shape[3] != 3):
+            raise ValueError(f"{path} holds {self.frames.dtype} frames of shape {self.frames.shape[1:]}, not 8-bit images")
+        self.frame_count = len(self.frames)
+        self.height, self.width = self.frames.shape[1:3]
+
+    def read(self, frame):
+        frame = int(frame)
+        if not 0 <= frame < self.frame_count:
+            return None
+        image = self.frames[frame]
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if self.rgb:
+            return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        # A read-only view into the file
+        return image
+
+def open_source(path):
+    """The FrameSource for path: a folder of images, a .npy array, or else a video."""
+    if os.path.isdir(path):
+        return ImageSequenceSource(path)
+    if path.lower().endswith(".npy"):
+        return ArraySource(path)
+    return VideoSource(path)
@@ -82,6 +82,8 @@ class OutputPanel(QWidget):
         self.layout.addWidget(self.validationtitle)
         self.layout.addWidget(self.scroll_area , stretch=2)
         
+        self.log_labels = {} # {exception: QLabel} for the validation log
+        
     def update_error(self,exception):
         self.errormsg.setText(str(exception))
         self.update()
@@ -90,14 +92,17 @@ class OutputPanel(QWidget):
         self.errormsg.setText("")
         self.update()
     
-    def update_log(self, exception_list):
-        while self.exceptionarea.loglayout.count():
-            item = self.exceptionarea.loglayout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
-            del item
+    def update_log(self, added, resolved):
+        # Only the labels of diagnostics that appeared or went away are touched
+        for exception in resolved:
+            label = self.log_labels.pop(exception, None)
+            if label is not None:
+                self.exceptionarea.loglayout.removeWidget(label)
+                label.deleteLater()
         
-        for exception in exception_list:
+        for exception in added:
+            if exception in self.log_labels:
+                continue
             stylesheet = CustomColorTheme.MONO_FONT_2
             if exception.type == "Error":
                 label = QLabel(f"-ERROR: {exception}")
@@ -111,5 +116,6 @@ class OutputPanel(QWidget):
                 
             label.setStyleSheet(stylesheet)
             self.exceptionarea.loglayout.addWidget(label)
+            self.log_labels[exception] = label
         self.exceptionarea.update()
-        self.update()
\ No newline at end of file
+        self.update()
@@ -1,11 +1,16 @@
-from PyQt5.QtCore import Qt, QSize, pyqtSignal, QPoint, QEvent
+from PyQt5.QtCore import Qt, QSize, QTimer, pyqtSignal, QPoint, QEvent
 from PyQt5.QtWidgets import QWidget, QLabel, QSizePolicy
-from PyQt5.QtGui import QResizeEvent
+from PyQt5.QtGui import QResizeEvent, QImage, QPixmap, QColor
+import numpy as np
 from sortedcontainers import SortedDict
 
+from data_structure.naryrangetree import NaryRangeTreeEvent
 from gui import util
 from gui.colortheme import CustomColorTheme
 
+# Edits redraw the density strip at most this often, as it labels every visible frame
+DENSITY_DELAY_MS = 100
+
 class FrameWidget(QWidget):
     HoverFrame = pyqtSignal(bool)
     def __init__(self, color, type):
@@ -42,6 +47,24 @@ class FrameWidget(QWidget):
                 self.HoverFrame.emit(False)
         return super().eventFilter(obj, event)
     
+class DensityStrip(QLabel):
+    # How many depths are labelled along the visible window, more opaque where more are
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setScaledContents(True)
+    
+    def set_density(self, columns, depth):
+        if len(columns) == 0 or depth == 0:
+            self.clear()
+            return
+        color = QColor(CustomColorTheme.DETAILSHIGHLIGHT)
+        row = np.empty((1, len(columns), 4), dtype=np.uint8)
+        row[..., 0], row[..., 1], row[..., 2] = color.red(), color.green(), color.blue()
+        row[..., 3] = 255 * columns // depth
+        # The copy detaches the image from the array, which is freed on return
+        image = QImage(row.data, len(columns), 1, row.strides[0], QImage.Format_RGBA8888).copy()
+        self.setPixmap(QPixmap.fromImage(image))
+    
 class SeekerBar(QWidget):
     def __init__(self,height,parent=None,type=None):
         super().__init__(parent)
@@ -108,6 +131,15 @@ class SeekerWindow(QWidget):
         self.bar.setStyleSheet(f"background-color: {CustomColorTheme.TIMELINE};")
         self.bar.move(0,self.bar_margin_top)
         
+        self.tree = None
+        self.density_strip = DensityStrip(self)
+        self.density_timer = QTimer(self)
+        self.density_timer.setSingleShot(True)
+        self.density_timer.setInterval(DENSITY_DELAY_MS)
+        self.density_timer.timeout.connect(self.update_density)
+        self.density_strip.setFixedHeight(self.bar_margin_top)
+        self.density_strip.move(0,self.bar_margin_top+self.bar_height)
+        
         self.seekerbar = SeekerBar(self.bar_height+self.bar_margin_top,self)
         self.seekerbar.setCursor(Qt.SplitHCursor)
         self.seekerbar.move(-self.seekerbar.get_x_offset(),0)
@@ -131,6 +163,7 @@ class SeekerWindow(QWidget):
         
         self.widgetInfo = dict()
         self.items = SortedDict()
+        self.keys = {} # {uuid: key in self.items}
         
     def recalculate_max_ticks(self):
         self.max_ticks = self.bar_width
@@ -140,7 +173,9 @@ class SeekerWindow(QWidget):
         self.bar_width = width
         self.recalculate_max_ticks()
         self.bar.setFixedWidth(self.bar_width)
+        self.density_strip.setFixedWidth(self.bar_width)
         self.generate_ticks(self.min_frame,self.max_frame)
+        self.update_density()
         for key,frame_item in self.items.items():
             start_frame, end_frame = key[0], -key[1]
             self.mod_skill(frame_item, start_frame, end_frame)
@@ -148,28 +183,23 @@ class SeekerWindow(QWidget):
         super().resizeEvent(event)
         
     def update_skills(self, tree):
-        # Different items- remove from sidebar
-        selected_skills = [(w[0].value,w[1]) for w in tree.traverse(levels=True)]
+        self.tree = tree
+        self.update_density()
+        # Only skills intersecting the visible frame window get a widget
+        selected_skills = [(w[0].value,w[1]) for w in tree.range_query(self.min_frame, self.max_frame, levels=True)]
             
-        skill_uuids = set([(skill.frame_start,-skill.frame_end, skill.uuid) for (skill,level) in selected_skills])
+        # Different items- remove from sidebar
+        skill_uuids = set([(skill.frame_start,-skill.frame_end, -level, skill.uuid) for (skill,level) in selected_skills])
         difference_remove = set(self.items.keys()).difference(set(skill_uuids))
         
         for skill in difference_remove:
-            removed_item = self.items.pop(skill)
-            removed_item.setParent(None)
-            removed_item.deleteLater()
+            self.remove_item(tree, skill[-1])
             
         # Different items- add to sidebar
         for skill,level in selected_skills:
             new_key = (skill.frame_start,-skill.frame_end, -level, skill.uuid) 
             if new_key not in self.items:
-                frame_item = FrameWidget(skill.get_color(),skill.type)
-                frame_item.setParent(self.bar)
-                tree.connect_framewidget(skill.uuid, frame_item)
-                start_frame, end_frame = skill.frame_start, skill.frame_end
-                self.mod_skill(frame_item, start_frame, end_frame)
-                self.items[new_key] = frame_item
-                self.items[new_key].show()
+                self.add_item(tree, skill, level)
             else:
                 self.items[new_key].show()
                 
@@ -177,6 +207,62 @@ class SeekerWindow(QWidget):
             frame_item.raise_()
         self.update()
     
+    def apply_changes(self, tree, events):
+        self.tree = tree
+        # A run of edits, such as holding a key to fill actions, redraws the strip once
+        if not self.density_timer.isActive():
+            self.density_timer.start()
+        # Events arrive in pre-order, so raising each touched widget in turn keeps children on top
+        for event in events:
+            skill = event.node.value
+            if event.kind == NaryRangeTreeEvent.REMOVED:
+                self.remove_item(tree, skill.uuid)
+            elif event.kind == NaryRangeTreeEvent.INSERTED:
+                # Only skills intersecting the visible frame window get a widget
+                if event.node.range_end >= self.min_frame and event.node.range_start <= self.max_frame:
+                    self.add_item(tree, skill, event.level).raise_()
+            elif skill.uuid in self.keys:
+                old_key = self.keys[skill.uuid]
+                frame_item = self.items.pop(old_key)
+                new_key = (old_key[0], old_key[1], -event.level, skill.uuid)
+                self.items[new_key] = frame_item
+                self.keys[skill.uuid] = new_key
+                frame_item.raise_()
+        self.update()
+    
+    def update_density(self):
+        self.density_timer.stop()
+        if self.tree is None or len(self.frame_seek_frames) == 0:
+            self.density_strip.clear()
+            return
+        min_frame = int(self.frame_seek_frames[0])
+        labels, _ = self.tree.frame_labels(int(self.frame_seek_frames[-1]) - min_frame + 1, min_frame)
+        density = (labels >= 0).sum(axis=0)
+        # Zoomed out, a tick column spans several frames and shows the busiest of them
+        columns = np.maximum.reduceat(density, np.array(self.frame_seek_frames) - min_frame)
+        self.density_strip.set_density(columns, len(labels))
+    
+    def add_item(self, tree, skill, level):
+        new_key = (skill.frame_start,-skill.frame_end, -level, skill.uuid)
+        frame_item = FrameWidget(skill.get_color(),skill.type)
+        frame_item.setParent(self.bar)
+        tree.connect_framewidget(skill.uuid, frame_item)
+        start_frame, end_frame = skill.frame_start, skill.frame_end
+        self.mod_skill(frame_item, start_frame, end_frame)
+        self.items[new_key] = frame_item
+        self.keys[skill.uuid] = new_key
+        frame_item.show()
+        return frame_item
+    
+    def remove_item(self, tree, skill_uuid):
+        if skill_uuid not in self.keys:
+            return
+        removed_item = self.items.pop(self.keys.pop(skill_uuid))
+        tree.disconnect_framewidget(skill_uuid, removed_item)
+        self.widgetInfo.pop(removed_item, None)
+        removed_item.setParent(None)
+        removed_item.deleteLater()
+    
     def mod_skill(self,frame_widget, start_frame, end_frame):
         self.widgetInfo[frame_widget] = (start_frame, end_frame)
         frame_widget.setParent(self.bar)
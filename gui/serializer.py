@@ -6,6 +6,9 @@ import zipfile
 import cv2
 import json
 from gui.exceptions import FileEncodingFailure, FrameNotFound, VideoFileNotFound
+from gui.frame_reader import FrameStore
+from gui.frame_source import open_source
+from data_structure.skillunit import ActionRunUnit
 from PyQt5.QtCore import pyqtSignal, QObject, QThread
 from PyQt5.QtWidgets import QProgressBar, QDialog, QVBoxLayout
 from dataclasses import dataclass
@@ -24,7 +27,8 @@ class ProgressDialog(QDialog):
         super().__init__(parent)
         
         self.setWindowTitle("Processing...")
-        self.setModal(True)  # Make the dialog modal to grey out everything behind it
+        # The serializer works on a snapshot of the tree, so editing can go on while it runs
+        self.setModal(False)
         
         self.progress_bar = QProgressBar(self)
         self.progress_bar.setRange(0, 100)
@@ -103,46 +107,61 @@ class Serializer(QObject):
         
         
         # Load video
-        cap = cv2.VideoCapture(self.video_path)
-        #
-        skill_dict = {}
-        skills = [skill.value for skill in self.skills.traverse()]
-        num_progress = len(skills)+1
-        saved_frames = set()
-        for i,skill in enumerate(skills, 1):
-            skill_type = skill.type
-            skill_name = skill.name
-            skill_uuid = skill.uuid
-            start_frame = int(skill.frame_start)
-            end_frame = int(skill.frame_end)
-            #Find all desired frames
-            for f in range(start_frame, end_frame + 1): 
-                print("Frame",f)
-                if f not in saved_frames:
-                    saved_frames.add(f)
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, f)
-                    ret, video_frame = cap.read()
-                    if ret is False:
-                        return self.finishException(FrameNotFound(f))
+        source = open_source(self.video_path)
+        try:
+            # Frames are saved at full resolution, so a store only stands in for the video if it has that
+            store = FrameStore.load(self.video_path) if source.seek_cost > 1 else None
+            if store is not None and store.height != source.height:
+                store = None
+            #
+            skill_dict = {}
+            skills = [skill.value for skill in self.skills.iter_nodes()]
+            num_progress = len(skills)+1
+            saved_frames = set()
+            for i,skill in enumerate(skills, 1):
+                skill_type = skill.type
+                skill_name = skill.name
+                skill_uuid = skill.uuid
+                start_frame = int(skill.frame_start)
+                end_frame = int(skill.frame_end)
+                #Find all desired frames
+                # A run covers frames start to end-1, its end frame may not even exist in the video
+                last_frame = end_frame - 1 if isinstance(skill, ActionRunUnit) else end_frame
+                for f in range(start_frame, last_frame + 1): 
+                    if f not in saved_frames:
+                        saved_frames.add(f)
+                        video_frame = store.read(f) if store is not None else None
+                        if video_frame is None:
+                            video_frame = source.read(f)
+                        if video_frame is None:
+                            return self.finishException(FrameNotFound(f))
                         
-                    success, buffer = cv2.imencode('.png', video_frame)
-                    if not success:
-                        return self.finishException(FileEncodingFailure(f"{video_frame}.png"))
-                    byte_stream = io.BytesIO(buffer)
+                        success, buffer = cv2.imencode('.png', video_frame)
+                        if not success:
+                            return self.finishException(FileEncodingFailure(f"{video_frame}.png"))
+                        byte_stream = io.BytesIO(buffer)
                     
-                    # Add the image to the .sega archive
-                    with zipfile.ZipFile(self._temp_file, 'a') as zipf:
-                        zipf.writestr(f"{f}.png",byte_stream.getvalue())
+                        # Add the image to the .sega archive
+                        with zipfile.ZipFile(self._temp_file, 'a') as zipf:
+                            zipf.writestr(f"{f}.png",byte_stream.getvalue())
                     
-            skill_dict[str(skill_uuid)] = {"name": skill_name, "type": skill_type, "start": start_frame, "end": end_frame}
-            self.Progress.emit(int(i/num_progress*100))
+                skill_dict[str(skill_uuid)] = {"name": skill_name, "type": skill_type, "start": start_frame, "end": end_frame}
+                if isinstance(skill, ActionRunUnit):
+                    # One entry for the whole run, whose "end" is one past its last frame, as a
+                    # per-frame action's is. Older versions read it back as a single action over
+                    # the same range, which covers the same frames as the per-frame actions
+                    skill_dict[str(skill_uuid)]["run"] = True
+                self.Progress.emit(int(i/num_progress*100))
+        finally:
+            # Also on the early returns for frames that cannot be read or encoded
+            source.release()
              
         skill_dict[self._videopath] = str(self.video_path)  
         json_str = json.dumps(skill_dict,indent=None) 
         byte_stream = io.BytesIO(json_str.encode('utf-8'))
         with zipfile.ZipFile(self._temp_file, 'a') as zipf:
             zipf.writestr("data.json", byte_stream.getvalue())
-            pickled_skill_tree = pickle.dumps(self.skills.dewrap())
+            pickled_skill_tree = pickle.dumps(self.skills)
             zipf.writestr("skilltree.pkl", pickled_skill_tree)
 
         self.Progress.emit(int(num_progress/num_progress*100))
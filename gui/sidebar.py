@@ -3,6 +3,7 @@ from PyQt5.QtWidgets import QWidget, QLabel, QMenu, QAction, QSizePolicy, QPushB
 from PyQt5.QtGui import QCursor, QFont
 import numpy as np
 from sortedcontainers import SortedDict
+from data_structure.naryrangetree import NaryRangeTreeEvent
 from gui import util
 from gui.colortheme import CustomColorTheme
 
@@ -154,6 +155,8 @@ class SidebarItem(QWidget):
         self.nestlayout.insertWidget(0, nest_indicator)
         
     def update_nests(self, nest_count, has_children):
+        self.nest_count = nest_count
+        self.has_children = has_children
         # Update nest indicators
         while self.nestlayout.count() > 0:
             item = self.nestlayout.takeAt(0)  # Take the item from the layout
@@ -236,38 +239,29 @@ class SkillBar(QWidget):
         self.layout.setAlignment(Qt.AlignTop)
         
         self.items = SortedDict()
+        self.keys = {} # {uuid: key in self.items}
     
     def update_skills(self, tree):
-        selected_skills = [w for w in tree.traverse(levels=True)]
         skills = []
         levels = []
         has_children = []
-        for skill, level in selected_skills:
+        for skill, level in tree.iter_nodes(levels=True):
             skills.append(skill.value)
             levels.append(level)
             has_children.append(len(skill.children) > 0)
             
         # Different items- remove from sidebar
-        skill_uuids = set([(skill.frame_start,-skill.frame_end,skill.uuid) for skill in skills])
+        skill_uuids = set([(skill.frame_start,-skill.frame_end,level,skill.uuid) for skill,level in zip(skills,levels)])
         difference_remove = set(self.items.keys()).difference(set(skill_uuids))
         
         for skill in difference_remove:
-            removed_item = self.items.pop(skill)
-            self.layout.removeWidget(removed_item)
-            removed_item.deleteLater()
+            self.remove_item(skill[-1])
             
         for skill,level,has_children in zip(skills,levels,has_children):
             # Different items- add to sidebar
             new_key = (skill.frame_start,-skill.frame_end,level,skill.uuid) 
             if new_key not in self.items:
-                sidebar_item = SidebarItem(skill.name, skill.type, skill.frame_start, skill.frame_end, skill.get_color())
-                sidebar_item.update_nests(level, has_children)
-                sidebar_item.VisibleChanged.connect(self.adjustSize)
-                tree.connect_sidebar(skill.uuid,sidebar_item)
-                self.items[new_key] = sidebar_item
-                index_loc = self.items.index(new_key)
-                self.layout.insertWidget(index_loc, sidebar_item)
-                self.items[new_key].show()
+                self.add_item(tree, skill, level, has_children)
             else:
                 self.items[new_key].update_nests(level, has_children)
                 self.items[new_key].show()
@@ -276,6 +270,60 @@ class SkillBar(QWidget):
         self.adjustSize()
         self.update()
     
+    def apply_changes(self, tree, events):
+        # Only rows touched by the events are created, moved or deleted
+        parents = []
+        for event in events:
+            skill = event.node.value
+            if event.kind == NaryRangeTreeEvent.REMOVED:
+                self.remove_item(skill.uuid)
+                parents.append(event.parent)
+            elif event.kind == NaryRangeTreeEvent.INSERTED:
+                self.add_item(tree, skill, event.level, len(event.node.children) > 0)
+                parents.append(event.parent)
+            else:
+                self.move_item(skill.uuid, event.level)
+                parents += [event.parent, event.old_parent]
+        
+        # Parents may have gained or lost their only child
+        for parent in parents:
+            if parent is None or parent.value is None or parent.value.uuid not in self.keys:
+                continue
+            sidebar_item = self.items[self.keys[parent.value.uuid]]
+            sidebar_item.update_nests(sidebar_item.nest_count, len(parent.children) > 0)
+        self.adjustSize()
+        self.update()
+    
+    def add_item(self, tree, skill, level, has_children):
+        new_key = (skill.frame_start,-skill.frame_end,level,skill.uuid)
+        sidebar_item = SidebarItem(skill.name, skill.type, skill.frame_start, skill.frame_end, skill.get_color())
+        sidebar_item.update_nests(level, has_children)
+        sidebar_item.VisibleChanged.connect(self.adjustSize)
+        tree.connect_sidebar(skill.uuid,sidebar_item)
+        self.items[new_key] = sidebar_item
+        self.keys[skill.uuid] = new_key
+        self.layout.insertWidget(self.items.index(new_key), sidebar_item)
+        sidebar_item.show()
+    
+    def remove_item(self, skill_uuid):
+        if skill_uuid not in self.keys:
+            return
+        removed_item = self.items.pop(self.keys.pop(skill_uuid))
+        self.layout.removeWidget(removed_item)
+        removed_item.deleteLater()
+    
+    def move_item(self, skill_uuid, level):
+        if skill_uuid not in self.keys:
+            return
+        old_key = self.keys[skill_uuid]
+        sidebar_item = self.items.pop(old_key)
+        self.layout.removeWidget(sidebar_item)
+        new_key = (old_key[0], old_key[1], level, skill_uuid)
+        self.items[new_key] = sidebar_item
+        self.keys[skill_uuid] = new_key
+        self.layout.insertWidget(self.items.index(new_key), sidebar_item)
+        sidebar_item.update_nests(level, sidebar_item.has_children)
+    
     def adjustSize(self):
         height = 0
         for i in range(self.layout.count()):
@@ -2,14 +2,69 @@ import uuid
 from PyQt5.QtCore import Qt, pyqtSignal, QObject
 from PyQt5.QtWidgets import QWidget, QLabel, QFrame, QSizePolicy, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit
 from gui.colortheme import CustomColorTheme
+from data_structure.naryrangetree import NaryRangeTreeEvent
 
 class NaryRangeTreeSkillSegaWrapper():
     def __init__(self, skill_tree):
         self._wrapped_obj = skill_tree
         self.skill_emissions = {} # {uuid: SkillEmission}
+        # Subscribers stay with the wrapper when a load swaps the wrapped tree
+        self._listeners = []
+        skill_tree.subscribe(self._forward_events)
+    
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+    
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+    
+    def _forward_events(self, events):
+        for listener in list(self._listeners):
+            listener(events)
     
     def insert(self, value, range_start, range_end, trigger_delete_skill, zoom_selection):
-        self._wrapped_obj.insert(value, range_start, range_end)
+        # Subscribers are only called at the end of the batch, once the emission exists
+        with self._wrapped_obj.batch():
+            self._wrapped_obj.insert(value, range_start, range_end)
+            self._add_emission(value, range_start, range_end, trigger_delete_skill, zoom_selection)
+    
+    def insert_many(self, intervals, trigger_delete_skill, zoom_selection):
+        # Raises InvalidIntervals and leaves the tree unchanged if any interval is invalid
+        with self._wrapped_obj.batch():
+            nodes = self._wrapped_obj.insert_many(intervals)
+            for node in nodes:
+                self._add_emission(node.value, node.range_start, node.range_end, trigger_delete_skill, zoom_selection)
+        return nodes
+    
+    def load_intervals(self, intervals, trigger_delete_skill, trigger_delete_action, zoom_selection):
+        # Raises InvalidIntervals before the current tree is touched
+        skill_tree = type(self._wrapped_obj).from_intervals(intervals)
+        # The old tree is dropped rather than cleared, so the only reset published is the one below
+        self._wrapped_obj.unsubscribe(self._forward_events)
+        self._clear_emissions()
+        self._wrapped_obj = skill_tree
+        skill_tree.subscribe(self._forward_events)
+        for node in skill_tree.iter_nodes():
+            trigger_delete = trigger_delete_action if node.value.type == "action" else trigger_delete_skill
+            self._add_emission(node.value, node.range_start, node.range_end, trigger_delete, zoom_selection)
+        self._forward_events([NaryRangeTreeEvent(NaryRangeTreeEvent.RESET)])
+    
+    def restore(self, snapshot, trigger_delete_skill, trigger_delete_action, zoom_selection):
+        # Publishes a single reset once the emissions match the restored nodes
+        with self._wrapped_obj.batch():
+            self._wrapped_obj.restore(snapshot)
+            nodes = {node.value.uuid: node for node in self._wrapped_obj.iter_nodes()}
+            for skill_uuid, skill_emission in list(self.skill_emissions.items()):
+                node = nodes.get(skill_uuid)
+                # Run parts keep their run's uuid with a different range, so compare ranges too
+                if node is None or (node.range_start, node.range_end) != (skill_emission.frame_start, skill_emission.frame_end):
+                    self.skill_emissions.pop(skill_uuid).deleteLater()
+            for skill_uuid, node in nodes.items():
+                if skill_uuid not in self.skill_emissions:
+                    trigger_delete = trigger_delete_action if node.value.type == "action" else trigger_delete_skill
+                    self._add_emission(node.value, node.range_start, node.range_end, trigger_delete, zoom_selection)
+    
+    def _add_emission(self, value, range_start, range_end, trigger_delete_skill, zoom_selection):
         skill_uuid = value.uuid
         if skill_uuid not in self.skill_emissions:
             self.skill_emissions[skill_uuid] = SkillEmission(skill_uuid, range_start, range_end)
@@ -19,12 +74,8 @@ class NaryRangeTreeSkillSegaWrapper():
     
     def toggle_show_under(self, uuid, hideUnder = False):
         print("Toggling show under", uuid, hideUnder)
-        lambda_func = lambda x: x.uuid == uuid
-        value = self._wrapped_obj.get(lambda_func)
-        hide_list = []
-        self._wrapped_obj._traverse_recursive(value, hide_list,-1)
-        hide_list.pop(0)
-        for skill in hide_list:
+        value = self._wrapped_obj.get_by_uuid(uuid)
+        for skill in self._wrapped_obj.iter_nodes(node=value):
             print("Hide",hideUnder,skill.value.uuid)
             if hideUnder:
                 self.skill_emissions[skill.value.uuid].hide()
@@ -34,6 +85,22 @@ class NaryRangeTreeSkillSegaWrapper():
     
     def pop(self, value):
         skill = self._wrapped_obj.pop(value)
+        return self._pop_emission(skill)
+    
+    def pop_by_uuid(self, skill_uuid):
+        skill = self._wrapped_obj.pop_by_uuid(skill_uuid)
+        return self._pop_emission(skill)
+    
+    def pop_run_frame(self, skill_uuid, frame, trigger_delete_skill, zoom_selection):
+        with self._wrapped_obj.batch():
+            run, parts = self._wrapped_obj.pop_run_frame(skill_uuid, frame)
+            # The part before the frame keeps the run's uuid, so its old emission has to go first
+            run, emission = self._pop_emission(run)
+            for node in parts:
+                self._add_emission(node.value, node.range_start, node.range_end, trigger_delete_skill, zoom_selection)
+        return emission
+    
+    def _pop_emission(self, skill):
         print("Successfully popped", skill.value.uuid)
         
         if skill.value.uuid not in self.skill_emissions:
@@ -52,8 +119,16 @@ class NaryRangeTreeSkillSegaWrapper():
             AssertionError(f"Skill emission with uuid {skill_uuid} not inserted into tree.")
         self.skill_emissions[skill_uuid].connect_framewidget(skill_emission)
     
+    def disconnect_framewidget(self, skill_uuid, frame_widget):
+        # The skill may already have been popped, or scrolled out of the timeline window
+        if skill_uuid in self.skill_emissions:
+            self.skill_emissions[skill_uuid].disconnect_framewidget(frame_widget)
+    
     def clear(self):
         self._wrapped_obj.clear()
+        self._clear_emissions()
+    
+    def _clear_emissions(self):
         for skill_emission in self.skill_emissions.values():
             skill_emission.deleteLater()
         self.skill_emissions.clear()
@@ -73,10 +148,14 @@ class SkillEmission(QObject):
         self.uuid = uuid
         self.frame_start = frame_start
         self.frame_end = frame_end
+        self.sidebar_widget = None
+        self.frame_widget = None
         
     def deleteLater(self):
-        self.frame_widget.deleteLater()
-        self.sidebar_widget.deleteLater()
+        if self.frame_widget:
+            self.frame_widget.deleteLater()
+        if self.sidebar_widget:
+            self.sidebar_widget.deleteLater()
         super().deleteLater()
     
     def connect_sidebar(self, sidebar):
@@ -93,6 +172,10 @@ class SkillEmission(QObject):
         self.frame_widget = frame_widget
         self.frame_widget.HoverFrame.connect(self.hover_control)
     
+    def disconnect_framewidget(self, frame_widget):
+        if self.frame_widget is frame_widget:
+            self.frame_widget = None
+    
     def hide(self):
         if self.sidebar_widget:
             self.sidebar_widget.hide()
@@ -129,6 +212,7 @@ class SkillCreator(QWidget):
     EnterAction = pyqtSignal(str)
     EnterFillAction = pyqtSignal(str)
     EnterQuickAction = pyqtSignal(str)
+    EnterFillGaps = pyqtSignal(str)
     SetStart = pyqtSignal()
     SetEnd = pyqtSignal()
     def __init__(self):
@@ -295,6 +379,9 @@ class SkillCreator(QWidget):
     def emit_quick_action(self):
         self.EnterQuickAction.emit(self.enter_skill_name.text())
         
+    def emit_fill_gaps(self):
+        self.EnterFillGaps.emit(self.enter_skill_name.text())
+        
     def emit_fill_action_creation(self):
         if self.fill_quick_action_button.isEnabled():
             self.EnterFillAction.emit(self.enter_skill_name.text())
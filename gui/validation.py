@@ -0,0 +1,75 @@
+from gui.exceptions import InconsistentType, NonPythonicName
+from data_structure.naryrangetree import NaryRangeTreeEvent
+
+
+class ValidationIndex():
+    """Reference counts of the names used in the skill tree, kept up to date from its events.
+
+    A name gets InconsistentType while it is used by both actions and skills, and
+    NonPythonicName while it is used at all and is not an identifier. Each edit only
+    rechecks the names of the nodes it inserted or removed.
+    """
+    def __init__(self):
+        self.counts = {} # {name: {"action": count, "skill": count}}
+        self.invalid_names = set() # Names in use that are not identifiers
+        self.diagnostics = set()
+
+    def apply_changes(self, tree, events):
+        """Update the index from a batch of tree events, returning the (added, resolved) diagnostics."""
+        if any(event.kind == NaryRangeTreeEvent.RESET for event in events):
+            return self.rebuild(tree)
+
+        before = {} # {name: diagnostics before the batch}
+        for event in events:
+            if event.kind == NaryRangeTreeEvent.INSERTED:
+                change = 1
+            elif event.kind == NaryRangeTreeEvent.REMOVED:
+                change = -1
+            else:
+                # Moving a node does not change which names are in use
+                continue
+            name = event.node.value.name
+            if name not in before:
+                before[name] = self._diagnostics_of(name)
+            self._count(name, event.node.value.type, change)
+
+        added, resolved = set(), set()
+        for name, old in before.items():
+            new = self._diagnostics_of(name)
+            added |= new - old
+            resolved |= old - new
+        self.diagnostics = (self.diagnostics - resolved) | added
+        return added, resolved
+
+    def rebuild(self, tree):
+        old = self.diagnostics
+        self.counts = {}
+        self.invalid_names = set()
+        for node in tree.iter_nodes():
+            self._count(node.value.name, node.value.type, 1)
+        self.diagnostics = set()
+        for name in self.counts:
+            self.diagnostics |= self._diagnostics_of(name)
+        return self.diagnostics - old, old - self.diagnostics
+
+    def _count(self, name, value_type, change):
+        counts = self.counts.get(name)
+        if counts is None:
+            counts = self.counts[name] = {"action": 0, "skill": 0}
+            if not name.isidentifier():
+                self.invalid_names.add(name)
+        counts["action" if value_type == "action" else "skill"] += change
+        if not counts["action"] and not counts["skill"]:
+            del self.counts[name]
+            self.invalid_names.discard(name)
+
+    def _diagnostics_of(self, name):
+        diagnostics = set()
+        counts = self.counts.get(name)
+        if counts is None:
+            return diagnostics
+        if counts["action"] and counts["skill"]:
+            diagnostics.add(InconsistentType(name))
+        if name in self.invalid_names:
+            diagnostics.add(NonPythonicName(name))
+        return diagnostics
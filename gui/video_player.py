@@ -1,32 +1,240 @@
-from PyQt5.QtCore import Qt, QSize, QTimer, pyqtSignal, QObject
-from PyQt5.QtWidgets import QWidget, QLabel, QSizePolicy,QComboBox, QPushButton, QVBoxLayout, QFileDialog, QStyle, QHBoxLayout, QStatusBar
+import os
+import queue
+import threading
+import time
+from collections import deque
+from PyQt5.QtCore import Qt, QSize, QTimer, QThread, pyqtSignal, QObject
+from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QSizePolicy,QComboBox, QPushButton, QVBoxLayout, QFileDialog, QStyle, QHBoxLayout, QStatusBar
 from PyQt5.QtGui import QImage, QPixmap, QColor
 import cv2
 
+from data_structure.framecache import FRAME_CACHE_BYTES, FrameCache
+from data_structure.framering import FrameRing
 from gui.colortheme import CustomColorTheme
+from gui.frame_reader import FrameProxy, FrameStore, KeyframeIndex
+from gui.frame_source import IMAGE_EXTENSIONS, open_source
+
+PREFETCH_FRAMES = 30
+CHEAP_PREFETCH_FRAMES = 4 # For sources that read any frame as fast as the next one
+PROXY_CACHE_BYTES = 64 * 1024 * 1024
+STATS_INTERVAL = 1.0 # Seconds between playback reports, and the window fps is measured over
+# Qt 5.14 added a BGR format, before that frames are converted to RGB in place
+BGR_FORMAT = getattr(QImage, "Format_BGR888", None)
+
+def to_qimage(array):
+    """A QImage of the BGR image array, sharing its memory.
+
+    The image keeps a reference to the array (as image.array), so the memory stays valid for
+    as long as the image does.
+    """
+    if BGR_FORMAT is None:
+        # Frames read from a FrameStore are read-only views of its file
+        array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=array if array.flags.writeable else None)
+    h, w = array.shape[:2]
+    image = QImage(array.data, w, h, array.strides[0], QImage.Format_RGB888 if BGR_FORMAT is None else BGR_FORMAT)
+    image.array = array
+    return image
+
+class FrameDecoder(QThread):
+    """Decodes the frames the playhead needs next, off the GUI thread.
+
+    The GUI thread posts the (frame, proxy) pairs it is missing with request(), proxy telling
+    whether the FrameProxy image is wanted rather than the full frame, and picks up the
+    decoded (frame, proxy, size, (image, array)) tuples with take_ready(), which never blocks.
+    Images are scaled to fit size, the display size given to set_size() when the frame was
+    decoded. At most queue_size decoded frames wait to be picked up; a frame that cannot be
+    read comes back as None. FrameReady is emitted whenever a frame is queued.
+    """
+    FrameReady = pyqtSignal()
+    def __init__(self, video_path, queue_size=PREFETCH_FRAMES):
+        super().__init__()
+        self.video_path = video_path
+        self.ready = queue.Queue(queue_size)
+        self.condition = threading.Condition()
+        self.wanted = [] # Frames to decode next, in order
+        self.decoding = None # Frame being decoded and not yet queued
+        self.index = None # KeyframeIndex, once it is loaded or built
+        self.proxy = None # FrameProxy, likewise
+        self.store = None # FrameStore, read from instead of the video when it has the frame
+        self.size = None # (width, height) frames are scaled to fit, None for their own size
+        self.ring = None # FrameRing the scaled frames are written into, used on this thread only
+        self.active = True
+    
+    def request(self, frames):
+        with self.condition:
+            # The frame being decoded is on its way already
+            self.wanted = [frame for frame in frames if frame != self.decoding]
+            self.condition.notify()
+    
+    def set_index(self, index):
+        with self.condition:
+            self.index = index
+    
+    def set_proxy(self, proxy):
+        with self.condition:
+            self.proxy = proxy
+    
+    def set_store(self, store):
+        with self.condition:
+            self.store = store
+    
+    def set_size(self, size):
+        with self.condition:
+            self.size = size
+    
+    def take_ready(self):
+        decoded = []
+        while True:
+            try:
+                decoded.append(self.ready.get_nowait())
+            except queue.Empty:
+                return decoded
+    
+    def stop(self):
+        with self.condition:
+            self.active = False
+            self.condition.notify()
+        self.wait()
+    
+    def run(self):
+        # Videos read consecutive frames without seeking, as playback asks for them
+        source = open_source(self.video_path)
+        frame_size = (source.width, source.height)
+        last_size = None
+        while True:
+            with self.condition:
+                while self.active and not self.wanted:
+                    self.condition.wait()
+                if not self.active:
+                    break
+                frame, proxy = self.decoding = self.wanted.pop(0)
+                source.set_index(self.index)
+                frame_proxy = self.proxy
+                frame_store = self.store
+                size = self.size
+            if size != last_size and self.ring is not None:
+                # Frames scaled for the old size are let go, so the arrays the ring grew for them can go too
+                self.ring.trim()
+            last_size = size
+            if proxy:
+                video_frame = frame_proxy.read(frame)
+            elif frame_store is not None and frame < len(frame_store):
+                video_frame = frame_store.read(frame)
+            else:
+                video_frame = source.read(frame)
+            decoded = None if video_frame is None else self.convert(video_frame, self.fit(frame_size, size))
+            # The GUI thread empties the queue on every tick, so this only waits briefly
+            while self.active:
+                try:
+                    self.ready.put((frame, proxy, size, decoded), timeout=0.05)
+                    self.FrameReady.emit()
+                    break
+                except queue.Full:
+                    pass
+            with self.condition:
+                self.decoding = None
+        source.release()
+        if self.proxy is not None:
+            self.proxy.close()
+    
+    @staticmethod
+    def fit(frame_size, size):
+        # The (width, height) a frame of frame_size is shown at to fit size, None if unscaled
+        w, h = frame_size
+        if size is None or w <= 0 or h <= 0:
+            return None
+        scale = min(size[0] / w, size[1] / h)
+        if scale <= 0 or scale == 1:
+            return None
+        return (max(1, round(w * scale)), max(1, round(h * scale)))
+    
+    def convert(self, video_frame, dsize):
+        if dsize is not None and dsize != (video_frame.shape[1], video_frame.shape[0]):
+            # Scaled here rather than on every repaint, straight into memory no frame uses anymore.
+            # Proxies go to the same size as full frames, so one swaps for the other in place
+            shape = (dsize[1], dsize[0], video_frame.shape[2])
+            if self.ring is None:
+                self.ring = FrameRing(shape)
+            elif self.ring.shape != shape:
+                self.ring.reshape(shape)
+            interpolation = cv2.INTER_AREA if dsize[0] < video_frame.shape[1] else cv2.INTER_LINEAR
+            video_frame = cv2.resize(video_frame, dsize, dst=self.ring.acquire(), interpolation=interpolation)
+        return to_qimage(video_frame), video_frame
+
+class SidecarBuilder(QThread):
+    # Loads what was saved next to the video, or builds (and saves) it the first time it is opened
+    Ready = pyqtSignal(object)
+    def __init__(self, video_path, sidecar_class):
+        super().__init__()
+        self.video_path = video_path
+        self.sidecar_class = sidecar_class # KeyframeIndex, FrameProxy or FrameStore
+        self.cancelled = False
+    
+    def run(self):
+        sidecar = self.sidecar_class.load(self.video_path)
+        if sidecar is None:
+            sidecar = self.sidecar_class.build(self.video_path, cancelled=lambda: self.cancelled)
+        if sidecar is not None:
+            self.Ready.emit(sidecar)
+    
+    def stop(self):
+        self.cancelled = True
+        self.wait()
 
 class VideoWorker(QObject):
     PreviewImageFrameUpdate = pyqtSignal(QImage) #,QImage,QImage) # frame
     CurrImageFrameUpdate = pyqtSignal(QImage) # frame
     ImageInfoUpdate = pyqtSignal(float, int, int, int, int, int) # fps, curr_frame, min_frame, max_frame, height, width
+    PlaybackStats = pyqtSignal(float, float, int) # achieved fps, target fps, dropped frames
     
-    def __init__(self):
+    def __init__(self, cache_bytes=FRAME_CACHE_BYTES, use_proxy=True, use_store=False):
         super().__init__()
+        # Only runs while playing, decoded frames arrive through FrameDecoder.FrameReady
         self.fpsSync = QTimer()
-        self.prev_fps = 0
-        self.fps = 60
-        self.fpsSync.setInterval((int)(1000 // self.fps))
-        
+        self.fpsSync.setTimerType(Qt.PreciseTimer)
         self.playing = False
-        self.cap = None
+        self.set_fps(60)
+        
+        # Playback follows the wall clock from clock_start, when clock_frame was shown
+        self.clock_start = 0
+        self.clock_frame = 0
+        self.dropped_frames = 0 # Frames skipped since playback started, for being late
+        self.shown_times = deque() # When frames were shown during the last STATS_INTERVAL
+        self.stats_time = 0
+        
+        self.source = None # FrameSource of the loaded video, for what it tells about the frames
+        self.prefetch_frames = PREFETCH_FRAMES
         self.cap_fps = 0
         self.cap_frames = 0
         self.cap_height = 0
         self.cap_width = 0
         self.curr_frame = 0
+        self.shown_frame = None # Frame of curr_img, behind curr_frame until the decoder catches up
+        self.shown_proxy = False # Whether curr_img is only the proxy of shown_frame
+        self.direction = 1 # Prefetch ahead of the playhead, or behind it when stepping back
+        self.decoder = None
+        self.indexer = None
+        self.requested = []
+        self.unreadable = set() # (frame, proxy) pairs the decoder could not read
+        # Downscaled frames stand in while a full one decodes, e.g. while dragging the seeker
+        self.use_proxy = use_proxy
+        self.proxy_builder = None
+        self.proxy_ready = False
+        self.proxy_cache = FrameCache(PROXY_CACHE_BYTES)
+        # Decoded frames kept on disk across sessions, built only when asked for as they take
+        # a lot of space, but used whenever one is already there
+        self.use_store = use_store
+        self.store_builder = None
+        self.video_path = None
+        self.display_size = None
         
         self.curr_img = None
         self.next_img = None
+        # The arrays the images point into, kept alive even once the cache lets go of them
+        self.curr_array = None
+        self.next_array = None
+        # Decoded frames, so stepping back and forth within a segment does not decode again
+        self.frame_cache = FrameCache(cache_bytes)
         
         self.min_frame = 0
         self.max_frame = self.cap_frames
@@ -34,7 +242,6 @@ class VideoWorker(QObject):
         #self.load_video("minigrid.mp4")
         
         self.fpsSync.timeout.connect(self.run)
-        self.fpsSync.start()
     
     def generate_empty_frame(self):
         f = QImage(self.cap_height, self.cap_width, QImage.Format_RGB32)
@@ -42,26 +249,41 @@ class VideoWorker(QObject):
         return f
     
     def run(self):
-        prev_frame = self.curr_frame
-        prev_fps = self.cap_fps
-        prev_min_frame = self.min_frame
-        prev_max_frame = self.max_frame
-        if self.playing:                
-            self.emit_frame(self.curr_frame+1)
-        elif prev_frame != self.curr_frame or prev_fps != self.cap_fps or prev_min_frame != self.min_frame or prev_max_frame != self.max_frame:
-            self.ImageInfoUpdate.emit(self.cap_fps, int(self.curr_frame), int(self.min_frame), int(self.max_frame), self.cap_height, self.cap_width)
+        if self.decoder is not None:
+            self.show_ready_frames()
+        if not self.playing:
+            return
+        # The newest frame that is due and ready is shown, the ones before it are dropped
+        target = self.clock_target()
+        for frame in range(target, int(self.curr_frame), -1):
+            if frame in self.frame_cache or frame in self.proxy_cache or (frame, False) in self.unreadable:
+                self.dropped_frames += frame - int(self.curr_frame) - 1
+                self.emit_frame(frame)
+                self.shown_times.append(time.perf_counter())
+                break
+        if time.perf_counter() - self.stats_time >= STATS_INTERVAL:
+            self.report_playback()
+    
+    def clock_target(self):
+        # The frame due now, never behind the one shown
+        elapsed = time.perf_counter() - self.clock_start
+        target = min(self.max_frame, self.clock_frame + int(elapsed * self.fps))
+        return int(max(self.curr_frame, target))
+    
+    def start_clock(self):
+        self.clock_start = time.perf_counter()
+        self.clock_frame = self.curr_frame
+    
+    def report_playback(self):
+        now = time.perf_counter()
+        while self.shown_times and self.shown_times[0] < now - STATS_INTERVAL:
+            self.shown_times.popleft()
+        self.stats_time = now
+        self.PlaybackStats.emit(len(self.shown_times) / STATS_INTERVAL, float(self.fps), self.dropped_frames)
         
     def emit_frame(self, frame=None):
-        if self.prev_fps != self.fps:
-            self.fpsSync.setInterval((int)(1000 // self.fps))
-            self.prev_fps = self.fps
-             
-        regenAll = False
         if frame is None:
-            regenAll = True
             frame = self.curr_frame+1
-        elif frame != self.curr_frame+1:
-            regenAll = True
             
         if frame > self.max_frame:
             # No need to update if we are at the end of the video
@@ -69,37 +291,120 @@ class VideoWorker(QObject):
         elif frame == self.curr_frame:
             # No need to update if we are at the same frame
             return False
-                
-        # GENERATE NEXT IMG
-        prev_next_img = self.next_img
-        if frame+1 <= self.max_frame:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame + 1)
-            next_ret, next_video_frame = self.cap.read()
-            h, w, ch = next_video_frame.shape
-            next_video_frame = cv2.cvtColor(next_video_frame, cv2.COLOR_BGR2RGB)
-            bytes_per_line = ch * w
-            self.next_img = QImage(next_video_frame.data, w, h, bytes_per_line, QImage.Format_RGB888)
-        else:
-            self.next_img = self.generate_empty_frame()
         
-        # EMIT CURR
+        self.direction = -1 if frame < self.curr_frame else 1
         self.curr_frame = frame
+        self.frame_cache.set_playhead(frame)
+        self.proxy_cache.set_playhead(frame)
+        # A miss is shown as soon as the decoder delivers it (or its proxy), the old image stays up until then
+        decoded = self.frame_cache.get(frame)
+        if decoded is not None:
+            self.show(decoded)
+        if self.decoder is not None:
+            self.show_ready_frames()
+        
+        # EMIT CURR
         self.ImageInfoUpdate.emit(self.cap_fps, int(self.curr_frame), int(self.min_frame), int(self.max_frame), self.cap_height, self.cap_width)
+        print(f"FPS: {self.fps}, Curr Frame: {self.curr_frame}, Min Frame: {self.min_frame},\
+            Max Frame: {self.max_frame} Height: {self.cap_height}, Width: {self.cap_width},\
+            Cache hits: {self.frame_cache.hits}, misses: {self.frame_cache.misses}")
+    
+    def show_ready_frames(self):
+        # Moves what the decoder finished into the cache, then shows it if the playhead needs it
+        for frame, proxy, size, decoded in self.decoder.take_ready():
+            if size != self.display_size:
+                # Scaled for a size the display no longer has
+                continue
+            if decoded is None:
+                self.unreadable.add((frame, proxy))
+            else:
+                cache = self.proxy_cache if proxy else self.frame_cache
+                cache.put(frame, decoded, decoded[1].nbytes)
+        
+        if self.shown_frame != self.curr_frame or self.shown_proxy:
+            decoded = self.frame_cache.peek(self.curr_frame)
+            if decoded is not None:
+                self.show(decoded)
+            elif (self.curr_frame, False) in self.unreadable:
+                # Nothing to wait for, so the last image stays up
+                self.shown_frame = self.curr_frame
+                self.shown_proxy = False
+            elif self.shown_frame != self.curr_frame:
+                decoded = self.proxy_cache.peek(self.curr_frame)
+                if decoded is not None:
+                    self.show(decoded, proxy=True)
         
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.curr_frame)
-        if regenAll:
-            ret, video_frame = self.cap.read()
-            if ret:
-                rgb_image = cv2.cvtColor(video_frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = rgb_image.shape
-                bytes_per_line = ch * w
-                convert_to_qt_format = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
-                self.curr_img = convert_to_qt_format
+        # GENERATE NEXT IMG
+        if self.curr_frame+1 > self.max_frame:
+            if self.next_img is None or self.next_array is not None:
+                self.show_next((self.generate_empty_frame(), None))
         else:
-            self.curr_img = prev_next_img
-        print(f"FPS: {self.fps}, Curr Frame: {self.curr_frame}, Min Frame: {self.min_frame},\
-            Max Frame: {self.max_frame} Height: {self.cap_height}, Width: {self.cap_width}")
+            decoded = self.frame_cache.peek(self.curr_frame+1)
+            if decoded is not None:
+                self.show_next(decoded)
+        self.prefetch()
     
+    def show(self, decoded, proxy=False):
+        self.curr_img, self.curr_array = decoded
+        self.shown_frame = self.curr_frame
+        self.shown_proxy = proxy
+        self.CurrImageFrameUpdate.emit(self.curr_img)
+    
+    def show_next(self, decoded):
+        # Called on every tick, but only a different image is sent on for painting
+        if decoded[0] is not self.next_img:
+            self.next_img, self.next_array = decoded
+            self.PreviewImageFrameUpdate.emit(self.next_img)
+    
+    def set_display_size(self, width, height):
+        # Frames are decoded at the size they are shown at, so a new size starts the caches over
+        if (width, height) == self.display_size:
+            return
+        self.display_size = (width, height)
+        self.frame_cache.clear()
+        self.proxy_cache.clear()
+        self.requested = []
+        # The image on screen is kept (scaled) until the frame arrives at the new size
+        self.shown_proxy = True
+        if self.decoder is not None:
+            self.decoder.set_size(self.display_size)
+            # The timer is stopped while paused, so the playhead frame is asked for at the new size here
+            self.prefetch()
+    
+    def prefetch(self):
+        # The frames the caches are missing from the playhead on, in the order they will be shown.
+        # While playing, frames the clock has passed would only be dropped, so they are skipped
+        first_frame = self.clock_target() if self.playing else int(self.curr_frame)
+        last_frame = self.max_frame if self.direction > 0 else self.min_frame
+        window = range(first_frame, int(last_frame) + self.direction, self.direction)[:self.prefetch_frames+1]
+        missing = [(frame, False) for frame in window if frame not in self.frame_cache and (frame, False) not in self.unreadable]
+        wanted = []
+        if self.proxy_ready:
+            # Faster than real time, full frames could not keep up, so only proxies are shown
+            fast = self.playing and self.fps > self.cap_fps
+            if fast:
+                wanted = [(frame, True) for frame in window]
+                missing = []
+            elif missing[:1] == [(int(self.curr_frame), False)] and self.shown_frame != self.curr_frame:
+                # The proxy is decoded first, to have something to show while the full frame is
+                wanted = [(int(self.curr_frame), True)]
+            wanted = [item for item in wanted if item[0] not in self.proxy_cache and item not in self.unreadable]
+        wanted += missing
+        if wanted != self.requested:
+            self.requested = wanted
+            self.decoder.request(wanted)
+    
+    def set_proxy(self, proxy):
+        # A proxy of a video closed since arrives too late to be of use
+        if proxy.video_path != self.video_path:
+            return
+        self.decoder.set_proxy(proxy)
+        self.proxy_ready = True
+    
+    def set_store(self, store):
+        if store.video_path != self.video_path:
+            return
+        self.decoder.set_store(store)
             
     def get_frame(self):
         return self.curr_img
@@ -108,14 +413,23 @@ class VideoWorker(QObject):
         return self.next_img
     
     def load_video(self, video_path):
-        if self.cap is not None:
-            self.cap.release()
-        self.cap = cv2.VideoCapture(video_path)
-        self.curr_frame = self.cap.get(cv2.CAP_PROP_POS_FRAMES)
-        self.cap_fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.cap_frames = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)-1 # Last frame is empty
-        cap_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        cap_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        if self.source is not None:
+            self.source.release()
+        if self.decoder is not None:
+            self.decoder.stop()
+        if self.indexer is not None:
+            self.indexer.stop()
+        if self.proxy_builder is not None:
+            self.proxy_builder.stop()
+        if self.store_builder is not None:
+            self.store_builder.stop()
+        # A video file, a folder of images or a .npy array
+        self.source = open_source(video_path)
+        self.curr_frame = 0
+        self.cap_fps = self.source.fps
+        self.cap_frames = self.source.frame_count-1 # Last frame is empty
+        cap_height = self.source.height
+        cap_width = self.source.width
         
         if (cap_height < cap_width):
             #Landscape
@@ -125,17 +439,54 @@ class VideoWorker(QObject):
             #Portrait
             cap_width = min(cap_width, 1080)
             cap_height = int(cap_width * (cap_height / cap_width))
-            
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, cap_width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cap_height)
         
         self.cap_height = cap_height
         self.cap_width = cap_width
         
         self.curr_img = None
         self.next_img = None
-        
-        self.fps = self.cap_fps
+        self.curr_array = None
+        self.next_array = None
+        self.frame_cache.clear()
+        self.shown_frame = None
+        self.shown_proxy = False
+        self.requested = []
+        self.unreadable = set()
+        self.proxy_cache.clear()
+        self.proxy_ready = False
+        # Frames are only read on the decoder's thread, from its own source
+        self.decoder = FrameDecoder(video_path)
+        self.decoder.FrameReady.connect(self.show_ready_frames)
+        self.decoder.set_size(self.display_size)
+        self.decoder.start()
+        self.indexer = None
+        self.proxy_builder = None
+        self.store_builder = None
+        if self.source.seek_cost <= 1:
+            # Any frame reads as fast as the next one, so there is little to gain from reading ahead,
+            # and nothing from an index, proxy or store
+            self.prefetch_frames = CHEAP_PREFETCH_FRAMES
+        else:
+            self.prefetch_frames = PREFETCH_FRAMES
+            # Until the index is ready, seeks rely on OpenCV alone
+            self.indexer = SidecarBuilder(video_path, KeyframeIndex)
+            self.indexer.Ready.connect(self.decoder.set_index)
+            self.indexer.start()
+            # Building the proxy takes a full pass over the video, after which it is reused
+            if self.use_proxy:
+                self.proxy_builder = SidecarBuilder(video_path, FrameProxy)
+                self.proxy_builder.Ready.connect(self.set_proxy)
+                self.proxy_builder.start()
+            if self.use_store:
+                self.store_builder = SidecarBuilder(video_path, FrameStore)
+                self.store_builder.Ready.connect(self.set_store)
+                self.store_builder.start()
+            else:
+                store = FrameStore.load(video_path)
+                if store is not None:
+                    self.decoder.set_store(store)
+        
+        self.set_fps(self.cap_fps)
         self.min_frame = float(self.curr_frame) # frame 0 is NOT nothing
         self.max_frame = self.cap_frames
         
@@ -145,14 +496,37 @@ class VideoWorker(QObject):
     
     def play(self):
         self.playing = True
+        self.dropped_frames = 0
+        self.shown_times.clear()
+        self.stats_time = time.perf_counter()
+        self.start_clock()
+        self.fpsSync.start()
         
     def pause(self):
         self.playing = False
+        self.fpsSync.stop()
+        self.report_playback()
+    
+    def set_fps(self, fps):
+        self.fps = fps
+        # Ticks once per frame, the clock decides which frame that is
+        self.fpsSync.setInterval(max(1, int(1000 // fps)) if fps > 0 else 1000)
+        if self.playing:
+            self.start_clock()
           
     def stop(self):
         self.ThreadActive = False
-        self.cap.release()
-        self.quit()
+        self.fpsSync.stop()
+        if self.decoder is not None:
+            self.decoder.stop()
+        if self.indexer is not None:
+            self.indexer.stop()
+        if self.proxy_builder is not None:
+            self.proxy_builder.stop()
+        if self.store_builder is not None:
+            self.store_builder.stop()
+        if self.source is not None:
+            self.source.release()
     
     def set_frame(self, frame, external=False):
         # Prevent async issues
@@ -166,6 +540,9 @@ class VideoWorker(QObject):
             frame = self.min_frame
             
         self.emit_frame(frame)
+        if self.playing:
+            # Playback carries on from the new frame
+            self.start_clock()
         self.ImageInfoUpdate.emit(self.cap_fps, int(self.curr_frame), int(self.min_frame), int(self.max_frame), self.cap_height, self.cap_width)
         
     def change_video_bounds(self,start_frame, end_frame, external=False):
@@ -203,28 +580,26 @@ class VideoContainer(QWidget):
         self.mini_feed = QLabel(self,alignment=Qt.AlignCenter)
         self.mini_feed.setMinimumSize(100, 100)
         
-        self.update_dimensions(self.width(), self.height())
-        
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_image)
-        self.timer.start(1000 // 30)
-        
         # Video Worker that Handles Stream
         self.video_worker = VideoWorker()
-        #self.video_worker_thread = QThread()
-        #self.video_worker.moveToThread(self.video_worker_thread)
-        #self.video_worker_thread.start()
+        # Decoding runs on the worker's own FrameDecoder thread, which has to end before the app
+        QApplication.instance().aboutToQuit.connect(self.video_worker.stop)
+        # Painted only when the worker has a new image, which already fits the feed
+        self.video_worker.CurrImageFrameUpdate.connect(self.update_image)
+        self.video_worker.PreviewImageFrameUpdate.connect(self.update_next_image)
+        
+        self.update_dimensions(self.width(), self.height())
                 
     def update_dimensions(self, width, height):
         self.center_feed.resize(width, height)
         scale = 4
         self.mini_feed.setFixedSize(self.center_feed.width()//scale, self.center_feed.height()//scale)
+        self.video_worker.set_display_size(width, height)
     
     def position_next_frame_label(self):
         self.center_label.move(5, self.height() - self.center_label.height())
         
     def resizeEvent(self, event):
-        self.timer.stop()
         self.update_dimensions(event.size().width(),event.size().height())
         
         
@@ -237,17 +612,15 @@ class VideoContainer(QWidget):
         # top right
         self.mini_feed.move(self.width()-self.mini_feed.width(),0)
         self.mini_label.move(self.mini_feed.pos())
-        self.timer.start()
-        
-    def update_image(self):
-        frame = self.video_worker.get_frame()
-        next_frame = self.video_worker.get_next_frame()
-        if next_frame is not None:
-            self.mini_feed.setPixmap(QPixmap.fromImage(next_frame.scaled(self.mini_feed.width(), self.mini_feed.height(), Qt.KeepAspectRatio, transformMode= Qt.SmoothTransformation)))
-        if frame is not None:
-            self.center_feed.setPixmap(QPixmap.fromImage(frame.scaled(self.center_feed.width(),self.center_feed.height(), Qt.KeepAspectRatio, transformMode= Qt.SmoothTransformation)))
-        self.mini_label.raise_()
+        
+    def update_image(self, frame):
+        # Decoded at the feed's size, so it is painted as is
+        self.center_feed.setPixmap(QPixmap.fromImage(frame))
         self.center_label.raise_()
+    
+    def update_next_image(self, next_frame):
+        self.mini_feed.setPixmap(QPixmap.fromImage(next_frame.scaled(self.mini_feed.width(), self.mini_feed.height(), Qt.KeepAspectRatio, transformMode= Qt.SmoothTransformation)))
+        self.mini_label.raise_()
         
 class VideoControls(QWidget):
     TogglePlay = pyqtSignal(bool)
@@ -317,6 +690,13 @@ class VideoControls(QWidget):
         self.layout.addWidget(self.play_button)
         self.layout.addWidget(self.forward_button)
         self.layout.addWidget(self.fps_select)
+        
+        self.playback_stats = QLabel()
+        self.playback_stats.setStyleSheet(CustomColorTheme.FONT_2)
+        self.layout.addWidget(self.playback_stats)
+    
+    def update_playback_stats(self, achieved_fps, target_fps, dropped_frames):
+        self.playback_stats.setText(f"{achieved_fps:.1f}/{target_fps:.1f} fps, {dropped_frames} dropped")
     
     def reset_zoom(self):
         self.ResetZoom.emit()
@@ -387,6 +767,7 @@ class VideoPlayer(QWidget):
         self.video_controls.BackwardVideo.connect(self.backward_video)
         self.video_controls.ChangeFps.connect(self.change_fps)
         self.video_controls.ResetZoom.connect(self.reset_zoom)
+        self.video_widget.video_worker.PlaybackStats.connect(self.video_controls.update_playback_stats)
     
         self.open_video = OpenVideo()
         self.aspect_ratio = 9/16
@@ -425,20 +806,26 @@ class VideoPlayer(QWidget):
     
     def change_fps(self, fps):
         default_fps = self.video_widget.video_worker.cap_fps
-        self.video_widget.video_worker.fps = fps * default_fps
+        self.video_widget.video_worker.set_fps(fps * default_fps)
     
     def forward_video(self, frames):
         self.video_widget.video_worker.forward(frames)
     
     def backward_video(self, frames):
         self.video_widget.video_worker.backward(frames)
+    
+    def seek_video(self, frame):
+        self.video_widget.video_worker.set_frame(frame)
         
     def load_video_from_file(self):
         # Pause video if playing
         self.video_controls.pause_video()
         # Open File Dialog
-        file_path, _ = QFileDialog.getOpenFileName(self, "Open Video", "", "Video Files (*.mp4 *.avi)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Video", "", "Video Files (*.mp4 *.avi);;Image Sequences (*.png *.jpg *.jpeg *.bmp *.tif *.tiff);;NumPy Arrays (*.npy)")
         if file_path:
+            if file_path.lower().endswith(IMAGE_EXTENSIONS):
+                # Any image of a sequence opens the folder it is in
+                file_path = os.path.dirname(file_path)
             # Load Video
             self.load_video(file_path)
             return True
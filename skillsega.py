@@ -1,4 +1,5 @@
 from collections import deque
+import math
 from pathlib import Path
 import sys
 import uuid
@@ -6,17 +7,18 @@ from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QFrame, QWidget, QMainWindow, QVBoxLayout, QFileDialog, QHBoxLayout
 from PyQt5.QtGui import QIcon, QKeySequence
 from gui.colortheme import CustomColorTheme
-from gui.exceptions import InconsistentType, InvalidFile, NonPythonicName, VideoFileNotFound
-from data_structure.exceptions import OverlappingSkills, ActionHasChildren
+from gui.exceptions import InvalidFile, SaveInProgress, VideoFileNotFound
+from data_structure.exceptions import OverlappingSkills, ActionHasChildren, InvalidIntervals
 from gui.hotkey_bar import HotkeyBar
 from gui.serializer import ProgressDialog, Serializer
 from gui.video_player import VideoPlayer
 from gui.seeker_window import SeekerWindow
 from gui.skill import NaryRangeTreeSkillSegaWrapper, SkillCreator
-from data_structure.skillunit import ActionUnit, SkillUnit
+from data_structure.skillunit import ActionRunUnit, ActionUnit, SkillUnit
 from gui.sidebar import Sidebar
-from data_structure.naryrangetree import NaryRangeTree
+from data_structure.naryrangetree import NaryRangeTree, NaryRangeTreeEvent
 from gui.outputpanel import OutputPanel
+from gui.validation import ValidationIndex
 
 
 class Window(QMainWindow):
@@ -49,6 +51,14 @@ class Window(QMainWindow):
         forward_action.triggered.connect(self.window.video_player.video_controls.forward_video)
         forward_action.setShortcut(QKeySequence("D"))
         
+        prev_boundary_action = hotkey_menu.addAction("Previous Annotation Boundary")
+        prev_boundary_action.triggered.connect(self.window.jump_prev_boundary)
+        prev_boundary_action.setShortcut(QKeySequence("Shift+A"))
+        
+        next_boundary_action = hotkey_menu.addAction("Next Annotation Boundary")
+        next_boundary_action.triggered.connect(self.window.jump_next_boundary)
+        next_boundary_action.setShortcut(QKeySequence("Shift+D"))
+        
         set_start_action = hotkey_menu.addAction("Set Start Frame")
         set_start_action.triggered.connect(self.window.skill_creator.set_start)
         set_start_action.setShortcut(QKeySequence("W"))
@@ -65,6 +75,14 @@ class Window(QMainWindow):
         fill_quick_action.triggered.connect(self.window.skill_creator.emit_fill_action_creation)
         fill_quick_action.setShortcut(QKeySequence("Shift+Q"))
         
+        fill_gaps_action = hotkey_menu.addAction("Fill Uncovered Frames Of Skill")
+        fill_gaps_action.triggered.connect(self.window.skill_creator.emit_fill_gaps)
+        fill_gaps_action.setShortcut(QKeySequence("Shift+F"))
+        
+        delete_run_frame_action = hotkey_menu.addAction("Delete Frame From Quick Action Fill")
+        delete_run_frame_action.triggered.connect(self.window.trigger_delete_run_frame)
+        delete_run_frame_action.setShortcut(QKeySequence("Shift+X"))
+        
         create_action_action = hotkey_menu.addAction("Create Action")
         create_action_action.triggered.connect(self.window.skill_creator.emit_action_creation)
         create_action_action.setShortcut(QKeySequence("F"))
@@ -128,6 +146,8 @@ class Window(QMainWindow):
         hotkey_menu.addAction(toggle_play_action)
         hotkey_menu.addAction(backward_action)
         hotkey_menu.addAction(forward_action)
+        hotkey_menu.addAction(prev_boundary_action)
+        hotkey_menu.addAction(next_boundary_action)
         
         hotkey_menu.addAction(set_start_action)
         hotkey_menu.addAction(set_end_action)
@@ -136,6 +156,7 @@ class Window(QMainWindow):
                 
         hotkey_menu.addAction(quick_action)
         hotkey_menu.addAction(fill_quick_action)
+        hotkey_menu.addAction(fill_gaps_action)
         
         
         hotkey_menu.addAction(quick_zoom_action)
@@ -174,6 +195,7 @@ class SkillSega(QWidget):
         super().__init__()
         
         self.current_file_path = None
+        self.progress_dialog = None
                 
         self.video_player = VideoPlayer()
         self.video_player.ResetZoom.connect(self.zoom_selection)
@@ -192,6 +214,7 @@ class SkillSega(QWidget):
         self.skill_creator.EnterAction.connect(self.trigger_create_action)
         self.skill_creator.EnterQuickAction.connect(self.trigger_quick_action)
         self.skill_creator.EnterFillAction.connect(self.trigger_quick_fill_action)
+        self.skill_creator.EnterFillGaps.connect(self.trigger_fill_gaps)
         
         self.hotkey_bar = HotkeyBar()
         self.hotkey_bar.skill_sidebar.SetName.connect(self.skill_creator.set_skill_name)
@@ -241,93 +264,37 @@ class SkillSega(QWidget):
         self.layout.addWidget(self.sidebar)
         
         self.skills = NaryRangeTreeSkillSegaWrapper(NaryRangeTree())
+        self.validation = ValidationIndex()
+        self.skills.subscribe(self.apply_skill_changes)
         
         # Stacks for undo/redo
         num_actions_saved = 50
         self.undo_stack = deque(maxlen=num_actions_saved)
         self.redo_stack = deque(maxlen=num_actions_saved)        
     
-    def log_action(self, action, dict):
-        # Add action to undo stack and clear redo stack
-        self.undo_stack.append((action, dict))
-        self.redo_stack = deque()
+    def log_action(self, before):
+        # before is the snapshot taken ahead of an edit; edits that failed left the root untouched
+        if before.root is self.skills.root:
+            return
+        self.undo_stack.append(before)
+        self.redo_stack.clear()
         
     def undo(self):
         if len(self.undo_stack) == 0:
             return
-        # pop top element from undo stack
-        last_action, dict = self.undo_stack.pop()
-        
-        # perform the action
-        reverse_action, new_dict = self.reverse_action(last_action, dict)
-        self.parse_action(reverse_action, new_dict)
-        
-        # push element onto redo stack
-        self.redo_stack.append((last_action, dict))
+        # Snapshots share every unchanged node, so keeping the current version costs O(1)
+        self.redo_stack.append(self.skills.snapshot())
+        self.restore_skills(self.undo_stack.pop())
     
     def redo(self):
         if len(self.redo_stack) == 0:
             return
-        # pop the top element of redo stack
-        last_action, dict = self.redo_stack.pop()
-        
-        # perform the action
-        self.parse_action(last_action, dict)
-        
-        # push element onto undo stack
-        self.undo_stack.append((last_action, dict))
+        self.undo_stack.append(self.skills.snapshot())
+        self.restore_skills(self.redo_stack.pop())
     
-    def reverse_action(self, action, dict):
-        if action == "create_skill":
-            return "delete_skill", dict
-        elif action == "delete_skill":
-            return "create_skill", dict
-        if action == "create_action":
-            return "delete_action", dict
-        elif action == "delete_action":
-            return "create_action", dict
-        elif action == "create_quick_fill_action":
-            return "delete_quick_fill_action", dict
-        elif action == "delete_quick_fill_action":
-            return "create_quick_fill_action", dict
-        else:
-            raise Exception("Invalid reverse action", action)
-    
-    def parse_action(self, action, dict):
-        if action == "create_skill":
-            skill_name = dict["skill_name"]
-            skill_uuid = dict["skill_uuid"]
-            start_frame = dict["start_frame"]
-            end_frame = dict["end_frame"]
-            self.create_skill(skill_name, skill_uuid, start_frame, end_frame)
-        elif action == "delete_skill":
-            skill_uuid = dict["skill_uuid"]
-            self.delete_skill(skill_uuid)
-        elif action == "create_action":
-            skill_name = dict["skill_name"]
-            skill_uuid = dict["skill_uuid"]
-            start_frame = dict["start_frame"]
-            end_frame = dict["end_frame"]
-            self.create_action(skill_name, skill_uuid, start_frame, end_frame)
-        elif action == "delete_action":
-            skill_uuid = dict["skill_uuid"]
-            self.delete_skill(skill_uuid)
-        elif action == "create_quick_fill_action":
-            skill_name = dict["skill_name"]
-            skill_uuids = dict["skill_uuids"]
-            start_frame = dict["start_frame"]
-            end_frame = dict["end_frame"]
-            frames = range(start_frame, end_frame+1)
-            for skill_uuid, frame in zip(skill_uuids,frames):
-                self.create_action(skill_name, skill_uuid, frame, frame, noRefresh=True)
-            self.transmit_skills()
-        elif action == "delete_quick_fill_action":
-            skill_uuids = dict["skill_uuids"]
-            for skill_uuid in skill_uuids:
-                self.delete_skill(skill_uuid, noRefresh=True)
-            self.transmit_skills()
-        else:
-            raise Exception("Invalid action", action)
+    def restore_skills(self, snapshot):
+        # Publishes a reset, which rereads the whole tree
+        self.skills.restore(snapshot, self.trigger_delete_skill, self.trigger_delete_action, self.zoom_selection)
     
     def load_video(self):
         loaded_video = self.video_player.load_video_from_file()
@@ -353,16 +320,28 @@ class SkillSega(QWidget):
             except VideoFileNotFound as e:
                 self.outputpanel.update_error(e)
             else:
-                self.outputpanel.clear_error()
-                self.skills.clear()
+                intervals = []
                 for key,value in dict_data.items():
                     if "type" not in value:
                         new_item = SkillUnit(uuid.UUID(key), value["name"], value["start"], value["end"])
+                    elif value["type"] == "action" and value.get("run", False):
+                        new_item = ActionRunUnit(uuid.UUID(key), value["name"], value["start"], value["end"])
                     elif value["type"] == "action":
                         new_item = ActionUnit(uuid.UUID(key), value["name"], value["start"], value["end"])
                     else:
                         new_item = SkillUnit(uuid.UUID(key), value["name"], value["start"], value["end"])
-                    self.skills.insert(new_item,value["start"], value["end"], self.trigger_delete_skill, self.zoom_selection)
+                    intervals.append((new_item, value["start"], value["end"]))
+                
+                # Builds the whole tree in one sorted pass, reporting every invalid entry at once
+                try:
+                    self.skills.load_intervals(intervals, self.trigger_delete_skill, self.trigger_delete_action, self.zoom_selection)
+                except InvalidIntervals as e:
+                    self.outputpanel.update_error(e)
+                    return
+                self.outputpanel.clear_error()
+                # Snapshots of the previous tree would bring its annotations back
+                self.undo_stack.clear()
+                self.redo_stack.clear()
                     
                 self.video_player.load_video(video_path)
                 self.update_window_title(file_path)
@@ -398,38 +377,41 @@ class SkillSega(QWidget):
 
     def save_skills(self, filename):
         if filename:
+            if self.progress_dialog is not None:
+                # Both saves would write to the same temporary file
+                self.outputpanel.update_error(SaveInProgress(filename))
+                return
             video_path = self.video_player.video_widget.video_worker.video_path
             
+            # The serializer gets a frozen snapshot, so edits made while it runs go into the next save
             self.progress_dialog = ProgressDialog(self)
-            self.progress_dialog.save_file(video_path, self.skills, filename)
-            self.progress_dialog.exec_()
+            self.progress_dialog.finished.connect(lambda result: self.save_finished(filename))
+            self.progress_dialog.save_file(video_path, self.skills.snapshot(), filename)
+            self.progress_dialog.show()
+    
+    def save_finished(self, filename):
+        if self.progress_dialog.exception:
+            self.outputpanel.update_error(self.progress_dialog.exception)
+        else:
+            self.outputpanel.clear_error()
+            self.update_window_title(filename)
             
-            if self.progress_dialog.exception:
-                self.outputpanel.update_error(self.progress_dialog.exception)
-            else:
-                self.outputpanel.clear_error()
-                self.update_window_title(filename)
-                
-            self.progress_dialog.deleteLater()
+        self.progress_dialog.deleteLater()
+        self.progress_dialog = None
         
+    def apply_skill_changes(self, events):
+        # Edits only touch the widgets of the nodes they changed; a reset rereads the whole tree
+        if any(event.kind == NaryRangeTreeEvent.RESET for event in events):
+            self.transmit_skills()
+        else:
+            self.sidebar.skill_sidebar.apply_changes(self.skills, events)
+            self.seeker_window.apply_changes(self.skills, events)
+        self.generate_debug(events)
+    
     def transmit_skills(self):
-        unique_uuids = set()
-        error_uuids = set()
-        print("Traversal:")
-        for s in self.skills.traverse():
-            print(s)
-            if s.value.uuid in unique_uuids:
-                error_uuids.add(s.value.uuid)
-            if s.value.uuid not in unique_uuids:
-                unique_uuids.add(s.value.uuid)
-        print("End Traversal")
-        if error_uuids:
-            print("=====================================")
-            print("ERROR:", error_uuids)
-            print("=====================================")
+        # Duplicate uuids are rejected by the tree's uuid index on insert, so no scan is needed here
         self.sidebar.skill_sidebar.update_skills(self.skills)
         self.seeker_window.update_skills(self.skills)
-        self.generate_debug()
     
     def quick_zoom_frame_selection(self):
         curr_frame = self.seeker_window.send_seekerbar_frame()
@@ -444,6 +426,17 @@ class SkillSega(QWidget):
         else:
             self.video_player.reset_zoom()
             
+    def jump_next_boundary(self):
+        # Start or end of the nearest annotation after the playhead
+        boundary = self.skills.next_boundary(self.seeker_window.send_seekerbar_frame())
+        if boundary is not None:
+            self.video_player.seek_video(boundary)
+    
+    def jump_prev_boundary(self):
+        boundary = self.skills.prev_boundary(self.seeker_window.send_seekerbar_frame())
+        if boundary is not None:
+            self.video_player.seek_video(boundary)
+            
     def zoom_frame_selection(self):
         if self.skill_creator.zoom_button.isEnabled():
             start_frame = self.seeker_window.startbar_frame
@@ -454,29 +447,11 @@ class SkillSega(QWidget):
         self.video_player.zoom_selection(start_frame, end_frame)
         self.transmit_skills()
     
-    def generate_debug(self):
-        print("Generating debug")
-        action_names = set()
-        skill_names = set()
-        
-        errors = set()
-        
-        for skill_node in self.skills.traverse():
-            if type(skill_node.value) is ActionUnit:
-                if skill_node.value.name in skill_names:
-                    errors.add(InconsistentType(skill_node.value.name))
-                else:
-                    action_names.add(skill_node.value.name)
-            else:
-                if skill_node.value.name in action_names:
-                    errors.add(InconsistentType(skill_node.value.name))
-                else:
-                    skill_names.add(skill_node.value.name)
-            if not skill_node.value.name.isidentifier():
-                errors.add(NonPythonicName(skill_node.value.name))
-                    
-        print("Errors:", errors)
-        self.outputpanel.update_log(errors)
+    def generate_debug(self, events):
+        # Only the names of inserted and removed nodes are rechecked
+        added, resolved = self.validation.apply_changes(self.skills, events)
+        if added or resolved:
+            self.outputpanel.update_log(added, resolved)
     
     def verify_frames(self, start_frame, end_frame):
         if start_frame > end_frame:
@@ -489,8 +464,9 @@ class SkillSega(QWidget):
         end_frame = frame + 1        
         action_uuid = uuid.uuid4()
 
-        self.create_action(action_name, action_uuid, frame, end_frame, noRefresh=False)
-        self.log_action("create_action", {"skill_name": action_name, "skill_uuid": action_uuid, "start_frame": frame, "end_frame": end_frame})
+        before = self.skills.snapshot()
+        self.create_action(action_name, action_uuid, frame, end_frame)
+        self.log_action(before)
 
     def trigger_quick_fill_action(self, action_name):
         start_frame, end_frame = self.seeker_window.send_skill_frames()
@@ -498,22 +474,36 @@ class SkillSega(QWidget):
         if valid:
             self.seeker_window.clear_bars()
             self.skill_creator.skill_entered()
-            action_uuids = []
             chosen_frames = range(int(start_frame), int(end_frame))
             
             # If we are going to generate no frames, just don't do anything
-            if chosen_frames == []:
+            if len(chosen_frames) == 0:
                 return
             
-            for curr_start_frame in chosen_frames:
-                curr_end_frame = curr_start_frame + 1
-                action_uuid = uuid.uuid4()
-                action_uuids.append(action_uuid)
-                self.create_action(action_name, action_uuid, curr_start_frame, curr_end_frame, noRefresh=True)
-                
-            self.transmit_skills()
-            self.log_action("create_quick_fill_action", {"skill_name": action_name, "skill_uuids": action_uuids, "start_frame": start_frame, "end_frame": end_frame})
+            # One run per stretch of frames that share a parent, rather than one action per frame
+            frame_ranges = self.skills.fill_segments(chosen_frames.start, chosen_frames.stop)
+            action_uuids = [uuid.uuid4() for _ in frame_ranges]
+            before = self.skills.snapshot()
+            # A rejected batch is rolled back, but the rollback still copies the changed path
+            if self.create_quick_fill_action(action_name, action_uuids, frame_ranges):
+                self.log_action(before)
 
+    def trigger_fill_gaps(self, action_name):
+        # Fills every frame of the skill under the playhead that no child covers yet
+        frame = self.seeker_window.send_seekerbar_frame()
+        skill = self.skills.query_value_with_tightest_range_containing(frame, value_type = "skill")
+        if skill.value is None:
+            return
+        
+        # Gaps lie between the skill's children, so each one becomes a single run directly under it
+        frame_ranges = [(math.ceil(start_frame), math.floor(end_frame)) for start_frame, end_frame in self.skills.gaps(skill)]
+        frame_ranges = [(start_frame, end_frame) for start_frame, end_frame in frame_ranges if start_frame < end_frame]
+        if len(frame_ranges) == 0:
+            return
+        action_uuids = [uuid.uuid4() for _ in frame_ranges]
+        before = self.skills.snapshot()
+        if self.create_quick_fill_action(action_name, action_uuids, frame_ranges):
+            self.log_action(before)
     
     def trigger_create_skill(self, skill_name):
         start_frame, end_frame = self.seeker_window.send_skill_frames()
@@ -522,8 +512,9 @@ class SkillSega(QWidget):
             skill_uuid = uuid.uuid4()
             self.seeker_window.clear_bars()
             self.skill_creator.skill_entered()
+            before = self.skills.snapshot()
             self.create_skill(skill_name, skill_uuid, start_frame, end_frame)
-            self.log_action("create_skill", {"skill_name": skill_name, "skill_uuid": skill_uuid, "start_frame": start_frame, "end_frame": end_frame})
+            self.log_action(before)
             
     def trigger_create_action(self, action_name):
         start_frame, end_frame = self.seeker_window.send_skill_frames()
@@ -532,64 +523,91 @@ class SkillSega(QWidget):
             action_uuid = uuid.uuid4()
             self.seeker_window.clear_bars()
             self.skill_creator.skill_entered()
+            before = self.skills.snapshot()
             self.create_action(action_name, action_uuid, start_frame, end_frame)
-            self.log_action("create_action", {"skill_name": action_name, "skill_uuid": action_uuid, "start_frame": start_frame, "end_frame": end_frame})
+            self.log_action(before)
     
-    def create_action(self, action_name, action_uuid, start_frame, end_frame, noRefresh=False):
+    def create_action(self, action_name, action_uuid, start_frame, end_frame):
         print("Creating action", action_name, "from", start_frame, "to", end_frame)
         new_action = ActionUnit(action_uuid, action_name, start_frame, end_frame)
         try:
             self.skills.insert(new_action,start_frame,end_frame, self.trigger_delete_action, self.zoom_selection)
-            if not noRefresh:
-                self.transmit_skills()
         except (OverlappingSkills, ActionHasChildren) as e:
             self.outputpanel.update_error(e)
             
         else:
             self.outputpanel.clear_error()
             
-    def create_skill(self, skill_name, skill_uuid, start_frame, end_frame, noRefresh=False):
+    def create_quick_fill_action(self, action_name, action_uuids, frame_ranges):
+        # Runs of per-frame actions, inserted as one batch with a single refresh
+        intervals = [(ActionRunUnit(action_uuid, action_name, start_frame, end_frame), start_frame, end_frame)
+                     for action_uuid, (start_frame, end_frame) in zip(action_uuids, frame_ranges)]
+        try:
+            self.skills.insert_many(intervals, self.trigger_delete_action, self.zoom_selection)
+        except InvalidIntervals as e:
+            self.outputpanel.update_error(e)
+            return False
+        self.outputpanel.clear_error()
+        return True
+            
+    def create_skill(self, skill_name, skill_uuid, start_frame, end_frame):
         print("Creating skill", skill_name, "from", start_frame, "to", end_frame)
         new_skill = SkillUnit(skill_uuid, skill_name, start_frame, end_frame)
         try:
             self.skills.insert(new_skill,start_frame,end_frame, self.trigger_delete_skill, self.zoom_selection)
-            if not noRefresh:
-                self.transmit_skills()
         except (OverlappingSkills, ActionHasChildren) as e:
             self.outputpanel.update_error(e)
         else:
             self.outputpanel.clear_error()
     
     def delete_all_skills(self):
-        for skill_node in self.skills.traverse():
+        for skill_node in self.skills.iter_nodes():
             uuid = skill_node.value.uuid
             emission = self.skills.skill_emissions[uuid]
             emission.deleteLater()
+        # Clearing publishes a reset, which rereads the (now empty) tree
         self.skills.clear()
-        self.transmit_skills()
     
     def trigger_delete_action(self, uuid):
-        skill_name, start_frame, end_frame = self.delete_skill(uuid)
-        self.log_action("delete_action", {"skill_name": skill_name, "skill_uuid": uuid, "start_frame": start_frame, "end_frame": end_frame})
+        before = self.skills.snapshot()
+        if self.delete_skill(uuid) is not None:
+            self.log_action(before)
     
     
     def trigger_delete_skill(self, uuid):
-        skill_name, start_frame, end_frame = self.delete_skill(uuid)
-        self.log_action("delete_skill", {"skill_name": skill_name, "skill_uuid": uuid, "start_frame": start_frame, "end_frame": end_frame})
+        before = self.skills.snapshot()
+        if self.delete_skill(uuid) is not None:
+            self.log_action(before)
     
-    def delete_skill(self, uuid, noRefresh = False):
+    def delete_skill(self, uuid):
         # for node in self.skills.traverse():
         #     print(node)
-        # Remove skill with uuid: assume first. Should retrieve removed object for proper cleanup
-        lambda_func = lambda x: x.uuid == uuid
-        skill, emission = self.skills.pop(lambda_func)
+        # Remove skill with uuid. Should retrieve removed object for proper cleanup
+        try:
+            skill, emission = self.skills.pop_by_uuid(uuid)
+        except ActionHasChildren as e:
+            # Popping it would leave a single frame at the start of an action; nothing changed
+            self.outputpanel.update_error(e)
+            return None
         skill = skill.value
         #print("Found Deleting skill", skill.uuid, skill.name, skill.frame_start, skill.frame_end)
         emission.deleteLater()
-        if not noRefresh:
-            self.transmit_skills()
         return skill.name, skill.frame_start, skill.frame_end
         
+    def trigger_delete_run_frame(self):
+        frame = int(self.seeker_window.send_seekerbar_frame())
+        run_node = self.skills.query_run_containing(frame)
+        if run_node is None:
+            return
+        run = run_node.value
+        before = self.skills.snapshot()
+        self.delete_run_frame(run.uuid, frame)
+        self.log_action(before)
+    
+    def delete_run_frame(self, run_uuid, frame):
+        emission = self.skills.pop_run_frame(run_uuid, frame, self.trigger_delete_action, self.zoom_selection)
+        emission.deleteLater()
+    
     def transmit_frame_info(self,fps,curr_frame,min_frame,max_frame,width,height):
         self.seeker_window.receive_playback(curr_frame,min_frame,max_frame)
 